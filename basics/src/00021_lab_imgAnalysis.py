@@ -17,7 +17,7 @@ Expected duration: 15-20 minutes
 import os
 import base64
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
 import requests
 from PIL import Image
 from io import BytesIO
@@ -26,7 +26,7 @@ from io import BytesIO
 load_dotenv()
 
 # Initialize the OpenAI client
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 
 
 def encode_image(image_path):
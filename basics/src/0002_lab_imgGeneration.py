@@ -1,14 +1,14 @@
 import os
 import requests
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
 from PIL import Image
 from io import BytesIO
 import matplotlib.pyplot as plt
 import datetime
 
 load_dotenv()
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 
 
 def generate_image(prompt, style="vivid", size="1024x1024", quality="standard"):
@@ -1,13 +1,14 @@
 import os
 
 from dotenv import load_dotenv
-from openai import OpenAI, Stream
+from llm.client import get_openai_client
+from openai import Stream
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from openai.types.chat.chat_completion import ChatCompletion
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 
 
@@ -1,11 +1,11 @@
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
 from openai.types.chat.chat_completion import ChatCompletion
 import os
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 
 
@@ -1,13 +1,13 @@
 import requests
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
 from openai.types.chat.chat_completion import ChatCompletion
 import os
 from openai.types.images_response import ImagesResponse
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 
 
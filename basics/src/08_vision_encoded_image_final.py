@@ -2,15 +2,13 @@ import base64
 import json
 import os
 
-import requests
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import post_chat_completion
 
 load_dotenv()
 
-client = OpenAI()
 LLM = os.environ.get("OPEN_AI_MODEL")
-api_key = os.environ.get("OPENAI_API_KEY")
 
 
 # Function to encode the image
@@ -30,11 +28,9 @@ def ask_openai(
     temperature: float = 1.0,
     top_p: float = 1.0,
     max_tokens: int = 500,
-) -> requests.Response:
+) -> httpx.Response:
     print(f"LLM : {LLM}")
 
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
-
     payload = {
         "model": "gpt-4o-mini",
         "messages": [
@@ -53,9 +49,8 @@ def ask_openai(
         "temperature": temperature,
     }
 
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=payload
-    )
+    # Sent over the shared keep-alive pool (llm/client.py)
+    response = post_chat_completion(payload)
 
     print(f"response  type : {type(response)}")
     return response
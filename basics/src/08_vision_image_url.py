@@ -2,12 +2,12 @@ import base64
 import os
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
 from openai.types.chat.chat_completion import ChatCompletion
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 image_url = "https://drive.google.com/uc?export=view&id=1tCgKNVxDTTivWG4LOHL1DOaaRuptztBH"
 
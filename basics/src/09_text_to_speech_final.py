@@ -1,9 +1,9 @@
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
 from openai._legacy_response import HttpxBinaryResponseContent
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 
 def ask_openai(
     speech_text: str,
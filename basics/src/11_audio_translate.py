@@ -2,12 +2,12 @@ import base64
 import os
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
 from openai.resources.audio.transcriptions import Transcriptions
 from openai.resources.audio.translations import Translation
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 
 # Call the openai chat.completions endpoint
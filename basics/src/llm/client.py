@@ -0,0 +1,133 @@
+"""
+One pooled HTTP client shared by the OpenAI calls of the basics scripts.
+
+Creating ``OpenAI()`` per script, or calling ``requests.post`` for the vision
+endpoint, opens a fresh TCP+TLS connection for every request. Here a single
+``httpx.Client`` per process keeps connections alive between requests and
+is shared by the OpenAI SDK client and by raw chat completion posts.
+HTTP/2 is used when the ``h2`` package is installed (``pip install
+httpx[http2]``); otherwise the pool falls back to HTTP/1.1 keep-alive.
+
+Pool limits, timeouts and prewarming are read from the environment (.env):
+
+    OPENAI_BASE_URL           API root, default https://api.openai.com/v1
+    OPENAI_HTTP2              "0" to force HTTP/1.1
+    OPENAI_MAX_CONNECTIONS    open connections at most (default 10)
+    OPENAI_MAX_KEEPALIVE      idle connections kept open (default 5)
+    OPENAI_KEEPALIVE_EXPIRY   seconds an idle connection is kept (default 60)
+    OPENAI_CONNECT_TIMEOUT    seconds (default 5)
+    OPENAI_TIMEOUT            seconds to wait for a response (default 60)
+    OPENAI_PREWARM            connections opened at startup (default 1, 0 = off)
+    OPENAI_RATE_LIMIT         "0" to turn off the shared RPM/TPM limiter
+    OPENAI_USAGE_LEDGER       "0" to stop recording usage
+
+Every request sent through the pool waits on the shared rate limiter in
+llm/rate_limiter.py first. Failed requests are retried with jittered
+backoff (llm/resilience.py, OPENAI_RETRIES), and the usage and cost of
+every request are recorded in the ledger of llm/usage_ledger.py.
+"""
+
+import importlib.util
+import os
+import threading
+from functools import cache
+
+import httpx
+from dotenv import load_dotenv
+from llm.rate_limiter import RateLimitedTransport, get_rate_limiter
+from llm.resilience import RetryTransport
+from llm.usage_ledger import USAGE_LEDGER, LedgerTransport, get_usage_ledger
+from openai import OpenAI
+
+load_dotenv()
+
+BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+HTTP2 = os.environ.get("OPENAI_HTTP2", "1") != "0"
+MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 10))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE", 5))
+KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 60))
+CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 60))
+PREWARM_CONNECTIONS = int(os.environ.get("OPENAI_PREWARM", 1))
+RATE_LIMIT = os.environ.get("OPENAI_RATE_LIMIT", "1") != "0"
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def prewarm(http_client: httpx.Client, connections: int = 1):
+    """
+    Open ``connections`` pooled connections ahead of the first request, so
+    it doesn't pay for DNS, TCP and TLS setup. Failures are ignored, the
+    real request will report them.
+    """
+
+    def touch():
+        try:
+            http_client.head(BASE_URL)
+        except httpx.HTTPError:
+            pass
+
+    threads = [threading.Thread(target=touch) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@cache
+def get_http_client() -> httpx.Client:
+    """Return this process's keep-alive connection pool, prewarmed in the background."""
+    transport = httpx.HTTPTransport(
+        http2=HTTP2 and http2_available(),
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+    )
+    if USAGE_LEDGER:
+        transport = LedgerTransport(transport, get_usage_ledger())
+    if RATE_LIMIT:
+        # Inside the retries, so every attempt waits for the limiter
+        transport = RateLimitedTransport(transport, get_rate_limiter())
+    # Outermost, so every attempt is recorded in the ledger
+    transport = RetryTransport(transport)
+    http_client = httpx.Client(
+        transport=transport,
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+    if PREWARM_CONNECTIONS > 0:
+        threading.Thread(
+            target=prewarm,
+            args=(http_client, PREWARM_CONNECTIONS),
+            name="openai-prewarm",
+            daemon=True,
+        ).start()
+    return http_client
+
+
+@cache
+def get_openai_client() -> OpenAI:
+    """
+    Return the OpenAI SDK client, sending its requests through the pool.
+
+    SDK retries are off; the pool's RetryTransport (llm/resilience.py)
+    retries the requests instead.
+    """
+    return OpenAI(base_url=BASE_URL, http_client=get_http_client(), max_retries=0)
+
+
+def post_chat_completion(payload: dict) -> httpx.Response:
+    """
+    POST a raw chat completion request body through the pool.
+
+    For callers that build the JSON themselves (e.g. image questions); the
+    response is returned as is, check ``status_code`` before ``json()``.
+    """
+    return get_http_client().post(
+        f"{BASE_URL}/chat/completions",
+        headers={"Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}"},
+        json=payload,
+    )
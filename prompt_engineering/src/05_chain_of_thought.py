@@ -1,23 +1,27 @@
 import os
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
+from llm.response_cache import cached_chat_completion
 from openai.types.chat.chat_completion import ChatCompletion
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 
 
 def ask_openai(
     prompt: str,
 ) -> ChatCompletion:
-    response = client.chat.completions.create(
+    # Deterministic, so reruns are answered from the response cache
+    response = cached_chat_completion(
+        client,
         model=LLM,
         messages=[
             {"role": "user", "content": prompt},
         ],
+        temperature=0,
     )
     return response
 
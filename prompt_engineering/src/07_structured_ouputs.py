@@ -1,12 +1,14 @@
 import os
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
+from llm.prompt_layout import PromptLayout, cache_report, user_turn
+from llm.response_cache import cached_chat_completion
 from openai.types.chat.chat_completion import ChatCompletion
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 
 system_message = """
@@ -48,16 +50,47 @@ Your tasks include:
 """
 
 
+# The instructions are the static prefix of each request (llm/prompt_layout.py);
+# only the text to extract from varies, so it goes last, in the user message
+ORDER_LAYOUT = PromptLayout(
+    name="order",
+    system="""
+    Extract the key information from the text delimited by triple backticks and format it in JSON.
+    I need details like name, order date, product names, quantities, prices, shipping address, and delivery date.
+    """,
+)
+
+FLIGHT_LAYOUT = PromptLayout(
+    name="flight",
+    system=system_message
+    + """
+    Extract the key information from the text delimited by triple backticks and format it in JSON.
+    I need details like name, booking date, flight information (flight number, origin, destination, departure/arrival times), 
+    luggage details, ticket price, and seat number.
+    """,
+)
+
+ARTICLE_LAYOUT = PromptLayout(
+    name="article",
+    system="""
+    Extract the key information from the text delimited by triple backticks and and provide a summary in JSON format.
+    Include details such as the company name, earnings report date, revenue, net income, reasons for growth, future plans, and any warnings.
+    """,
+)
+
+
 def ask_openai(
-    prompt: str,
+    layout: PromptLayout,
+    text: str,
 ) -> ChatCompletion:
-    response = client.chat.completions.create(
-        model=LLM,
-        messages=[
-            # {"role": "system", "content": system_message},
-            {"role": "user", "content": prompt},
-        ],
-    )
+    # Deterministic, so reruns are answered from the response cache
+    with layout.tags():
+        response = cached_chat_completion(
+            client,
+            model=LLM,
+            temperature=0,
+            **layout.request(user_turn(f"Text: ```{text}```")),
+        )
     return response
 
 
@@ -68,15 +101,7 @@ def extract_order_details():
     The order was shipped to 123 Elm Street, Springfield, IL, and was expected to be delivered by September 25, 2024."
     """
 
-    prompt = f"""
-    Extract the key information from the following text delimited by triple backticks and format it in JSON.
-    I need details like name, order date, product names, quantities, prices, shipping address, and delivery date.
-
-    Text: ```{text}```
-   
-
-    """
-    response = ask_openai(prompt=prompt)
+    response = ask_openai(ORDER_LAYOUT, text)
     # Print the Type and Response
     return response
 
@@ -88,16 +113,7 @@ def extract_flight_info():
     Her ticket price was $450.00, and she will be seated in 14A.
     """
 
-    prompt = f"""
-    Extract the key information from the following text delimited by triple backticks and format it in JSON.
-    I need details like name, booking date, flight information (flight number, origin, destination, departure/arrival times), 
-    luggage details, ticket price, and seat number.
-
-    Text: ```{text}```
-   
-
-    """
-    response = ask_openai(prompt=prompt)
+    response = ask_openai(FLIGHT_LAYOUT, text)
     # Print the Type and Response
     return response
 
@@ -112,15 +128,7 @@ def article_summary():
     However, Musk warned that rising material costs could impact future profitability.
     """
 
-    prompt = f"""
-    Extract the key information from the following text delimited by triple backticks and and provide a summary in JSON format.
-    Include details such as the company name, earnings report date, revenue, net income, reasons for growth, future plans, and any warnings.
-
-    Text: ```{text}```
-   
-
-    """
-    response = ask_openai(prompt=prompt)
+    response = ask_openai(ARTICLE_LAYOUT, text)
     # Print the Type and Response
     return response
 
@@ -137,3 +145,5 @@ if __name__ == "__main__":
     # Finance - Article Summary
     # response: ChatCompletion = article_summary()
     # print(f"response  : {response.choices[0].message.content}")
+
+    cache_report()
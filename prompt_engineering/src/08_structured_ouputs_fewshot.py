@@ -1,24 +1,54 @@
 import os
+from functools import cache
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
+from llm.prompt_layout import PromptLayout, cache_report, user_turn
+from llm.response_cache import cached_chat_completion
 from openai.types.chat.chat_completion import ChatCompletion
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 
 
+@cache
+def flight_layout() -> PromptLayout:
+    """
+    Instructions and the few-shot example first, read once so every request
+    starts with the same bytes and hits the prompt cache (llm/prompt_layout.py).
+    """
+    few_shot_example = ""
+    with open("resources/flight-info-fewshot.json", "r") as file:
+        few_shot_example = file.read()
+
+    return PromptLayout(
+        name="flight-fewshot",
+        system=f"""
+    Extract the key information from the text delimited by triple backticks and format it in JSON.
+    I need details like name, booking date, flight information (flight number, origin, destination, departure/arrival times), 
+    luggage details, ticket price, and seat number.
+
+    Here is an example output of the JSON format:\n
+    {few_shot_example}
+    """,
+    )
+
+
 def ask_openai(
-    prompt: str,
+    text: str,
 ) -> ChatCompletion:
-    response = client.chat.completions.create(
-        model=LLM,
-        messages=[
-            {"role": "user", "content": prompt},
-        ],
-    )
+    layout = flight_layout()
+    # Deterministic, so reruns are answered from the response cache
+    with layout.tags():
+        response = cached_chat_completion(
+            client,
+            model=LLM,
+            temperature=0,
+            # The text to extract from is the only variable part, so it goes last
+            **layout.request(user_turn(f"Text: ```{text}```")),
+        )
     return response
 
 
@@ -40,24 +70,7 @@ def extract_flight_info_few_shot():
     # His ticket price was ¥3,200.00, and he will be seated in 22C.
     # """
 
-    few_shot_example = ""
-    with open("resources/flight-info-fewshot.json", "r") as file:
-        few_shot_example = file.read()
-
-    prompt = f"""
-    Extract the key information from the following text delimited by triple backticks and format it in JSON.
-    I need details like name, booking date, flight information (flight number, origin, destination, departure/arrival times), 
-    luggage details, ticket price, and seat number.
-
-    Here is an example output of the JSON format:\n
-    {few_shot_example}
-
-    \n
-
-    Text: ```{text}```
-   
-    """
-    response = ask_openai(prompt=prompt)
+    response = ask_openai(text)
     # Print the Type and Response
     return response
 
@@ -65,3 +78,4 @@ def extract_flight_info_few_shot():
 if __name__ == "__main__":
     response: ChatCompletion = extract_flight_info_few_shot()
     print(f"response  : {response.choices[0].message.content}")
+    cache_report()
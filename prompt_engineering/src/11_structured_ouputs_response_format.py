@@ -1,12 +1,12 @@
 import os
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm.client import get_openai_client
 from openai.types.chat.chat_completion import ChatCompletion
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
 system_message = """
 You are an AI assistant specialized in extracting detailed flight booking information from given text and formatting it into a structured JSON object. 
@@ -5,14 +5,17 @@ from datetime import datetime, timezone
 import requests
 import yfinance as yf
 from dotenv import load_dotenv
+from llm.client import get_openai_client
+from llm.resilience import RETRY_STATUSES, retry_call
 from model.weather_model import OpenMeteoInput
-from openai import OpenAI
 from openai.types.chat.chat_completion import ChatCompletion, ChatCompletionMessage
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
+# Seconds to wait for open-meteo before the attempt is retried
+TIMEOUT = 10
 system_message = """
 You are a helpful assistant!
 """
@@ -31,8 +34,14 @@ def get_current_weather(openMeteoInput: OpenMeteoInput):
         "forecast_days": 1,
     }
 
-    # Make the request
-    response = requests.get(BASE_URL, params=params)
+    def fetch():
+        response = requests.get(BASE_URL, params=params, timeout=TIMEOUT)
+        if response.status_code in RETRY_STATUSES:
+            response.raise_for_status()
+        return response
+
+    # Make the request, retrying timeouts, dropped connections and 5xx/429
+    response = retry_call(fetch, retry_on=(requests.RequestException,))
 
     if response.status_code == 200:
         results = response.json()
@@ -65,8 +74,14 @@ def get_current_time() -> str:
 
 
 def get_current_stock_value(ticker_symbol):
-    ticker = yf.Ticker(ticker_symbol)
-    todays_data = ticker.history(period="1d")
+    def fetch():
+        # yfinance logs network errors and returns no rows instead of raising
+        history = yf.Ticker(ticker_symbol).history(period="1d")
+        if history.empty:
+            raise LookupError(f"No price data for {ticker_symbol}")
+        return history
+
+    todays_data = retry_call(fetch, retry_on=(LookupError, OSError))
     print(todays_data.to_string(index=False))
     return f"The stock price of {ticker_symbol} is,  {todays_data["Close"].iloc[0]}"
 
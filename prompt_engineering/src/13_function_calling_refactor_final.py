@@ -5,14 +5,26 @@ from datetime import datetime, timezone
 import requests
 import yfinance as yf
 from dotenv import load_dotenv
+from llm.client import get_openai_client
+from llm.prompt_layout import (
+    PromptLayout,
+    assistant_turn,
+    cache_report,
+    tool_turn,
+    user_turn,
+)
+from llm.resilience import RETRY_STATUSES, retry_call
 from model.Weather import OpenMeteoInput
-from openai import OpenAI
 from openai.types.chat.chat_completion import ChatCompletion, ChatCompletionMessage
 
 load_dotenv()
 
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 LLM = os.environ.get("OPEN_AI_MODEL")
+# Seconds to wait for open-meteo before the attempt is retried
+TIMEOUT = 10
+# Both calls of a turn go to the same model: the prompt cache is per model
+TOOL_LLM = "gpt-4o"
 system_message = """
 You are a helpful assistant!
 """
@@ -31,8 +43,14 @@ def get_current_weather(openMeteoInput: OpenMeteoInput):
         "forecast_days": 1,
     }
 
-    # Make the request
-    response = requests.get(BASE_URL, params=params)
+    def fetch():
+        response = requests.get(BASE_URL, params=params, timeout=TIMEOUT)
+        if response.status_code in RETRY_STATUSES:
+            response.raise_for_status()
+        return response
+
+    # Make the request, retrying timeouts, dropped connections and 5xx/429
+    response = retry_call(fetch, retry_on=(requests.RequestException,))
 
     if response.status_code == 200:
         results = response.json()
@@ -65,8 +83,14 @@ def get_current_time() -> str:
 
 
 def get_current_stock_value(ticker_symbol):
-    ticker = yf.Ticker(ticker_symbol)
-    todays_data = ticker.history(period="1d")
+    def fetch():
+        # yfinance logs network errors and returns no rows instead of raising
+        history = yf.Ticker(ticker_symbol).history(period="1d")
+        if history.empty:
+            raise LookupError(f"No price data for {ticker_symbol}")
+        return history
+
+    todays_data = retry_call(fetch, retry_on=(LookupError, OSError))
     print(todays_data.to_string(index=False))
     return f"The stock price of {ticker_symbol} is,  {todays_data["Close"].iloc[0]}"
 
@@ -121,46 +145,48 @@ functions = [
 ]
 
 
+# Tool schemas and system prompt: the static prefix of every request here,
+# so the follow-up call reuses the cached prompt of the first one
+# (llm/prompt_layout.py)
+TOOL_LAYOUT = PromptLayout(name="tools", system=system_message, tools=functions)
+
+
 def ask_openai(
     prompt: str,
 ) -> ChatCompletion:
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": prompt},
-        ],
-        tools=functions,
-        tool_choice="auto",
-    )
-    return response
+    with TOOL_LAYOUT.tags():
+        return client.chat.completions.create(
+            model=TOOL_LLM,
+            **TOOL_LAYOUT.request(user_turn(prompt)),
+            tool_choice="auto",
+        )
 
 
 # Send the result back to the model
 
 
-def send_tool_call_response(LLM, user_input, message, tool_name, result, tool_call_id):
-    response = client.chat.completions.create(
-        model=LLM,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": user_input},
-            message,  # The model's tool call
-            {
-                "role": "tool",
-                "name": tool_name,
-                "content": result,
-                "tool_call_id": tool_call_id,  # Include the tool_call_id
-            },
-        ],
-    )
-    return response
+def send_tool_call_response(LLM, user_input, message, result, tool_call_id):
+    with TOOL_LAYOUT.tags():
+        return client.chat.completions.create(
+            model=LLM,
+            # Same prefix as ask_openai, then the question, the model's tool
+            # call and the tool's result
+            **TOOL_LAYOUT.request(
+                user_turn(user_input),
+                assistant_turn(message),
+                tool_turn(tool_call_id, result),
+            ),
+            # The tools stay in the request so the prefix is cached, but the
+            # model has to answer with text now instead of calling again
+            tool_choice="none",
+        )
 
 
 def app():
     while True:
         user_input = input("You: ")
         if user_input == "exit":
+            cache_report()
             break
         response = ask_openai(user_input)
         message: ChatCompletionMessage = response.choices[0].message
@@ -186,7 +212,7 @@ def app():
                 tool_call_id = message.tool_calls[0].id  # Get the tool_call_id
                 # Send the result back to the model
                 second_response = send_tool_call_response(
-                    LLM, user_input, message, tool_name, result, tool_call_id
+                    TOOL_LLM, user_input, message, result, tool_call_id
                 )
                 # Print the model's final response
                 final_message = second_response.choices[0].message.content
@@ -203,7 +229,7 @@ def app():
                 tool_call_id = message.tool_calls[0].id  # Get the tool_call_id
                 # Send the result back to the model
                 second_response = send_tool_call_response(
-                    LLM, user_input, message, tool_name, result, tool_call_id
+                    TOOL_LLM, user_input, message, result, tool_call_id
                 )
                 # Print the model's final response
                 final_message = second_response.choices[0].message.content
@@ -212,7 +238,7 @@ def app():
                 result = get_current_time()
                 tool_call_id = message.tool_calls[0].id  # Get the tool_call_id
                 second_response = send_tool_call_response(
-                    LLM, user_input, message, tool_name, result, tool_call_id
+                    TOOL_LLM, user_input, message, result, tool_call_id
                 )
                 # Print the model's final response
                 final_message = second_response.choices[0].message.content
@@ -0,0 +1,169 @@
+"""
+Throughput of llm/async_engine.py against a local stub of the chat API.
+
+The stub answers each request after ``--latency-ms`` and enforces a rate
+limit of ``--rate`` requests per second, answering 429 with a retry-after-ms
+header when it is exceeded, like the real API. It runs in its own process so
+its threads don't compete with the engine's event loop for the GIL.
+Throughput should grow with the concurrency limit until it reaches the rate
+limit.
+
+Run from prompt_engineering/src:
+    python -m benchmarks.bench_async_engine
+    python -m benchmarks.bench_async_engine --prompts 500 --rate 200
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from llm.async_engine import ChatJob, run_jobs
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.2
+    rate = 100.0
+    lock = threading.Lock()
+    tokens = 0.0
+    refilled = time.monotonic()
+    rejected = 0
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @classmethod
+    def take_token(cls) -> bool:
+        with cls.lock:
+            now = time.monotonic()
+            cls.tokens = min(cls.rate, cls.tokens + (now - cls.refilled) * cls.rate)
+            cls.refilled = now
+            if cls.tokens >= 1:
+                cls.tokens -= 1
+                return True
+            cls.rejected += 1
+            return False
+
+    def reply(self, status: int, body: dict, headers: dict = {}):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/reset":
+            # Full bucket for the next run; returns the 429s of the last one
+            with self.lock:
+                rejected = StubHandler.rejected
+                StubHandler.tokens, StubHandler.rejected = self.rate, 0
+            self.reply(200, {"rejected": rejected})
+            return
+        if not self.take_token():
+            self.reply(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                {"retry-after-ms": "500"},
+            )
+            return
+        time.sleep(self.latency)
+        self.reply(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "Stub answer."},
+                        "finish_reason": "stop",
+                    }
+                ],
+            },
+        )
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, latency: float, rate: float):
+    StubHandler.latency = latency
+    StubHandler.rate = rate
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    port.value = server.server_port
+    server.serve_forever()
+
+
+def reset(url: str) -> int:
+    return httpx.post(f"{url}/reset", json={}).json()["rejected"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--rate", type=float, default=50, help="requests/s")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    args = parser.parse_args()
+
+    port = multiprocessing.Value("i", 0)
+    server = multiprocessing.Process(
+        target=serve, args=(port, args.latency_ms / 1000, args.rate), daemon=True
+    )
+    server.start()
+    while not port.value:
+        time.sleep(0.01)
+    url = f"http://127.0.0.1:{port.value}"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    jobs = [
+        ChatJob(messages=[{"role": "user", "content": f"Question {i}"}])
+        for i in range(args.prompts)
+    ]
+    print(
+        f"{args.prompts} prompts, {args.latency_ms:.0f} ms per request, "
+        f"rate limit {args.rate:.0f}/s"
+    )
+    for concurrency in args.concurrency:
+        if concurrency == 1 and args.prompts * args.latency_ms > 60_000:
+            # Serial baseline on a subset; it scales linearly
+            sample = jobs[:50]
+        else:
+            sample = jobs
+        reset(url)
+        start = time.perf_counter()
+        results = run_jobs(
+            sample,
+            concurrency=concurrency,
+            base_url=f"{url}/v1",
+            max_retries=args.max_retries,
+        )
+        elapsed = time.perf_counter() - start
+        failed = sum(result.error is not None for result in results)
+        print(
+            f"concurrency {concurrency:4d}: {len(sample) / elapsed:7.1f} req/s"
+            f"   {reset(url):4d} 429s   {failed} failed"
+        )
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
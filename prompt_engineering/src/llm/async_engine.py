@@ -0,0 +1,232 @@
+"""
+Run many OpenAI requests concurrently on AsyncOpenAI.
+
+Jobs describe one request each (chat, structured output, image generation
+or audio transcription/translation). The engine runs them on one event loop
+with at most ``concurrency`` requests in flight, gated by a semaphore, over
+a connection pool sized to match. Throughput grows with ``concurrency``
+until the shared RPM/TPM limiter (llm/rate_limiter.py, the same budget
+the scripts and chat apps draw on) makes requests wait, instead of the API
+answering 429; a 429 that gets through anyway is backed off and retried by
+the SDK (``max_retries``).
+
+Results come back in submission order (run_all) or as soon as each job
+finishes (as_completed). A failed job doesn't cancel the others; its
+JobResult carries the exception instead. Synchronous scripts call
+run_jobs():
+
+    results = run_jobs([ChatJob(messages=[{"role": "user", "content": q}])
+                        for q in questions], concurrency=16)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Literal
+
+import httpx
+from dotenv import load_dotenv
+from llm.client import RATE_LIMIT
+from llm.rate_limiter import RateLimitedTransport, get_rate_limiter
+from llm.usage_ledger import USAGE_LEDGER, LedgerTransport, get_usage_ledger
+from openai import AsyncOpenAI
+from pydantic import BaseModel, ConfigDict
+
+load_dotenv()
+
+LLM = os.environ.get("OPEN_AI_MODEL", "gpt-4o-mini")
+
+CONCURRENCY = 8
+
+
+class ChatJob(BaseModel):
+    messages: list[dict]
+    model: str = LLM
+    params: dict = {}  # temperature, max_tokens, tools, ...
+
+
+class StructuredJob(BaseModel):
+    messages: list[dict]
+    response_format: type[BaseModel]
+    model: str = "gpt-4o-2024-08-06"
+    params: dict = {}
+
+
+class ImageJob(BaseModel):
+    prompt: str
+    model: str = "dall-e-3"
+    size: str = "1024x1024"
+    params: dict = {}
+
+
+class AudioJob(BaseModel):
+    path: str
+    task: Literal["transcribe", "translate"] = "transcribe"
+    prompt: str = ""
+    model: str = "whisper-1"
+
+
+Job = ChatJob | StructuredJob | ImageJob | AudioJob
+
+
+class JobResult(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: int  # Position of the job in the submitted list
+    job: Job
+    result: Any = None  # ChatCompletion, ParsedChatCompletion, ImagesResponse, ...
+    error: BaseException | None = None
+    latency: float = 0.0  # Seconds from start of the request to its result
+
+
+class AsyncEngine:
+    def __init__(
+        self,
+        concurrency: int = CONCURRENCY,
+        base_url: str | None = None,
+        max_retries: int = 2,
+    ):
+        self.concurrency = concurrency
+        self.base_url = base_url
+        self.max_retries = max_retries
+
+    def _client(self) -> AsyncOpenAI:
+        # One pool per run: an httpx.AsyncClient belongs to the loop it's used on
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+        )
+        if USAGE_LEDGER:
+            # Usage and cost of every job (llm/usage_ledger.py)
+            transport = LedgerTransport(transport, get_usage_ledger())
+        if RATE_LIMIT:
+            transport = RateLimitedTransport(transport, get_rate_limiter())
+        return AsyncOpenAI(
+            base_url=self.base_url,
+            max_retries=self.max_retries,
+            http_client=httpx.AsyncClient(
+                transport=transport, timeout=httpx.Timeout(60, connect=5)
+            ),
+        )
+
+    async def _request(self, client: AsyncOpenAI, job: Job):
+        if isinstance(job, ChatJob):
+            return await client.chat.completions.create(
+                model=job.model, messages=job.messages, **job.params
+            )
+        if isinstance(job, StructuredJob):
+            return await client.beta.chat.completions.parse(
+                model=job.model,
+                messages=job.messages,
+                response_format=job.response_format,
+                **job.params,
+            )
+        if isinstance(job, ImageJob):
+            return await client.images.generate(
+                model=job.model, prompt=job.prompt, size=job.size, **job.params
+            )
+        audio = (
+            client.audio.transcriptions
+            if job.task == "transcribe"
+            else client.audio.translations
+        )
+        with open(job.path, "rb") as audio_file:
+            return await audio.create(
+                model=job.model, file=audio_file, prompt=job.prompt
+            )
+
+    async def _run_job(
+        self,
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        index: int,
+        job: Job,
+    ) -> JobResult:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await self._request(client, job)
+            except Exception as e:
+                return JobResult(
+                    index=index,
+                    job=job,
+                    error=e,
+                    latency=time.perf_counter() - start,
+                )
+            return JobResult(
+                index=index,
+                job=job,
+                result=result,
+                latency=time.perf_counter() - start,
+            )
+
+    async def as_completed(self, jobs: list[Job]) -> AsyncIterator[JobResult]:
+        """Yield each job's result as soon as it finishes."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._client() as client:
+            tasks = [
+                asyncio.create_task(self._run_job(client, semaphore, index, job))
+                for index, job in enumerate(jobs)
+            ]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield await next_done
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    async def run_all(self, jobs: list[Job]) -> list[JobResult]:
+        """Run every job and return the results in submission order."""
+        results = [None] * len(jobs)
+        async for result in self.as_completed(jobs):
+            results[result.index] = result
+        return results
+
+
+def _run(coroutine):
+    """asyncio.run(), also from a thread that already runs an event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    outcome = {}
+
+    def target():
+        try:
+            outcome["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+def run_jobs(
+    jobs: list[Job],
+    concurrency: int = CONCURRENCY,
+    ordered: bool = True,
+    base_url: str | None = None,
+    max_retries: int = 2,
+) -> list[JobResult]:
+    """
+    Synchronous entry point: run ``jobs`` concurrently and return their
+    results, in submission order or, with ``ordered=False``, in the order
+    they finished.
+    """
+    engine = AsyncEngine(
+        concurrency=concurrency, base_url=base_url, max_retries=max_retries
+    )
+    if ordered:
+        return _run(engine.run_all(jobs))
+
+    async def collect():
+        return [result async for result in engine.as_completed(jobs)]
+
+    return _run(collect())
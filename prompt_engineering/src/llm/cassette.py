@@ -0,0 +1,436 @@
+"""
+Record/replay HTTP cassettes for the OpenAI SDK, requests and yfinance.
+
+Scripts like 12_function_calling_final.py call OpenAI, open-meteo.com and
+Yahoo Finance on every run, which is slow and gives different answers each
+time. A cassette records every HTTP exchange of a run to a JSON file once;
+replaying it answers the same requests from the file, with no network and
+no waiting, so the run is fast and repeatable.
+
+Traffic is captured at the transport level, so scripts need no changes:
+httpx transports (the OpenAI SDK, sync and async; also httpx2, which newer
+SDK releases use instead) and requests' HTTPAdapter (open-meteo, and
+yfinance, which sends its requests through requests) are patched while
+the cassette is in use. Streamed responses are recorded chunk by chunk and
+replayed as the same chunks.
+
+Requests are matched on a normalized key: method, URL with sorted query
+parameters (volatile ones like yfinance's ``crumb`` dropped) and body
+(JSON with sorted keys; the random multipart boundary removed). Headers,
+including the API key, are neither matched nor stored. Identical requests
+replay their recordings in order, the last one repeating. A request with no
+recording raises CassetteMismatchError and is reported when the cassette
+closes; there is no fallback to the network.
+
+Run a script under a cassette from prompt_engineering/src:
+
+    python -m llm.cassette record cassettes/12.json 12_function_calling_final.py
+    python -m llm.cassette replay cassettes/12.json 12_function_calling_final.py
+
+or in code:
+
+    with Cassette("cassettes/12.json", mode="replay"):
+        ...
+"""
+
+import argparse
+import base64
+import hashlib
+import importlib
+import json
+import os
+import re
+import runpy
+import sys
+import threading
+from collections import defaultdict
+from typing import Literal
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+VERSION = 1
+
+# Query parameters that change between runs without changing the answer.
+VOLATILE_PARAMS = {"crumb"}
+
+# Response headers not worth storing, or wrong once the body is replayed
+# from decoded chunks.
+DROPPED_HEADERS = {
+    "date",
+    "content-length",
+    "content-encoding",
+    "transfer-encoding",
+    "connection",
+    "keep-alive",
+}
+
+_BOUNDARY = re.compile(rb"boundary=([^\s;]+)")
+
+# The cassette whose patches are installed, if any.
+_active: "Cassette | None" = None
+
+
+class CassetteMismatchError(Exception):
+    """A request in replay mode that the cassette has no recording for."""
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name not in VOLATILE_PARAMS
+    )
+    return urlunsplit(
+        (parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), "")
+    )
+
+
+def normalize_body(body: bytes, content_type: str) -> bytes:
+    if not body:
+        return b""
+    if "json" in content_type:
+        try:
+            return json.dumps(
+                json.loads(body), sort_keys=True, separators=(",", ":")
+            ).encode()
+        except ValueError:
+            return body
+    match = _BOUNDARY.search(content_type.encode())
+    if match:
+        return body.replace(match.group(1).strip(b'"'), b"BOUNDARY")
+    return body
+
+
+def request_key(method: str, url: str, body: bytes, content_type: str) -> str:
+    digest = hashlib.sha256(normalize_body(body, content_type)).hexdigest()
+    return f"{method.upper()} {normalize_url(url)} {digest[:16]}"
+
+
+def _encode(chunk: bytes) -> dict:
+    try:
+        return {"text": chunk.decode()}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(chunk).decode()}
+
+
+def _decode(chunk: dict) -> bytes:
+    if "text" in chunk:
+        return chunk["text"].encode()
+    return base64.b64decode(chunk["base64"])
+
+
+def _kept_headers(headers) -> dict:
+    return {
+        name.lower(): value
+        for name, value in headers.items()
+        if name.lower() not in DROPPED_HEADERS
+    }
+
+
+def _transport_modules() -> list:
+    """httpx, and httpx2 when installed (newer OpenAI SDKs use it instead)."""
+    modules = [httpx]
+    try:
+        modules.append(importlib.import_module("httpx2"))
+    except ImportError:
+        pass
+    return modules
+
+
+class ReplayStream:
+    """A recorded response body, chunk by chunk, for httpx."""
+
+    def __init__(self, chunks: list[bytes]):
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield from self.chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class RecordingStream:
+    """Pass an httpx response body through, recording it once it's read."""
+
+    def __init__(self, stream, on_complete):
+        self.stream = stream
+        self.chunks = []
+        self.on_complete = on_complete
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.chunks.append(chunk)
+            yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.chunks.append(chunk)
+            yield chunk
+
+    def _complete(self):
+        if self.on_complete is not None:
+            self.on_complete(self.chunks)
+            self.on_complete = None
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._complete()
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self._complete()
+
+
+def _byte_stream(module, base: type) -> type:
+    """``base`` as a byte stream class of ``module`` (httpx or httpx2)."""
+    key = (module.__name__, base)
+    if key not in _STREAM_CLASSES:
+        _STREAM_CLASSES[key] = type(
+            base.__name__, (base, module.SyncByteStream, module.AsyncByteStream), {}
+        )
+    return _STREAM_CLASSES[key]
+
+
+_STREAM_CLASSES: dict[tuple, type] = {}
+
+
+class Cassette:
+    def __init__(self, path: str, mode: Literal["record", "replay"] = "replay"):
+        self.path = path
+        self.mode = mode
+        # key -> recorded interactions, in the order they were made
+        self.interactions: dict[str, list[dict]] = defaultdict(list)
+        self.cursors: dict[str, int] = defaultdict(int)
+        self.unmatched: list[str] = []
+        self._lock = threading.Lock()
+        self._originals = {}
+        if mode == "replay":
+            self.load()
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as file:
+            data = json.load(file)
+        for interaction in data["interactions"]:
+            self.interactions[interaction["key"]].append(interaction)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._lock:
+            interactions = sorted(
+                (i for recorded in self.interactions.values() for i in recorded),
+                key=lambda interaction: interaction["order"],
+            )
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"version": VERSION, "interactions": interactions}, file, indent=1
+            )
+
+    # --- matching and recording ---
+
+    def play(self, method: str, url: str, key: str) -> tuple[int, dict, list[bytes]]:
+        """(status, headers, body chunks) recorded for ``key``."""
+        with self._lock:
+            recorded = self.interactions.get(key)
+            if not recorded:
+                self.unmatched.append(key)
+                endpoint = key.rsplit(" ", 1)[0]
+                same_url = [
+                    k for k in self.interactions if k.rsplit(" ", 1)[0] == endpoint
+                ]
+                message = (
+                    f"No recording in {self.path} for {method} {url} ({key}); "
+                    f"{len(same_url)} recorded with the same URL but another body. "
+                    "Record the cassette again."
+                )
+                print(f"Cassette: {message}", file=sys.stderr)
+                raise CassetteMismatchError(message)
+            position = min(self.cursors[key], len(recorded) - 1)
+            self.cursors[key] += 1
+        response = recorded[position]["response"]
+        return (
+            response["status"],
+            response["headers"],
+            [_decode(chunk) for chunk in response["chunks"]],
+        )
+
+    def record(
+        self, method: str, url: str, key: str, status: int, headers, chunks: list[bytes]
+    ):
+        with self._lock:
+            order = sum(len(recorded) for recorded in self.interactions.values())
+            self.interactions[key].append(
+                {
+                    "order": order,
+                    "key": key,
+                    "request": {"method": method, "url": normalize_url(url)},
+                    "response": {
+                        "status": status,
+                        "headers": _kept_headers(headers),
+                        "chunks": [_encode(chunk) for chunk in chunks if chunk],
+                    },
+                }
+            )
+
+    # --- transports ---
+
+    def _httpx_key(self, request: httpx.Request) -> str:
+        body = request.read()
+        return request_key(
+            request.method,
+            str(request.url),
+            body,
+            request.headers.get("content-type", ""),
+        )
+
+    def _httpx_replay(self, module, request: httpx.Request) -> httpx.Response:
+        status, headers, chunks = self.play(
+            request.method, str(request.url), self._httpx_key(request)
+        )
+        stream = _byte_stream(module, ReplayStream)(chunks)
+        return module.Response(status, headers=headers, stream=stream, request=request)
+
+    def _httpx_recording(
+        self, module, request: httpx.Request, response: httpx.Response
+    ) -> httpx.Response:
+        key = self._httpx_key(request)
+        response.stream = _byte_stream(module, RecordingStream)(
+            response.stream,
+            lambda chunks: self.record(
+                request.method,
+                str(request.url),
+                key,
+                response.status_code,
+                response.headers,
+                chunks,
+            ),
+        )
+        return response
+
+    def _requests_send(self, send, adapter, request, **kwargs):
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        key = request_key(
+            request.method, request.url, body, request.headers.get("Content-Type", "")
+        )
+        if self.mode == "replay":
+            status, headers, chunks = self.play(request.method, request.url, key)
+            response = requests.Response()
+            response.status_code = status
+            response.headers = CaseInsensitiveDict(headers)
+            response._content = b"".join(chunks)
+            response.url = request.url
+            response.request = request
+            response.encoding = requests.utils.get_encoding_from_headers(
+                response.headers
+            )
+            response.reason = "Replayed"
+            return response
+        request.headers["Accept-Encoding"] = "identity"
+        response = send(adapter, request, **kwargs)
+        self.record(
+            request.method,
+            request.url,
+            key,
+            response.status_code,
+            response.headers,
+            [response.content],
+        )
+        return response
+
+    def _patch_httpx(self, module):
+        cassette = self
+        original_sync = module.HTTPTransport.handle_request
+        original_async = module.AsyncHTTPTransport.handle_async_request
+        self._originals[module.HTTPTransport, "handle_request"] = original_sync
+        self._originals[module.AsyncHTTPTransport, "handle_async_request"] = (
+            original_async
+        )
+
+        def handle_request(transport, request):
+            if cassette.mode == "replay":
+                return cassette._httpx_replay(module, request)
+            # Plain bodies keep the cassette readable
+            request.headers["Accept-Encoding"] = "identity"
+            return cassette._httpx_recording(
+                module, request, original_sync(transport, request)
+            )
+
+        async def handle_async_request(transport, request):
+            if cassette.mode == "replay":
+                return cassette._httpx_replay(module, request)
+            request.headers["Accept-Encoding"] = "identity"
+            return cassette._httpx_recording(
+                module, request, await original_async(transport, request)
+            )
+
+        module.HTTPTransport.handle_request = handle_request
+        module.AsyncHTTPTransport.handle_async_request = handle_async_request
+
+    def install(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError(f"Cassette {_active.path} is already in use")
+        _active = self
+        for module in _transport_modules():
+            self._patch_httpx(module)
+        original_send = HTTPAdapter.send
+        self._originals[HTTPAdapter, "send"] = original_send
+
+        def send(adapter, request, **kwargs):
+            return self._requests_send(original_send, adapter, request, **kwargs)
+
+        HTTPAdapter.send = send
+
+    def uninstall(self):
+        global _active
+        for (owner, name), original in self._originals.items():
+            setattr(owner, name, original)
+        self._originals = {}
+        _active = None
+
+    def __enter__(self) -> "Cassette":
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+        if self.mode == "record":
+            self.save()
+        if self.unmatched:
+            print(
+                f"Cassette: {len(self.unmatched)} request(s) had no recording in "
+                f"{self.path}",
+                file=sys.stderr,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("cassette", help="cassette file (JSON)")
+    parser.add_argument("script", help="script to run under the cassette")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    sys.argv = [args.script, *args.args]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    with Cassette(args.cassette, mode=args.mode) as cassette:
+        runpy.run_path(args.script, run_name="__main__")
+    # Scripts may swallow the error; the exit status still reports it
+    sys.exit(1 if cassette.unmatched else 0)
+
+
+if __name__ == "__main__":
+    main()
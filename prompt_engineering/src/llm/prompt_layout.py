@@ -0,0 +1,130 @@
+"""
+Request layout that keeps prompts friendly to OpenAI's prompt caching.
+
+OpenAI caches the longest previously seen prefix of a request (tools, then
+messages, in 128-token steps once the prompt is 1024 tokens or longer) and
+bills cached tokens at a discount with lower latency. A prefix only matches
+if it is byte-for-byte identical, so everything that stays the same between
+calls has to come first and everything that changes last.
+
+A PromptLayout holds the static part of a family of requests: the system
+prompt, few-shot example turns and tool schemas, serialized once. Its
+messages() puts the variable turns (the user's text, tool call results)
+after that prefix, always in the same shape:
+
+    FLIGHTS = PromptLayout(system=INSTRUCTIONS, examples=[...], tools=TOOLS)
+    with FLIGHTS.tags():
+        response = client.chat.completions.create(
+            model=LLM, **FLIGHTS.request({"role": "user", "content": text})
+        )
+
+Calls made inside tags() are recorded in the usage ledger
+(llm/usage_ledger.py) under the layout's name, with their prompt tokens and
+how many of them (``usage.prompt_tokens_details.cached_tokens``) were
+served from the cache; cache_report() prints the hit ratio per layout for
+the calls of this run.
+"""
+
+import hashlib
+import json
+import time
+
+from llm.usage_ledger import get_usage_ledger, usage_tags
+from openai.types.chat.chat_completion import ChatCompletionMessage
+
+# Start of this run; cache_report() covers the ledger rows since
+_STARTED = time.time()
+_layout_names: set[str] = set()
+
+
+def _canonical(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+class PromptLayout:
+    def __init__(
+        self,
+        system: str,
+        examples: list[dict] | None = None,
+        tools: list[dict] | None = None,
+        name: str | None = None,
+    ):
+        # Frozen as JSON so nothing can change the prefix between calls
+        self._prefix = _canonical(
+            [{"role": "system", "content": system}, *(examples or [])]
+        )
+        self._tools = _canonical(tools) if tools else None
+        self.key = hashlib.sha256(
+            f"{self._tools}\n{self._prefix}".encode()
+        ).hexdigest()[:12]
+        self.name = name or self.key
+        _layout_names.add(self.name)
+
+    def messages(self, *turns: dict) -> list[dict]:
+        """The static prefix followed by ``turns``, the variable messages."""
+        return [*json.loads(self._prefix), *turns]
+
+    def request(self, *turns: dict) -> dict:
+        """``messages`` (and ``tools``) for client.chat.completions.create."""
+        request = {"messages": self.messages(*turns)}
+        if self._tools is not None:
+            request["tools"] = json.loads(self._tools)
+        return request
+
+    def tags(self):
+        """Record the calls made inside the block under this layout's name."""
+        return usage_tags(feature=self.name)
+
+
+def user_turn(content: str) -> dict:
+    return {"role": "user", "content": content}
+
+
+def assistant_turn(message: ChatCompletionMessage) -> dict:
+    """A model reply (e.g. its tool calls) as a plain message, in a fixed shape."""
+    turn = {"role": "assistant", "content": message.content}
+    if message.tool_calls:
+        turn["tool_calls"] = [
+            {
+                "id": call.id,
+                "type": "function",
+                "function": {
+                    "name": call.function.name,
+                    "arguments": call.function.arguments,
+                },
+            }
+            for call in message.tool_calls
+        ]
+    return turn
+
+
+def tool_turn(tool_call_id: str, content: str) -> dict:
+    return {"role": "tool", "tool_call_id": tool_call_id, "content": content}
+
+
+def cache_stats() -> dict[str, dict]:
+    """Calls, prompt tokens, cached tokens and hit ratio per layout."""
+    stats: dict[str, dict] = {}
+    for row in get_usage_ledger().totals(since=_STARTED):
+        if row["feature"] not in _layout_names:
+            continue
+        stats[row["feature"]] = {
+            "calls": row["calls"],
+            "prompt_tokens": row["prompt_tokens"],
+            "cached_tokens": row["cached_tokens"],
+            "hit_ratio": (
+                row["cached_tokens"] / row["prompt_tokens"]
+                if row["prompt_tokens"]
+                else 0.0
+            ),
+        }
+    return stats
+
+
+def cache_report():
+    for layout, entry in cache_stats().items():
+        print(
+            f"prompt cache [{layout}]: {entry['calls']} calls, "
+            f"{entry['cached_tokens']}/{entry['prompt_tokens']} prompt tokens "
+            f"cached ({entry['hit_ratio']:.0%})"
+        )
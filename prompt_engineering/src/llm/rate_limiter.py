@@ -0,0 +1,310 @@
+"""
+Client-side requests-per-minute / tokens-per-minute limiter for the prompt
+scripts and the AsyncEngine.
+
+The same token buckets the chat apps keep (streamlit-chat-ui/src/llm/
+rate_limiter.py): two per model, refilled continuously at RPM/60 and TPM/60
+per second and holding at most a minute's worth, in a ``buckets`` table
+updated under BEGIN IMMEDIATE. Scripts and apps given the same
+OPENAI_RATE_LIMIT_DB therefore share one budget for the API key.
+
+Before a request is sent its token cost is estimated (prompt tokens +
+max_tokens) and taken from both buckets; if either is short the caller
+sleeps until enough has refilled instead of getting a 429. When the
+response body closes the estimate is corrected from its ``usage``.
+RateLimitedTransport applies this to every request of the pool in
+llm/client.py and, awaiting instead of sleeping, of the AsyncEngine's.
+
+    OPENAI_RPM                 requests per minute per model (default 500)
+    OPENAI_TPM                 tokens per minute per model (default 30000)
+    OPENAI_RATE_LIMIT_DB       default rate_limits.db
+    OPENAI_RATE_LIMIT_MAX_WAIT seconds to wait before sending anyway (default 60)
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import cache
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RPM = float(os.environ.get("OPENAI_RPM", 500))
+TPM = float(os.environ.get("OPENAI_TPM", 30_000))
+LIMITER_DB = os.environ.get("OPENAI_RATE_LIMIT_DB", "rate_limits.db")
+MAX_WAIT = float(os.environ.get("OPENAI_RATE_LIMIT_MAX_WAIT", 60))
+
+# Completion tokens reserved when a request doesn't set max_tokens.
+COMPLETION_ESTIMATE = 256
+
+# Tokens counted for an image part (a high-detail 1024x1024 image).
+IMAGE_TOKENS = 765
+
+# Overhead tokens per chat message (role, separators).
+MESSAGE_TOKENS = 4
+
+# Longest single sleep, so a refund from another process is noticed quickly.
+MAX_SLEEP = 1.0
+
+# The response tail that usage is looked for in.
+USAGE_TAIL = 8192
+
+_TOTAL_TOKENS = re.compile(rb'"total_tokens":\s*(\d+)')
+
+
+def _text_tokens(text: str) -> int:
+    # About four characters per token for English text
+    return math.ceil(len(text) / 4)
+
+
+def estimate_tokens(body: dict) -> int:
+    """Estimate what a request counts against TPM: input plus max output."""
+    tokens = 0
+    for message in body.get("messages") or []:
+        tokens += MESSAGE_TOKENS
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += _text_tokens(content)
+        for part in content if isinstance(content, list) else []:
+            if part.get("type") == "text":
+                tokens += _text_tokens(part.get("text", ""))
+            else:
+                tokens += IMAGE_TOKENS
+    for tool in body.get("tools") or []:
+        tokens += _text_tokens(json.dumps(tool))
+    if "messages" in body:
+        tokens += (
+            body.get("max_completion_tokens")
+            or body.get("max_tokens")
+            or COMPLETION_ESTIMATE
+        )
+    return tokens
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        db_path: str = LIMITER_DB,
+        rpm: float = RPM,
+        tpm: float = TPM,
+        max_wait: float = MAX_WAIT,
+    ):
+        self.limits = {"requests": rpm, "tokens": tpm}
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        # The apps' migration 1 creates the same table
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """
+        )
+
+    def _update(self, model: str, change):
+        """
+        Refill ``model``'s buckets, let ``change(levels)`` adjust them and
+        save them; returns what ``change`` returned.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                levels = {}
+                for kind, limit in self.limits.items():
+                    row = self._conn.execute(
+                        "SELECT level, updated_at FROM buckets WHERE key=?",
+                        (f"{kind}:{model}",),
+                    ).fetchone()
+                    levels[kind] = (
+                        limit
+                        if row is None
+                        else min(limit, row[0] + (now - row[1]) * limit / 60)
+                    )
+                result = change(levels)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, level, updated_at) "
+                    "VALUES (?,?,?)",
+                    [
+                        (f"{kind}:{model}", level, now)
+                        for kind, level in levels.items()
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _try_take(self, model: str, cost: dict[str, float], force: bool) -> float:
+        """Take ``cost`` if available (or regardless, with ``force``); else
+        return the seconds until it will be."""
+
+        def take(levels):
+            wait = max(
+                (cost[kind] - levels[kind]) * 60 / self.limits[kind]
+                for kind in self.limits
+            )
+            if wait <= 0 or force:
+                for kind in self.limits:
+                    levels[kind] -= cost[kind]
+            return 0.0 if force else wait
+
+        return self._update(model, take)
+
+    def _waits(self, model: str, tokens: int):
+        """The sleeps until one request and ``tokens`` tokens are taken."""
+        # A request bigger than a whole bucket goes once the bucket is full
+        cost = {"requests": 1, "tokens": min(tokens, self.limits["tokens"])}
+        deadline = time.monotonic() + self.max_wait
+        while (wait := self._try_take(model, cost, force=False)) > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"Rate limiter: waited {self.max_wait}s for {model}, sending")
+                self._try_take(model, cost, force=True)
+                return
+            yield min(wait, remaining, MAX_SLEEP)
+
+    def acquire(self, model: str, tokens: int):
+        """Block until one request and ``tokens`` tokens are available."""
+        for wait in self._waits(model, tokens):
+            time.sleep(wait)
+
+    async def acquire_async(self, model: str, tokens: int):
+        """acquire() that awaits instead of blocking the event loop."""
+        for wait in self._waits(model, tokens):
+            await asyncio.sleep(wait)
+
+    def settle(self, model: str, estimated: int, actual: int):
+        """Give back (or take more of) the tokens a request was estimated at."""
+        if estimated == actual:
+            return
+
+        def correct(levels):
+            levels["tokens"] = min(
+                self.limits["tokens"], levels["tokens"] + estimated - actual
+            )
+
+        self._update(model, correct)
+
+
+class UsageStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Pass a response body through and settle its tokens when it closes."""
+
+    def __init__(
+        self, stream, limiter: RateLimiter, model: str, estimated: int, status: int
+    ):
+        self.stream = stream
+        self.limiter = limiter
+        self.model = model
+        self.estimated = estimated
+        self.status = status
+        self.tail = b""
+        self.settled = False
+
+    def _feed(self, chunk: bytes) -> bytes:
+        self.tail = (self.tail + chunk)[-USAGE_TAIL:]
+        return chunk
+
+    def __iter__(self):
+        for chunk in self.stream:
+            yield self._feed(chunk)
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield self._feed(chunk)
+
+    def _settle(self):
+        if self.settled:
+            return
+        self.settled = True
+        match = _TOTAL_TOKENS.search(self.tail)
+        if self.status >= 400:
+            # Rejected requests don't use tokens
+            actual = 0
+        else:
+            actual = int(match.group(1)) if match else self.estimated
+        self.limiter.settle(self.model, self.estimated, actual)
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._settle()
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self._settle()
+
+
+class RateLimitedTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    httpx transport (sync or async, after the transport it wraps) that runs
+    every JSON POST through a RateLimiter.
+    """
+
+    def __init__(self, transport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    def _cost(self, request: httpx.Request) -> tuple[str, int | None]:
+        """The model and estimated tokens; None for tokens if not counted."""
+        if request.method == "POST" and request.headers.get(
+            "content-type", ""
+        ).startswith("application/json"):
+            body = json.loads(request.content or b"{}")
+            return body.get("model", "default"), estimate_tokens(body)
+        # Uploads (audio) and other calls: one request, tokens unknown
+        return "default", None
+
+    def _wrap(self, response: httpx.Response, model: str, tokens: int | None):
+        if tokens is None:
+            return response
+        response.stream = UsageStream(
+            response.stream,
+            self.limiter,
+            model,
+            min(tokens, self.limiter.limits["tokens"]),
+            response.status_code,
+        )
+        return response
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        model, tokens = self._cost(request)
+        self.limiter.acquire(model, tokens or 0)
+        return self._wrap(self.transport.handle_request(request), model, tokens)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        model, tokens = self._cost(request)
+        await self.limiter.acquire_async(model, tokens or 0)
+        response = await self.transport.handle_async_request(request)
+        return self._wrap(response, model, tokens)
+
+    def close(self):
+        self.transport.close()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+@cache
+def get_rate_limiter() -> RateLimiter:
+    """Return this process's handle on the shared rate limits."""
+    return RateLimiter()
@@ -0,0 +1,115 @@
+"""
+Retries with jittered backoff for the HTTP calls of the prompt scripts.
+
+A request is retried only when trying again can help: connection failures
+and timeouts, and 408/409/429/5xx answers (a 429 for exhausted quota is
+not retried). The wait before retry n is drawn uniformly from
+[0, min(backoff_max, backoff_base * 2**n)] ("full jitter"), so scripts that
+failed together don't come back together, and is never shorter than the
+server's retry-after header.
+
+RetryTransport does this for every request sent through the pool in
+llm/client.py, so each ask_openai helper is covered without changes; the
+SDK client is created with ``max_retries=0`` so this is the only layer
+retrying. Only the start of a response is retried: a stream that fails
+halfway is raised to the caller. retry_call() applies the same policy to
+other calls, such as the open-meteo and Yahoo Finance lookups in
+tools/tools.py.
+
+    OPENAI_RETRIES            retries after the first attempt (default 3)
+    OPENAI_BACKOFF_BASE       seconds, first retry waits up to this (default 0.5)
+    OPENAI_BACKOFF_MAX        seconds, longest wait between attempts (default 20)
+"""
+
+import os
+import random
+import time
+from typing import Callable
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RETRIES = int(os.environ.get("OPENAI_RETRIES", 3))
+BACKOFF_BASE = float(os.environ.get("OPENAI_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.environ.get("OPENAI_BACKOFF_MAX", 20))
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def retry_after(headers) -> float:
+    """Seconds the server asked to wait (retry-after-ms / retry-after), or 0."""
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after", 0))
+    except ValueError:
+        # retry-after may also be an HTTP date; fall back to our own backoff
+        return 0.0
+
+
+def backoff_delay(
+    attempt: int,
+    base: float = BACKOFF_BASE,
+    cap: float = BACKOFF_MAX,
+    server_delay: float = 0.0,
+) -> float:
+    """Full-jitter exponential backoff before retry number ``attempt`` (0-based)."""
+    return max(server_delay, random.uniform(0, min(cap, base * 2**attempt)))
+
+
+def _quota_exhausted(response: httpx.Response) -> bool:
+    if response.status_code != 429:
+        return False
+    response.read()
+    return b"insufficient_quota" in response.content
+
+
+class RetryTransport(httpx.BaseTransport):
+    """httpx transport that retries failed requests with jittered backoff."""
+
+    def __init__(self, transport: httpx.BaseTransport, retries: int = RETRIES):
+        self.transport = transport
+        self.retries = retries
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        # Buffer the body (uploads included) so every attempt can send it
+        request.read()
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            if (
+                attempt >= self.retries
+                or response.status_code not in RETRY_STATUSES
+                or _quota_exhausted(response)
+            ):
+                return response
+            delay = backoff_delay(attempt, server_delay=retry_after(response.headers))
+            response.close()
+            time.sleep(delay)
+
+    def close(self):
+        self.transport.close()
+
+
+def retry_call(
+    fn: Callable,
+    *args,
+    retry_on: tuple[type[BaseException], ...] = (OSError,),
+    retries: int = RETRIES,
+    **kwargs,
+):
+    """``fn(*args, **kwargs)``, retried with backoff while it raises ``retry_on``."""
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except retry_on:
+            if attempt >= retries:
+                raise
+            time.sleep(backoff_delay(attempt))
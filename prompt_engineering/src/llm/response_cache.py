@@ -0,0 +1,212 @@
+"""
+Exact-match cache in front of ``client.chat.completions.create``.
+
+The scripts send the same deterministic prompts (temperature 0, identical
+messages) on every run. A request is keyed on everything that shapes the
+answer: model, messages, tools, response_format and the sampling
+parameters; only temperature-0 requests are cached, since caching a
+temperature 1 request would replace fresh samples with one stored answer.
+Answers that were cut off (``finish_reason="length"``) are not stored.
+
+Answers are kept in two tiers: an in-memory LRU in front of a SQLite table
+that outlives the process, each entry expiring after ``ttl`` seconds.
+
+    response = cached_chat_completion(
+        client, model=LLM, messages=messages, temperature=0
+    )
+
+Configured from the environment (.env):
+
+    OPENAI_CACHE_DB            cache database, default response_cache.db
+    OPENAI_CACHE_TTL           seconds an answer is reused (default 86400)
+    OPENAI_CACHE_MAX_ENTRIES   answers kept in memory (default 512)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import cache
+from typing import Callable
+
+from dotenv import load_dotenv
+from openai import OpenAI
+from openai.types.chat.chat_completion import ChatCompletion
+
+load_dotenv()
+
+CACHE_DB = os.environ.get("OPENAI_CACHE_DB", "response_cache.db")
+TTL = float(os.environ.get("OPENAI_CACHE_TTL", 24 * 60 * 60))
+MAX_ENTRIES = int(os.environ.get("OPENAI_CACHE_MAX_ENTRIES", 512))
+
+# Request arguments that change the answer. Anything else (timeout,
+# extra_headers, ...) only changes how it arrives.
+KEY_FIELDS = (
+    "model",
+    "messages",
+    "tools",
+    "tool_choice",
+    "parallel_tool_calls",
+    "functions",
+    "function_call",
+    "response_format",
+    "temperature",
+    "top_p",
+    "max_tokens",
+    "max_completion_tokens",
+    "presence_penalty",
+    "frequency_penalty",
+    "logit_bias",
+    "stop",
+    "seed",
+    "n",
+)
+
+# Finish reasons of a complete answer; "length" and "content_filter" are not.
+COMPLETE_FINISH_REASONS = ("stop", "tool_calls")
+
+
+def _json_default(value):
+    # pydantic models (messages, response_format classes) and other SDK types
+    if hasattr(value, "model_json_schema"):
+        return value.model_json_schema()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return str(value)
+
+
+def cache_key(request: dict) -> str:
+    """SHA-256 of the canonical JSON of the answer-shaping request fields."""
+    fields = {name: request[name] for name in KEY_FIELDS if name in request}
+    canonical = json.dumps(
+        fields, sort_keys=True, separators=(",", ":"), default=_json_default
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def is_cacheable(request: dict) -> bool:
+    # Streams are passed through; the scripts read whole answers
+    if request.get("stream") or request.get("n", 1) != 1:
+        return False
+    return request.get("temperature", 1) == 0
+
+
+class ResponseCache:
+    def __init__(
+        self, db_path: str = CACHE_DB, max_entries: int = MAX_ENTRIES, ttl: float = TTL
+    ):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (response dict, expires_at)
+        self._memory: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "stores": 0,
+            "bypassed": 0,
+        }
+        # One connection, used under the lock (AsyncEngine runs jobs on threads)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """
+            )
+
+    def _remember(self, key: str, response: dict, expires_at: float):
+        self._memory[key] = (response, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> dict | None:
+        """Look ``key`` up in memory, then on disk; None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM responses WHERE key=?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            if row[1] <= now:
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            response = json.loads(row[0])
+            self._remember(key, response, row[1])
+            self._stats["disk_hits"] += 1
+            return response
+
+    def put(self, key: str, response: dict):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, response, expires_at)
+            self._stats["stores"] += 1
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO responses
+                        (key, response, created_at, expires_at)
+                    VALUES (?,?,?,?)
+                    """,
+                    (key, json.dumps(response), now, expires_at),
+                )
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
+
+    def create(self, create: Callable, **request) -> ChatCompletion:
+        """Call ``create(**request)`` unless the answer is cached."""
+        if not is_cacheable(request):
+            with self._lock:
+                self._stats["bypassed"] += 1
+            return create(**request)
+        key = cache_key(request)
+        response = self.get(key)
+        if response is not None:
+            return ChatCompletion.model_validate(response)
+        completion = create(**request)
+        if completion.choices[0].finish_reason in COMPLETE_FINISH_REASONS:
+            self.put(key, completion.model_dump(mode="json"))
+        return completion
+
+
+@cache
+def get_response_cache() -> ResponseCache:
+    """Return this process's response cache."""
+    return ResponseCache()
+
+
+def cached_chat_completion(client: OpenAI, **request) -> ChatCompletion:
+    """``client.chat.completions.create(**request)`` through the response cache."""
+    return get_response_cache().create(client.chat.completions.create, **request)
@@ -0,0 +1,374 @@
+"""
+Token usage and cost ledger for every OpenAI call of the scripts.
+
+A thin writer for the chat apps' ledger (streamlit-chat-ui/src/llm/
+usage_ledger.py): LedgerTransport sits in the shared pool (llm/client.py,
+and the AsyncEngine's pool) and appends one row per call to the same
+``usage`` table when its response body is closed: endpoint, model,
+feature, status, prompt/completion/cached tokens, latency and cost.
+Answers served by the response cache never reach the pool and are not
+billed, so they are not recorded.
+
+The apps' ledger owns the rollup tables, the triggers feeding them and
+the reports. Scripts make a call or a small batch at a time, so this side
+keeps no rollups and no writer thread: each row is one autocommit INSERT.
+Point OPENAI_USAGE_DB at the apps' usage.db to report together; the apps
+fold rows already in a database into their rollups when they first open
+it.
+
+The feature defaults to the running script's name; usage_tags() around a
+call overrides it (prompt_layout.py tags calls with their layout):
+
+    with usage_tags(feature="flights"):
+        response = client.chat.completions.create(...)
+
+    OPENAI_USAGE_DB       default usage.db
+    OPENAI_USAGE_LEDGER   "0" to stop recording
+
+For a report, run the apps' ledger on this database from
+streamlit-chat-ui/src:
+    python -m llm.usage_ledger day --db ../../prompt_engineering/src/usage.db
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+USAGE_DB = os.environ.get("OPENAI_USAGE_DB", "usage.db")
+USAGE_LEDGER = os.environ.get("OPENAI_USAGE_LEDGER", "1") != "0"
+
+# USD per million tokens: (input, cached input, output).
+TOKEN_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4o-transcribe": (2.50, 2.50, 10.00),
+    "gpt-4o-mini-transcribe": (1.25, 1.25, 5.00),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.13, 0.0),
+}
+# USD per image (standard quality, 1024x1024).
+IMAGE_PRICES = {"dall-e-3": 0.04, "dall-e-2": 0.02}
+# USD per million input characters (text to speech).
+SPEECH_PRICES = {"tts-1": 15.0, "tts-1-hd": 30.0}
+# USD per minute of transcribed audio.
+AUDIO_MINUTE_PRICES = {"whisper-1": 0.006}
+
+# Bytes of the response kept to find the model (head) and usage (tail).
+HEAD_BYTES = 2048
+TAIL_BYTES = 8192
+
+_MODEL = re.compile(rb'"model":\s*"([^"]+)"')
+_FORM_MODEL = re.compile(rb'name="model"\r\n\r\n([^\r]+)')
+_COUNTS = {
+    name: re.compile(rb'"%s":\s*(\d+)' % name.encode())
+    for name in (
+        "prompt_tokens",
+        "completion_tokens",
+        "cached_tokens",
+        "input_tokens",
+        "output_tokens",
+    )
+}
+_SECONDS = re.compile(rb'"seconds":\s*([\d.]+)')
+
+# "07_structured_ouputs" for python src/07_structured_ouputs.py
+SCRIPT = (
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    if sys.argv and sys.argv[0].endswith(".py")
+    else None
+)
+
+_tags: ContextVar[dict] = ContextVar("usage_tags", default={})
+
+
+@contextmanager
+def usage_tags(**tags):
+    """Tag the calls made inside the block (``feature``, ``chat_id``)."""
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def _price(prices: dict, model: str):
+    """The price of the longest-named model ``model`` is a version of."""
+    names = [name for name in prices if model.startswith(name)]
+    return prices[max(names, key=len)] if names else None
+
+
+def cost_of(
+    endpoint: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_tokens: int,
+    units: float = 0,
+) -> float | None:
+    """
+    USD cost of one call, or None for an unknown model. ``units`` are the
+    images generated, characters spoken or seconds transcribed.
+    """
+    if endpoint == "images":
+        price = _price(IMAGE_PRICES, model)
+        return price * units if price is not None else None
+    if endpoint == "audio" and _price(SPEECH_PRICES, model) is not None:
+        return _price(SPEECH_PRICES, model) * units / 1e6
+    if endpoint == "audio" and _price(AUDIO_MINUTE_PRICES, model) is not None:
+        # Unknown unless the response reports the audio's duration
+        return _price(AUDIO_MINUTE_PRICES, model) * units / 60 if units else None
+    prices = _price(TOKEN_PRICES, model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1e6
+
+
+def endpoint_of(path: str) -> str:
+    for endpoint in ("chat", "embeddings", "images", "audio"):
+        if f"/{endpoint}/" in path or path.endswith(f"/{endpoint}"):
+            return endpoint
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class UsageLedger:
+    def __init__(self, db_path: str = USAGE_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        # The ledger table of the apps' migration 1, which adds the rollups
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS usage (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                endpoint TEXT NOT NULL,
+                model TEXT NOT NULL,
+                feature TEXT NOT NULL,
+                chat_id TEXT,
+                status INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                cached_tokens INTEGER NOT NULL,
+                latency_ms REAL NOT NULL,
+                cost_usd REAL
+            )
+        """
+        )
+
+    def record(self, **row):
+        """Append one ledger row (and, in the apps' database, its rollups)."""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    f"INSERT INTO usage ({', '.join(row)}) "
+                    f"VALUES ({', '.join('?' for _ in row)})",
+                    tuple(row.values()),
+                )
+        except sqlite3.Error as e:
+            print(f"Usage ledger write failed: {e!r}", file=sys.stderr)
+
+    def totals(self, since: float, by: str = "feature") -> list[dict]:
+        """Calls and tokens per ``by`` column for the rows since ``since``."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"""
+                SELECT {by}, count(*) AS calls, sum(status >= 400) AS errors,
+                       sum(prompt_tokens) AS prompt_tokens,
+                       sum(completion_tokens) AS completion_tokens,
+                       sum(cached_tokens) AS cached_tokens,
+                       sum(latency_ms) AS latency_ms_total,
+                       coalesce(sum(cost_usd), 0) AS cost_usd
+                FROM usage WHERE ts >= ? GROUP BY {by} ORDER BY min(id)
+                """,
+                (since,),
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class LedgerStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """
+    Pass a response body (sync or async) through and record its usage when
+    it closes.
+    """
+
+    def __init__(self, stream, ledger: UsageLedger, call: dict, parse: bool):
+        self.stream = stream
+        self.ledger = ledger
+        self.call = call
+        self.parse = parse
+        self.head = b""
+        self.tail = b""
+        self.events = 0
+        self.recorded = False
+
+    def _feed(self, chunk: bytes) -> bytes:
+        if self.parse:
+            if len(self.head) < HEAD_BYTES:
+                self.head += chunk[: HEAD_BYTES - len(self.head)]
+            self.events += chunk.count(b"data:")
+            self.tail = (self.tail + chunk)[-TAIL_BYTES:]
+        return chunk
+
+    def __iter__(self):
+        for chunk in self.stream:
+            yield self._feed(chunk)
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield self._feed(chunk)
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._record()
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self._record()
+
+    def _count(self, name: str) -> int:
+        match = _COUNTS[name].search(self.tail)
+        return int(match.group(1)) if match else 0
+
+    def _record(self):
+        if self.recorded:
+            return
+        self.recorded = True
+        call = self.call
+        latency_ms = (time.perf_counter() - call.pop("started")) * 1000
+        units = call.pop("units")
+        model = call.pop("model")
+        match = _MODEL.search(self.head) or _MODEL.search(self.tail)
+        if match:
+            # The exact (dated) model that answered
+            model = match.group(1).decode()
+        prompt = self._count("prompt_tokens") or self._count("input_tokens")
+        completion = self._count("completion_tokens") or self._count(
+            "output_tokens"
+        )
+        if not completion and self.events > 1 and call["status"] < 400:
+            # Streamed without usage: about one token per chunk
+            completion = self.events - 1
+        cached = self._count("cached_tokens")
+        seconds = _SECONDS.search(self.tail)
+        if seconds:
+            units = float(seconds.group(1))
+        self.ledger.record(
+            **call,
+            model=model,
+            prompt_tokens=prompt,
+            completion_tokens=completion,
+            cached_tokens=cached,
+            latency_ms=round(latency_ms, 1),
+            cost_usd=(
+                cost_of(call["endpoint"], model, prompt, completion, cached, units)
+                if call["status"] < 400
+                else 0.0
+            ),
+        )
+
+
+def _describe(request: httpx.Request, endpoint: str) -> tuple[str, float]:
+    """The requested model and the billed units (images, characters)."""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        match = _FORM_MODEL.search(request.content)
+        return (match.group(1).decode() if match else "unknown"), 0
+    if endpoint not in ("images", "audio") or request.method != "POST":
+        # Chat and embedding responses name their model
+        return "unknown", 0
+    body = json.loads(request.content or b"{}")
+    model = body.get("model") or ("dall-e-2" if endpoint == "images" else "")
+    if endpoint == "images":
+        return model, body.get("n", 1)
+    return model or "unknown", len(body.get("input", ""))
+
+
+class LedgerTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    httpx transport (sync or async, after the transport it wraps) that
+    records every response in a UsageLedger.
+    """
+
+    def __init__(self, transport, ledger: UsageLedger):
+        self.transport = transport
+        self.ledger = ledger
+
+    def _wrap(
+        self, request: httpx.Request, response: httpx.Response, started: float
+    ) -> httpx.Response:
+        endpoint = endpoint_of(request.url.path)
+        model, units = _describe(request, endpoint)
+        tags = _tags.get()
+        content_type = response.headers.get("content-type", "")
+        response.stream = LedgerStream(
+            response.stream,
+            self.ledger,
+            {
+                "started": started,
+                "ts": time.time(),
+                "endpoint": endpoint,
+                "feature": tags.get("feature", SCRIPT or endpoint),
+                "chat_id": tags.get("chat_id"),
+                "status": response.status_code,
+                "model": model,
+                "units": units,
+            },
+            parse="json" in content_type or "event-stream" in content_type,
+        )
+        return response
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "HEAD":
+            return self.transport.handle_request(request)
+        request.read()
+        started = time.perf_counter()
+        response = self.transport.handle_request(request)
+        return self._wrap(request, response, started)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "HEAD":
+            return await self.transport.handle_async_request(request)
+        await request.aread()
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        return self._wrap(request, response, started)
+
+    def close(self):
+        self.transport.close()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+@cache
+def get_usage_ledger() -> UsageLedger:
+    """Return this process's handle on the usage ledger."""
+    return UsageLedger()
+
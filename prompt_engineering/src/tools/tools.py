@@ -2,6 +2,10 @@ from datetime import datetime, timezone
 
 import requests
 import yfinance as yf
+from llm.resilience import RETRY_STATUSES, retry_call
+
+# Seconds to wait for open-meteo before the attempt is retried
+TIMEOUT = 10
 
 
 def get_current_weather(openMeteoInput: OpenMeteoInput):
@@ -17,8 +21,14 @@ def get_current_weather(openMeteoInput: OpenMeteoInput):
         "forecast_days": 1,
     }
 
-    # Make the request
-    response = requests.get(BASE_URL, params=params)
+    def fetch():
+        response = requests.get(BASE_URL, params=params, timeout=TIMEOUT)
+        if response.status_code in RETRY_STATUSES:
+            response.raise_for_status()
+        return response
+
+    # Make the request, retrying timeouts, dropped connections and 5xx/429
+    response = retry_call(fetch, retry_on=(requests.RequestException,))
 
     if response.status_code == 200:
         results = response.json()
@@ -51,7 +61,13 @@ def get_current_time() -> str:
 
 
 def get_current_stock_value(ticker_symbol):
-    ticker = yf.Ticker(ticker_symbol)
-    todays_data = ticker.history(period="1d")
+    def fetch():
+        # yfinance logs network errors and returns no rows instead of raising
+        history = yf.Ticker(ticker_symbol).history(period="1d")
+        if history.empty:
+            raise LookupError(f"No price data for {ticker_symbol}")
+        return history
+
+    todays_data = retry_call(fetch, retry_on=(LookupError, OSError))
     print(todays_data.to_string(index=False))
     return f"The stock price of {ticker_symbol} is,  {todays_data["Close"].iloc[0]}"
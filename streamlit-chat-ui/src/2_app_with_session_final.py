@@ -1,14 +1,16 @@
 import streamlit as st
-from openai import OpenAI
 
 # from langchain_core.messages import AIMessage, HumanMessage
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from llm.context import build_context
+from llm.resilience import resilient_chat_completion
 load_dotenv()
 
 class ChatMessage(BaseModel):
     sender: str
     content: str
+    token_count: int | None = None  # Counted once by llm/context.py
 
 
 USER = "user"
@@ -33,31 +35,33 @@ for history in chat_history:
 
 
 LLM = "gpt-4o"
-client = OpenAI()
 
 
 def ask_openai(
     user_question: str,
+    history: list[ChatMessage],
     temperature: float = 1.0,
     top_p: float = 1.0,
     max_tokens: int = 256,
 ):
-    response = client.chat.completions.create(
+    # Through the shared pool (rate limits, usage ledger), with retries
+    response = resilient_chat_completion(
         model=LLM,
-        messages=[
-            {"role": "user", "content": user_question},
-        ],
+        # The system prompt, the latest history that fits the token budget
+        # and the question
+        messages=build_context(history, user_question),
         temperature=temperature,
         max_tokens=max_tokens,
         top_p=top_p,
         stream=True,
+        stream_options={"include_usage": True},
     )
 
     return response
 
 
-def response_generator(user_question):
-    for chunk in ask_openai(user_question):
+def response_generator(user_question, history):
+    for chunk in ask_openai(user_question, history):
         if chunk.choices and chunk.choices[0].delta.content:
             yield chunk.choices[0].delta.content  # Stream response incrementally
 
@@ -68,7 +72,8 @@ def run():
     if prompt:
         st.chat_message("user").write(prompt)
         st.session_state["chat_history"] += [ChatMessage(content=prompt, sender=USER)]
-        output = response_generator(prompt)
+        # Everything said before this prompt
+        output = response_generator(prompt, chat_history[:-1])
 
         with st.chat_message("ai"):
             ai_message = st.write_stream(output)
@@ -1,19 +1,21 @@
 import streamlit as st
 import uuid
-from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
 from pydantic import BaseModel
+from llm.context import build_context
+from llm.resilience import resilient_chat_completion
+from llm.usage_ledger import usage_tags
 
 class ChatMessage(BaseModel):
     sender: str  # BOT, USER
     content: str
+    token_count: int | None = None  # Counted once by llm/context.py
 
 USER = "user"
 BOT = "bot"
 
 LLM = "gpt-4o"
-client = OpenAI()
 
 st.header("Chat :blue[Application]")
 
@@ -64,24 +66,27 @@ if st.session_state["selected_chat"]:
     # Functions for the chatbot
     def ask_openai(
         user_question: str,
+        history: list[ChatMessage],
         temperature: float = 1.0,
         top_p: float = 1.0,
         max_tokens: int = 256,
     ):
-        response = client.chat.completions.create(
+        # Through the shared pool (rate limits, usage ledger), with retries
+        response = resilient_chat_completion(
             model=LLM,
-            messages=[
-                {"role": "user", "content": user_question},
-            ],
+            # The system prompt, the latest history that fits the token
+            # budget and the question
+            messages=build_context(history, user_question),
             temperature=temperature,
             max_tokens=max_tokens,
             top_p=top_p,
             stream=True,
+            stream_options={"include_usage": True},
         )
         return response
 
-    def response_generator(user_question):
-        for chunk in ask_openai(user_question):
+    def response_generator(user_question, history):
+        for chunk in ask_openai(user_question, history):
             if chunk.choices and chunk.choices[0].delta.content:
                 yield chunk.choices[0].delta.content  # Stream response incrementally
 
@@ -99,7 +104,8 @@ if st.session_state["selected_chat"]:
             chat_history.append(ChatMessage(content=prompt, sender=USER))
 
             # Generate response
-            output = response_generator(prompt)
+            # Everything said before this prompt
+            output = response_generator(prompt, chat_history[:-1])
             with st.chat_message("ai"):
                 ai_message = st.write_stream(output)
 
@@ -107,6 +113,8 @@ if st.session_state["selected_chat"]:
             chat_history.append(ChatMessage(content=ai_message, sender=BOT))
 
     if __name__ == "__main__":
-        run()
+        # Book this chat's calls to it in the usage ledger
+        with usage_tags(chat_id=chat_id):
+            run()
 else:
     st.write("Select or create a new chat from the sidebar to begin.")
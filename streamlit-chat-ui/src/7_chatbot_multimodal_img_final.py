@@ -1,142 +1,51 @@
 import base64
-import os
-import sqlite3
 import uuid
+from typing import Sequence
 
-import requests
+import httpx
 import streamlit as st
+from db.attachment_store import read_attachment, save_attachment
+from db.chat_store import (
+    GREETING,
+    STREAMING,
+    add_message_to_db,
+    checkpointed_stream,
+    create_new_chat_in_db,
+    delete_chat_in_db,
+    get_conversation,
+    init_db,
+    is_stalled,
+    list_chats,
+    load_older_messages,
+    load_summary,
+    load_unsummarized,
+    open_conversation_at,
+    search_messages,
+    update_chat_name_in_db,
+)
 from dotenv import load_dotenv
-from openai import OpenAI
-from pydantic import BaseModel
+from llm.client import post_chat_completion
+from llm.compaction import get_compactor
+from llm.context import build_context
+from llm.memory import recall_memories, start_memory
+from llm.resilience import resilient_call
+from llm.semantic_cache import semantic_chat_completion
+from llm.usage_ledger import usage_tags
+from model.chats_models import ChatMessage, ChatSummary, MemorySnippet
 
 load_dotenv()
 
 
-class ChatMessage(BaseModel):
-    sender: str  # BOT, USER
-    content: str
-    image: str | None = None  # For storing base64 image if provided
-
-
 USER = "user"
 BOT = "bot"
 
 LLM = "gpt-4o"
-client = OpenAI()
 
-api_key = os.environ.get("OPENAI_API_KEY")
-
-# -------------------------------------------------
-# Database Persistence Layer
-# -------------------------------------------------
+# Helper function to encode a stored image for the API
 
 
-def init_db():
-    """Initialize the SQLite database and create tables if they don't exist."""
-    with sqlite3.connect("chat.db") as conn:
-        c = conn.cursor()
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS chats (
-                chat_id TEXT PRIMARY KEY,
-                name TEXT
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                message_id TEXT PRIMARY KEY,
-                chat_id TEXT,
-                sender TEXT,
-                content TEXT
-            )
-        """)
-        # Attempt to add an image column if it doesn't exist
-        try:
-            c.execute("ALTER TABLE messages ADD COLUMN image TEXT")
-        except:
-            pass
-        conn.commit()
-
-
-def load_chats_from_db():
-    """Load all chats and their messages from the DB into a dictionary."""
-    with sqlite3.connect("chat.db") as conn:
-        c = conn.cursor()
-        c.execute("SELECT chat_id, name FROM chats")
-        rows = c.fetchall()
-        all_chats = {}
-        for chat_id, name in rows:
-            c.execute(
-                "SELECT sender, content, image FROM messages WHERE chat_id=?",
-                (chat_id,),
-            )
-            message_rows = c.fetchall()
-            messages = []
-            for sender, content, image_b64 in message_rows:
-                messages.append(
-                    ChatMessage(sender=sender, content=content, image=image_b64)
-                )
-            all_chats[chat_id] = {"name": name, "messages": messages}
-        return all_chats
-
-
-def create_new_chat_in_db(chat_id: str, name: str, first_message: ChatMessage):
-    """Create a new chat row in the DB and insert the first message."""
-    with sqlite3.connect("chat.db") as conn:
-        c = conn.cursor()
-        c.execute("INSERT INTO chats (chat_id, name) VALUES (?,?)", (chat_id, name))
-        c.execute(
-            "INSERT INTO messages (message_id, chat_id, sender, content, image) VALUES (?,?,?,?,?)",
-            (
-                str(uuid.uuid4()),
-                chat_id,
-                first_message.sender,
-                first_message.content,
-                first_message.image,
-            ),
-        )
-        conn.commit()
-
-
-def add_message_to_db(chat_id: str, message: ChatMessage):
-    """Add a new message to the messages table for the given chat."""
-    with sqlite3.connect("chat.db") as conn:
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO messages (message_id, chat_id, sender, content, image) VALUES (?,?,?,?,?)",
-            (
-                str(uuid.uuid4()),
-                chat_id,
-                message.sender,
-                message.content,
-                message.image,
-            ),
-        )
-        conn.commit()
-
-
-def update_chat_name_in_db(chat_id: str, new_name: str):
-    """Update an existing chat's name."""
-    with sqlite3.connect("chat.db") as conn:
-        c = conn.cursor()
-        c.execute("UPDATE chats SET name=? WHERE chat_id=?", (new_name, chat_id))
-        conn.commit()
-
-
-def get_all_messages():
-    """Retrieve all messages from the DB (for demonstration purposes)."""
-    with sqlite3.connect("chat.db") as conn:
-        c = conn.cursor()
-        c.execute("SELECT chat_id, sender, content, image FROM messages")
-        return c.fetchall()
-
-
-# Helper function to encode image
-
-
-def encode_image(uploaded_file) -> str:
-    if uploaded_file is None:
-        return ""
-    return base64.b64encode(uploaded_file.read()).decode("utf-8")
+def encode_image(sha256: str) -> str:
+    return base64.b64encode(read_attachment(sha256)).decode("utf-8")
 
 
 # -------------------------------------------------
@@ -146,20 +55,46 @@ def encode_image(uploaded_file) -> str:
 
 def ask_openai(
     user_question: str,
-    temperature: float = 1.0,
+    temperature: float = 0.0,  # Deterministic, so repeats hit the cache
     top_p: float = 1.0,
     max_tokens: int = 256,
+    partial_answer: str | None = None,
+    history: Sequence[ChatMessage] = (),
+    summary: ChatSummary | None = None,
+    memories: Sequence[MemorySnippet] = (),
 ):
-    """Send a user question to OpenAI and stream the completion response."""
-    response = client.chat.completions.create(
+    """Send a user question to OpenAI and stream the completion response.
+
+    The most recent ``history`` (the chat before this question) that fits
+    in the context budget is sent along, after the ``summary`` of the
+    messages compacted away, if any, and the ``memories`` recalled from
+    other chats. With ``partial_answer`` (an interrupted reply) the model
+    is asked to continue it instead of starting over.
+    """
+    messages = build_context(
+        history, user_question, summary=summary, memories=memories
+    )
+    if partial_answer:
+        messages += [
+            {"role": "assistant", "content": partial_answer},
+            {
+                "role": "user",
+                "content": "Continue exactly where you stopped, "
+                "without repeating anything.",
+            },
+        ]
+    # Questions similar to one answered before, and identical requests, are
+    # answered from the response caches; the exact-match cache only keeps
+    # temperature-0 answers (OPENAI_CACHE_ALL=1 for any temperature)
+    response = semantic_chat_completion(
         model=LLM,
-        messages=[
-            {"role": "user", "content": user_question},
-        ],
+        messages=messages,
         temperature=temperature,
         max_tokens=max_tokens,
         top_p=top_p,
         stream=True,
+        # Final chunk carries the usage for the ledger (llm/usage_ledger.py)
+        stream_options={"include_usage": True},
     )
     return response
 
@@ -170,36 +105,49 @@ def ask_openai_image(
     temperature: float = 1.0,
     top_p: float = 1.0,
     max_tokens: int = 500,
-) -> requests.Response:
-    """Send user text + image to an LLM endpoint and return a requests.Response."""
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
-
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [
+    history: Sequence[ChatMessage] = (),
+    summary: ChatSummary | None = None,
+    memories: Sequence[MemorySnippet] = (),
+) -> httpx.Response:
+    """Send user text + image to an LLM endpoint and return an httpx.Response."""
+    user_message = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": user_question},
             {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": user_question},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                    },
-                ],
-            }
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
+            },
         ],
+    }
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": build_context(
+            history, user_message, summary=summary, memories=memories
+        ),
         "max_tokens": max_tokens,
         "temperature": temperature,
     }
 
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=payload
-    )
+    with usage_tags(feature="vision"):
+        response = resilient_call(post_chat_completion, payload)
     return response
 
 
-def response_generator(user_question: str):
-    for chunk in ask_openai(user_question):
+def response_generator(
+    user_question: str,
+    partial_answer: str | None = None,
+    history: Sequence[ChatMessage] = (),
+    summary: ChatSummary | None = None,
+    memories: Sequence[MemorySnippet] = (),
+):
+    for chunk in ask_openai(
+        user_question,
+        partial_answer=partial_answer,
+        history=history,
+        summary=summary,
+        memories=memories,
+    ):
         if chunk.choices and chunk.choices[0].delta.content:
             yield chunk.choices[0].delta.content  # Stream response incrementally
 
@@ -212,10 +160,8 @@ st.header("Chat :blue[Application]")
 
 # Initialize the DB
 init_db()
-
-# Load existing chats from the database
-if "all_chats" not in st.session_state:
-    st.session_state["all_chats"] = load_chats_from_db()
+# Index messages for recall in other chats (llm/memory.py) as they are saved
+start_memory()
 
 # Track which chat (by UUID) is currently selected
 if "selected_chat" not in st.session_state:
@@ -228,45 +174,92 @@ with st.sidebar:
     # Place 'New Chat' button at the top
     if st.button("New Chat", key="new_chat_button"):
         new_chat_uuid = str(uuid.uuid4())
-        first_msg = ChatMessage(sender=BOT, content="Hello, how can I help you?")
+        first_msg = ChatMessage(sender=BOT, content=GREETING)
         create_new_chat_in_db(new_chat_uuid, "New Chat", first_msg)
-
-        st.session_state["all_chats"][new_chat_uuid] = {
-            "name": "New Chat",
-            "messages": [first_msg],
-        }
         st.session_state["selected_chat"] = new_chat_uuid
 
+    # Delete the open chat; its attachments stay while another chat uses them
+    if st.session_state["selected_chat"] and st.button(
+        "Delete Chat", key="delete_chat_button"
+    ):
+        delete_chat_in_db(st.session_state["selected_chat"])
+        st.session_state["selected_chat"] = None
+
+    # Full-text search across all chats; a hit opens its chat at that message
+    search_text = st.text_input("Search messages", key="search_text")
+    if search_text:
+        for hit in search_messages(search_text):
+            st.caption(hit.chat_name)
+            st.markdown(hit.snippet)
+            if st.button("Go to message", key=f"search_hit_{hit.message_id}"):
+                open_conversation_at(hit.chat_id, hit.seq)
+                st.session_state["selected_chat"] = hit.chat_id
+
     # Display existing chat sessions in reverse order so new ones appear at the top.
     # Add a unique key parameter to each button to avoid duplicate IDs.
-    for chat_id in reversed(list(st.session_state["all_chats"].keys())):
-        chat_data = st.session_state["all_chats"][chat_id]
-        button_label = chat_data["name"]
+    for chat_id, button_label in reversed(list_chats()):
         if st.button(button_label, key=f"chat_button_{chat_id}"):
             st.session_state["selected_chat"] = chat_id
 
-# print(f"conversations : {st.session_state['all_chats']}")
 
-def display_chat_history(chat_history):
-        for msg in chat_history:
+def display_chat_history(chat_id, chat_history, summary=None, older_cursor=None):
+        question, asked_after = "", ()
+        for index, msg in enumerate(chat_history):
             if msg.sender == BOT:
                 with st.chat_message("ai"):
                     st.write(msg.content)
+                    # A reply cut off while streaming can be finished from where it stopped;
+                    # not one another session is still generating
+                    if is_stalled(msg) and st.button(
+                        "Continue", key=f"continue_{msg.message_id}"
+                    ):
+                        st.write_stream(
+                            checkpointed_stream(
+                                chat_id,
+                                msg,
+                                response_generator(
+                                    question,
+                                    msg.content,
+                                    [
+                                        *load_unsummarized(
+                                            chat_id, older_cursor, summary
+                                        ),
+                                        *asked_after,
+                                    ],
+                                    summary,
+                                    # Memories, as when the question was first asked
+                                    memories=recall_memories(question, chat_id),
+                                ),
+                            )
+                        )
             else:
+                if msg.content:
+                    question, asked_after = msg.content, chat_history[:index]
                 with st.chat_message("human"):
                     if msg.content:
                         st.write(msg.content)
-                    if msg.image:
+                    if msg.image_sha256:
                                 # Display the image in conversation
                         st.image(
-                                    base64.b64decode(msg.image), use_container_width=True
+                                    read_attachment(msg.image_sha256),
+                                    use_container_width=True,
                                 )
 
 # If a chat is selected, display its conversation and the chat input
 if st.session_state["selected_chat"]:
     chat_id = st.session_state["selected_chat"]
-    chat_data = st.session_state["all_chats"][chat_id]
-    chat_history = chat_data["messages"]
+    # Messages come from the process-wide conversation cache; the session
+    # only keeps the id of the selected chat
+    conversation = get_conversation(chat_id)
+
+    # Prepend the next older page on demand
+    if conversation.older_cursor is not None and st.button(
+        "Load older messages", key=f"load_older_{chat_id}"
+    ):
+        conversation = load_older_messages(chat_id)
+    chat_history = conversation.messages
+    # Summary of the older messages, once the chat has been compacted
+    summary = load_summary(chat_id)
 
     # Main app logic to handle user input (text + optional image)
     def run():
@@ -286,7 +279,9 @@ if st.session_state["selected_chat"]:
         print(f"submit_button: {submit_button}")
         with chat_container:
             if submit_button:
-                display_chat_history(chat_history=chat_history)
+                display_chat_history(
+                    chat_id, chat_history, summary, conversation.older_cursor
+                )
                 # Show spinner
                 if uploaded_img is not None:
                     # If there's an image, specifically mention it
@@ -297,33 +292,46 @@ if st.session_state["selected_chat"]:
                 with st.spinner(spinner_text):
                     # Optionally, rename the conversation using the last user prompt if prompt is not empty
                     if prompt:
-                        st.session_state["all_chats"][chat_id]["name"] = prompt
                         update_chat_name_in_db(chat_id, prompt)
 
-                    # Encode the image if provided
-                    img_b64 = None
+                    # Store the image if provided
+                    img_sha256 = None
                     if uploaded_img is not None:
-                        img_b64 = encode_image(uploaded_img)
+                        img_sha256 = save_attachment(uploaded_img)
 
                     # Display user message in the chat
                     with st.chat_message("human"):
                         if prompt:
                             st.write(prompt)
-                        if img_b64:
-                            st.image(base64.b64decode(img_b64), use_column_width=True)
+                        if img_sha256:
+                            st.image(uploaded_img.getvalue(), use_column_width=True)
 
                     # Save user message to DB
                     user_msg = ChatMessage(
                         content=prompt if prompt else "",
                         sender=USER,
-                        image=img_b64,
+                        image_sha256=img_sha256,
+                        image_mime=uploaded_img.type if uploaded_img else None,
                     )
-                    chat_history.append(user_msg)
                     add_message_to_db(chat_id, user_msg)
+                    # What the user said in other chats that bears on this
+                    memories = recall_memories(prompt, chat_id)
+                    # The chat since its summary: older pages not loaded
+                    # yet, then the loaded messages
+                    history = [
+                        *load_unsummarized(chat_id, conversation.older_cursor, summary),
+                        *chat_history,
+                    ]
 
                     # If no image is provided, use ask_openai. Otherwise, use ask_openai_image
-                    if img_b64 and prompt:
-                        response = ask_openai_image(prompt, img_b64)
+                    if img_sha256 and prompt:
+                        response = ask_openai_image(
+                            prompt,
+                            encode_image(img_sha256),
+                            history=history,
+                            summary=summary,
+                            memories=memories,
+                        )
                         if response.status_code == 200:
                             data = response.json()
                             bot_content = data["choices"][0]["message"]["content"]
@@ -332,7 +340,6 @@ if st.session_state["selected_chat"]:
                                 st.write(bot_content)
 
                             bot_msg = ChatMessage(content=bot_content, sender=BOT)
-                            chat_history.append(bot_msg)
                             add_message_to_db(chat_id, bot_msg)
                         else:
                             with st.chat_message("ai"):
@@ -344,27 +351,42 @@ if st.session_state["selected_chat"]:
                                 content=f"Error: {response.status_code}",
                                 sender=BOT,
                             )
-                            chat_history.append(bot_msg)
                             add_message_to_db(chat_id, bot_msg)
 
                     elif prompt:
-                        output = response_generator(prompt)
-                        with st.chat_message("ai"):
-                            ai_message = st.write_stream(output)
-
-                        bot_msg = ChatMessage(content=ai_message, sender=BOT)
-                        chat_history.append(bot_msg)
+                        # Save the reply as it streams, so an interrupted
+                        # answer survives and can be continued later
+                        bot_msg = ChatMessage(content="", sender=BOT, status=STREAMING)
                         add_message_to_db(chat_id, bot_msg)
+                        output = checkpointed_stream(
+                            chat_id,
+                            bot_msg,
+                            response_generator(
+                                prompt,
+                                history=history,
+                                summary=summary,
+                                memories=memories,
+                            ),
+                        )
+                        with st.chat_message("ai"):
+                            st.write_stream(output)
                     else:
                         st.warning("Please enter a prompt or upload an image.")
+                # Fold older messages into the chat's summary in the
+                # background once the chat has grown past the threshold
+                get_compactor().submit(chat_id)
             else:
                 # Display chat history
-                display_chat_history(chat_history=chat_history)
+                display_chat_history(
+                    chat_id, chat_history, summary, conversation.older_cursor
+                )
 
 
 
     if __name__ == "__main__":
-        run()
+        # Every call made for this chat is booked to it in the usage ledger
+        with usage_tags(chat_id=chat_id):
+            run()
 else:
     st.write("Select or create a new chat from the sidebar to begin.")
 
@@ -0,0 +1,108 @@
+"""
+Compare per-operation sqlite3.connect() against the pooled ConnectionManager.
+
+Inserts and then reads back N chat messages (10k by default) one operation at
+a time, the way the chat apps call add_message_to_db() and friends.
+
+Run from streamlit-chat-ui/src:
+    python -m benchmarks.bench_db_connection
+    python -m benchmarks.bench_db_connection --messages 50000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from db.connection import ConnectionManager
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS messages (
+        message_id TEXT PRIMARY KEY,
+        chat_id TEXT,
+        sender TEXT,
+        content TEXT
+    )
+"""
+INSERT = "INSERT INTO messages (message_id, chat_id, sender, content) VALUES (?,?,?,?)"
+SELECT = "SELECT sender, content FROM messages WHERE message_id=?"
+
+
+def make_rows(count: int) -> list[tuple]:
+    chat_id = str(uuid.uuid4())
+    return [
+        (str(uuid.uuid4()), chat_id, "user" if i % 2 else "bot", f"message {i}")
+        for i in range(count)
+    ]
+
+
+def bench_connect_per_call(db_path: str, rows: list[tuple]) -> tuple[float, float]:
+    """The original pattern: open, execute, commit and close for every call."""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(SCHEMA)
+    start = time.perf_counter()
+    for row in rows:
+        conn = sqlite3.connect(db_path)
+        conn.execute(INSERT, row)
+        conn.commit()
+        conn.close()
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for row in rows:
+        conn = sqlite3.connect(db_path)
+        conn.execute(SELECT, (row[0],)).fetchone()
+        conn.close()
+    read_time = time.perf_counter() - start
+    return insert_time, read_time
+
+
+def bench_connection_manager(db_path: str, rows: list[tuple]) -> tuple[float, float]:
+    """Same calls, reusing the thread's long-lived WAL connection."""
+    manager = ConnectionManager(db_path)
+    with manager.transaction() as conn:
+        conn.execute(SCHEMA)
+    start = time.perf_counter()
+    for row in rows:
+        with manager.transaction() as conn:
+            conn.execute(INSERT, row)
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for row in rows:
+        manager.connection().execute(SELECT, (row[0],)).fetchone()
+    read_time = time.perf_counter() - start
+    manager.close_all()
+    return insert_time, read_time
+
+
+def report(label: str, count: int, insert_time: float, read_time: float):
+    print(
+        f"{label:<22} inserts: {insert_time:8.3f}s ({count / insert_time:10.0f}/s)"
+        f"   reads: {read_time:8.3f}s ({count / read_time:10.0f}/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10_000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.messages)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        before = bench_connect_per_call(os.path.join(tmp_dir, "before.db"), rows)
+        after = bench_connection_manager(os.path.join(tmp_dir, "after.db"), rows)
+
+    print(f"{args.messages} messages")
+    report("connect per call", args.messages, *before)
+    report("ConnectionManager", args.messages, *after)
+    print(
+        f"speedup                inserts: {before[0] / after[0]:6.1f}x"
+        f"                   reads: {before[1] / after[1]:6.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
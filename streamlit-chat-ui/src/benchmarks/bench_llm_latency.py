@@ -0,0 +1,368 @@
+"""
+LLM latency suite: TTFT, inter-token gap, tokens/s and end-to-end latency.
+
+Each scenario sends the same kind of request the scripts do, ``--requests``
+times in a row after ``--warmup`` unmeasured ones:
+
+    chat          non-streamed chat completion (02_openai_parameters_final.py)
+    chat_stream   streamed chat completion (03_openai_stream_response_final.py)
+    vision_sdk    image question through a default OpenAI() client
+    vision_raw    the same body with requests.post, a new connection each time
+    vision_pool   the same body through the shared pool (llm/client.py)
+
+and reports p50/p95/p99 of time to first token, gap between streamed
+tokens, tokens per second and end-to-end latency. A non-streamed answer's
+first token arrives with the whole answer, so its TTFT is its latency.
+
+Without ``--base-url`` the suite runs against the local mock server
+(benchmarks/mock_openai.py), whose latency settings take the same flags;
+with it, against that endpoint (e.g. https://api.openai.com/v1, using
+OPENAI_API_KEY). Results can be written to JSON and two runs compared;
+compare exits with status 1 when a metric got worse by more than
+``--threshold``, a scenario had more errors, or a metric measured before is
+missing after (e.g. every request failed).
+
+Run from streamlit-chat-ui/src:
+    python -m benchmarks.bench_llm_latency --output before.json
+    python -m benchmarks.bench_llm_latency --itl-ms 20 --output after.json
+    python -m benchmarks.bench_llm_latency compare before.json after.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+import requests
+from benchmarks.mock_openai import (
+    MockOpenAIServer,
+    add_config_arguments,
+    config_from_args,
+    png,
+)
+from llm.client import create_http_client
+from openai import OpenAI
+
+PERCENTILES = (50, 95, 99)
+
+# Metrics where a larger number is better; for the rest smaller is better.
+HIGHER_IS_BETTER = {"tokens_per_s"}
+
+QUESTION = "Can you complete the sentence? My dog is playful and loves to"
+
+
+@dataclass
+class Sample:
+    """Timings of one request, in seconds from when it was sent."""
+
+    total: float
+    first_token: float
+    token_times: list[float] = field(default_factory=list)
+    tokens: int = 0
+
+
+@dataclass
+class Target:
+    base_url: str
+    api_key: str
+    model: str
+    client: OpenAI  # On the shared pool
+    sdk_client: OpenAI  # With the SDK's own default connection handling
+    pool: object  # httpx.Client, the shared-pool setup without rate limiting
+    image: str  # base64 PNG for the vision scenarios
+
+    def vision_body(self) -> dict:
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "What is in this image?"},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/png;base64,{self.image}"},
+                        },
+                    ],
+                }
+            ],
+            "max_tokens": 300,
+        }
+
+
+def _completion_sample(start: float, completion_tokens: int) -> Sample:
+    total = time.perf_counter() - start
+    return Sample(total=total, first_token=total, tokens=completion_tokens)
+
+
+def run_chat(target: Target) -> Sample:
+    start = time.perf_counter()
+    response = target.client.chat.completions.create(
+        model=target.model,
+        messages=[{"role": "user", "content": QUESTION}],
+        max_tokens=256,
+    )
+    return _completion_sample(start, response.usage.completion_tokens)
+
+
+def run_chat_stream(target: Target) -> Sample:
+    start = time.perf_counter()
+    token_times = []
+    usage = None
+    stream = target.client.chat.completions.create(
+        model=target.model,
+        messages=[{"role": "user", "content": QUESTION}],
+        max_tokens=256,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            token_times.append(time.perf_counter() - start)
+    total = time.perf_counter() - start
+    return Sample(
+        total=total,
+        first_token=token_times[0] if token_times else total,
+        token_times=token_times,
+        # A chunk usually carries one token; usage is exact when sent
+        tokens=usage.completion_tokens if usage else len(token_times),
+    )
+
+
+def run_vision_sdk(target: Target) -> Sample:
+    start = time.perf_counter()
+    response = target.sdk_client.chat.completions.create(**target.vision_body())
+    return _completion_sample(start, response.usage.completion_tokens)
+
+
+def _raw_sample(start: float, response) -> Sample:
+    response.raise_for_status()
+    return _completion_sample(start, response.json()["usage"]["completion_tokens"])
+
+
+def run_vision_raw(target: Target) -> Sample:
+    start = time.perf_counter()
+    response = requests.post(
+        f"{target.base_url}/chat/completions",
+        headers={"Authorization": f"Bearer {target.api_key}"},
+        json=target.vision_body(),
+    )
+    return _raw_sample(start, response)
+
+
+def run_vision_pool(target: Target) -> Sample:
+    start = time.perf_counter()
+    response = target.pool.post(
+        f"{target.base_url}/chat/completions",
+        headers={"Authorization": f"Bearer {target.api_key}"},
+        json=target.vision_body(),
+    )
+    return _raw_sample(start, response)
+
+
+SCENARIOS: dict[str, Callable[[Target], Sample]] = {
+    "chat": run_chat,
+    "chat_stream": run_chat_stream,
+    "vision_sdk": run_vision_sdk,
+    "vision_raw": run_vision_raw,
+    "vision_pool": run_vision_pool,
+}
+
+
+def percentiles(values: list[float]) -> dict[str, float] | None:
+    if not values:
+        return None
+    return {
+        f"p{p}": round(float(v), 3)
+        for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))
+    }
+
+
+def summarize(samples: list[Sample], errors: int) -> dict:
+    gaps = [
+        (later - earlier) * 1000
+        for sample in samples
+        for earlier, later in zip(sample.token_times, sample.token_times[1:])
+    ]
+    rates = []
+    for sample in samples:
+        # Generation speed: tokens after the first over the time they took
+        # to stream; a non-streamed answer only has its total latency
+        span = sample.total - sample.first_token
+        if sample.token_times and span > 0:
+            rates.append((sample.tokens - 1) / span)
+        elif sample.total > 0:
+            rates.append(sample.tokens / sample.total)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "ttft_ms": percentiles([s.first_token * 1000 for s in samples]),
+        "inter_token_ms": percentiles(gaps),
+        "tokens_per_s": percentiles(rates),
+        "e2e_ms": percentiles([s.total * 1000 for s in samples]),
+    }
+
+
+def run_scenario(name: str, target: Target, count: int, warmup: int) -> dict:
+    run = SCENARIOS[name]
+    samples, errors = [], 0
+    for index in range(warmup + count):
+        try:
+            sample = run(target)
+        except Exception as e:
+            errors += 1
+            print(f"  {name}: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        if index >= warmup:
+            samples.append(sample)
+    return summarize(samples, errors)
+
+
+def print_result(name: str, result: dict):
+    print(f"{name}  ({result['requests']} requests, {result['errors']} errors)")
+    for metric in ("ttft_ms", "inter_token_ms", "tokens_per_s", "e2e_ms"):
+        values = result[metric]
+        if values:
+            print(
+                f"  {metric:<15}"
+                + "".join(f"{p:>5} {v:10.2f}" for p, v in values.items())
+            )
+
+
+def compare(before: dict, after: dict, threshold: float) -> list[str]:
+    """
+    Metric percentiles that got worse by more than ``threshold`` (a
+    fraction), scenarios with more errors, and metrics or scenarios that
+    were measured before but are missing after.
+    """
+    regressions = []
+    for name, old in before["scenarios"].items():
+        if name not in after["scenarios"]:
+            print(f"{name:<12} missing after  REGRESSION")
+            regressions.append(f"{name} missing")
+    for name, new in after["scenarios"].items():
+        old = before["scenarios"].get(name)
+        if old is None:
+            continue
+        old_errors, new_errors = old.get("errors", 0), new.get("errors", 0)
+        if new_errors > old_errors:
+            print(
+                f"{name:<12} {'errors':<15} {'':>4} {old_errors:10d} -> "
+                f"{new_errors:10d}  REGRESSION"
+            )
+            regressions.append(f"{name} errors")
+        for metric, old_values in old.items():
+            if isinstance(old_values, dict) and not new.get(metric):
+                print(f"{name:<12} {metric:<15} missing after  REGRESSION")
+                regressions.append(f"{name} {metric} missing")
+        for metric, new_values in new.items():
+            old_values = old.get(metric)
+            if not isinstance(new_values, dict) or not old_values:
+                continue
+            for p, new_value in new_values.items():
+                old_value = old_values.get(p)
+                if not old_value:
+                    continue
+                change = (new_value - old_value) / old_value
+                if metric in HIGHER_IS_BETTER:
+                    change = -change
+                flag = "REGRESSION" if change > threshold else ""
+                print(
+                    f"{name:<12} {metric:<15} {p:>4} {old_value:10.2f} -> "
+                    f"{new_value:10.2f}  {change:+7.1%}  {flag}"
+                )
+                if flag:
+                    regressions.append(f"{name} {metric} {p}")
+    return regressions
+
+
+def main_compare(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="bench_llm_latency compare",
+        description="Flag metrics that got worse between two result files.",
+    )
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="allowed slowdown (0.10 = 10%%)"
+    )
+    args = parser.parse_args(argv)
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    regressions = compare(before, after, args.threshold)
+    print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    if sys.argv[1:2] == ["compare"]:
+        main_compare(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--base-url", help="endpoint to measure instead of the mock")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    mock = parser.add_argument_group("mock server (without --base-url)")
+    add_config_arguments(mock)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    api_key = os.environ.get("OPENAI_API_KEY", "mock")
+    if base_url is None:
+        server = MockOpenAIServer(config_from_args(args)).start()
+        base_url = server.base_url
+    base_url = base_url.rstrip("/")
+    pool = create_http_client()
+    target = Target(
+        base_url=base_url,
+        api_key=api_key,
+        model=args.model,
+        client=OpenAI(
+            base_url=base_url, api_key=api_key, http_client=pool, max_retries=0
+        ),
+        sdk_client=OpenAI(base_url=base_url, api_key=api_key, max_retries=0),
+        pool=pool,
+        image=base64.b64encode(png(args.image_bytes)).decode(),
+    )
+
+    print(f"{base_url}, {args.requests} requests per scenario\n")
+    results = {}
+    for name in args.scenarios:
+        results[name] = run_scenario(name, target, args.requests, args.warmup)
+        print_result(name, results[name])
+    target.sdk_client.close()
+    pool.close()
+    if server is not None:
+        server.stop()
+
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "base_url": "mock" if server is not None else base_url,
+            "model": args.model,
+            "requests": args.requests,
+            "mock": vars(config_from_args(args)) if server is not None else None,
+            "scenarios": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Compare a new connection per request (requests.post) with the shared pool.
+
+A local stub server answers chat completion requests with a canned body, so
+only connection handling differs between the two runs. ``--connect-delay-ms``
+makes the stub wait before serving each new connection, to stand in for the
+TCP+TLS handshake round trips to api.openai.com that a local socket doesn't
+have.
+
+Run from streamlit-chat-ui/src:
+    python -m benchmarks.bench_openai_client
+    python -m benchmarks.bench_openai_client --requests 500 --connect-delay-ms 40
+"""
+
+import argparse
+import json
+import socket
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from llm.client import create_http_client
+
+COMPLETION = json.dumps(
+    {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "model": "gpt-4o-mini",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "A stub answer."},
+                "finish_reason": "stop",
+            }
+        ],
+    }
+).encode()
+
+PAYLOAD = {
+    "model": "gpt-4o-mini",
+    "messages": [{"role": "user", "content": "What is in this image?"}],
+    "max_tokens": 500,
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections open between requests
+    connect_delay = 0.0
+
+    def setup(self):
+        time.sleep(self.connect_delay)
+        super().setup()
+        # Headers and body go out in separate writes; don't let Nagle hold
+        # the body back waiting for the client's delayed ACK.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(label: str, count: int, post):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = post()
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+    first = latencies[0]
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{label:<28} first {first:7.2f} ms   "
+        f"median {statistics.median(latencies):7.2f} ms   p95 {p95:7.2f} ms"
+    )
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--connect-delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    StubHandler.connect_delay = args.connect_delay_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+    print(f"{args.requests} requests, connect delay {args.connect_delay_ms} ms")
+    before = measure(
+        "requests.post (old)",
+        args.requests,
+        lambda: requests.post(url, json=PAYLOAD),
+    )
+    with create_http_client() as http_client:
+        after = measure(
+            "shared pool (llm/client.py)",
+            args.requests,
+            lambda: http_client.post(url, json=PAYLOAD),
+        )
+    print(f"mean saved per request {before - after:.2f} ms ({before / after:.1f}x)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
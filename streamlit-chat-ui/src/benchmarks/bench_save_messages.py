@@ -0,0 +1,91 @@
+"""
+Compare row-by-row message inserts with the bulk db.chat_db.save_messages().
+
+The "before" numbers replay what save_messages() used to do: one
+cursor.execute() per message inside a single transaction, printing the list
+and every message (to a null stream, so terminal speed doesn't count).
+
+Run from streamlit-chat-ui/src:
+    python -m benchmarks.bench_save_messages
+    python -m benchmarks.bench_save_messages --messages 1000000 --batch-size 5000
+"""
+
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+import tracemalloc
+
+from db import chat_db
+from model.chats_models import ChatMessage
+
+
+def generate_messages(count: int):
+    for i in range(count):
+        yield ChatMessage(sender="user" if i % 2 else "bot", content=f"message {i}")
+
+
+def save_messages_row_by_row(chat_id, messages: list[ChatMessage]):
+    with chat_db.transaction(chat_db.DB_NAME) as conn:
+        cursor = conn.cursor()
+        print(f"messages : {messages}")
+        for msg in messages:
+            print(f"msg : {msg}")
+            cursor.execute(
+                """
+                INSERT INTO messages (chat_id, sender, message)
+                VALUES (?, ?, ?)
+                """,
+                (chat_id, msg.sender, msg.content),
+            )
+
+
+def measure(label: str, count: int, run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<26} {elapsed:8.3f}s {count / elapsed:10.0f} rows/s"
+        f"   peak memory {peak / 2**20:7.1f} MiB"
+    )
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=chat_db.BATCH_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        chat_db.init_db()
+        chat_db.save_chat("before", "before")
+        chat_db.save_chat("after", "after")
+
+        def before():
+            messages = list(generate_messages(args.messages))
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                save_messages_row_by_row("before", messages)
+
+        def after():
+            ids = chat_db.save_messages(
+                "after", generate_messages(args.messages), batch_size=args.batch_size
+            )
+            assert len(ids) == args.messages
+
+        print(f"{args.messages} messages")
+        before_time = measure("row by row (old)", args.messages, before)
+        after_time = measure(
+            f"save_messages (batch {args.batch_size})", args.messages, after
+        )
+        print(f"speedup {before_time / after_time:.1f}x")
+        chat_db.get_connection(chat_db.DB_NAME).close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Measure full-text search latency over a large chat history.
+
+Fills a throwaway chat.db with N messages (1M by default) spread over many
+chats, then times search_messages() for a mix of common, rare, multi-word
+and prefix queries and reports p50/p95/max per query. Message text is drawn
+from a Zipf-distributed vocabulary, like natural language, with the
+searched-for topic words in the mid-frequency range.
+
+Run from streamlit-chat-ui/src:
+    python -m benchmarks.bench_search
+    python -m benchmarks.bench_search --messages 100000
+"""
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+from db import chat_store
+
+WORDS = (
+    "python thread create async await list dict tuple class function import "
+    "module package database sqlite index query stream token model image audio "
+    "upload chat message search prompt response error retry cache memory vector "
+    "embedding latency server client request json schema table column row"
+).split()
+
+QUERIES = ["python", "thread create", "sqlite index query", "embed", "zyzzyva"]
+
+VOCABULARY_SIZE = 20_000
+# Rank of the first topic word; ranks below it are filler "stop words".
+TOPIC_RANK = 100
+
+CHATS = 2_000
+BATCH = 10_000
+
+
+def populate(count: int):
+    conn = chat_store.get_connection(chat_store.DB_NAME)
+    rng = random.Random(42)
+    vocabulary = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    vocabulary[TOPIC_RANK : TOPIC_RANK + len(WORDS)] = WORDS
+    cum_weights = list(
+        itertools.accumulate(1 / rank for rank in range(1, VOCABULARY_SIZE + 1))
+    )
+    chat_ids = [str(uuid.uuid4()) for _ in range(CHATS)]
+    with conn:
+        conn.executemany(
+            "INSERT INTO chats (chat_id, name, last_activity) VALUES (?, ?, ?)",
+            [(chat_id, f"Chat {i}", "") for i, chat_id in enumerate(chat_ids)],
+        )
+    for start in range(0, count, BATCH):
+        rows = []
+        for i in range(start, min(start + BATCH, count)):
+            words = rng.choices(
+                vocabulary, cum_weights=cum_weights, k=rng.randint(5, 40)
+            )
+            content = " ".join(words)
+            rows.append(
+                (str(uuid.uuid4()), chat_ids[i % CHATS], "user", content, i // CHATS + 1)
+            )
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO messages (message_id, chat_id, sender, content, seq)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+        print(f"\rinserted {min(start + BATCH, count)}/{count}", end="", flush=True)
+    print()
+    with conn:
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        chat_store.init_db()
+        populate(args.messages)
+
+        print(f"{'query':<22}{'hits':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                hits = chat_store.search_messages(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            print(
+                f"{query:<22}{len(hits):>6}{statistics.median(timings):>10.2f}"
+                f"{p95:>10.2f}{timings[-1]:>10.2f}"
+            )
+        chat_store.get_connection(chat_store.DB_NAME).close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measure semantic cache lookups: brute force vs IVF, and the hit rate on
+paraphrased questions, with the offline HashingEmbedder.
+
+The index is filled with synthetic questions; queries are the same
+questions with their words shuffled and one word dropped, which the hashing
+embedder still places close to the original.
+
+Run from streamlit-chat-ui/src:
+    python -m benchmarks.bench_semantic_cache
+    python -m benchmarks.bench_semantic_cache --entries 200000
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+from llm.semantic_cache import HashingEmbedder, VectorIndex
+
+TOPICS = """
+    python thread process list dictionary sqlite index streamlit session cache
+    openai stream token image audio pandas numpy array regex json http socket
+    async decorator class generator exception file path docker git branch
+    merge test mock fixture lambda
+""".split()
+VERBS = "create sort read write delete join parse debug".split()
+
+
+def synthetic_questions(count: int, rng: random.Random) -> list[str]:
+    return [
+        f"how do I {rng.choice(VERBS)} a {rng.choice(TOPICS)} with "
+        f"{rng.choice(TOPICS)} and {rng.choice(TOPICS)} {i}"
+        for i in range(count)
+    ]
+
+
+def paraphrase(question: str, rng: random.Random) -> str:
+    words = question.split()
+    words.pop(rng.randrange(len(words) - 1))
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def measure(index: VectorIndex, queries: np.ndarray, expected: list[int], threshold):
+    latencies, found, hits = [], 0, 0
+    for query, want in zip(queries, expected):
+        start = time.perf_counter()
+        vector_id, score = index.search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found += vector_id == want
+        hits += score >= threshold
+    return (
+        np.percentile(latencies, 50),
+        np.percentile(latencies, 95),
+        found / len(expected),
+        hits / len(expected),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    embed = HashingEmbedder()
+    questions = synthetic_questions(args.entries, rng)
+    start = time.perf_counter()
+    vectors = embed(questions)
+    print(f"embedded {args.entries} questions in {time.perf_counter() - start:.1f}s")
+
+    expected = rng.sample(range(args.entries), args.queries)
+    queries = embed([paraphrase(questions[i], rng) for i in expected])
+
+    for label, ivf_threshold in (("brute force", args.entries + 1), ("IVF", 1)):
+        index = VectorIndex(embed.dim, ivf_threshold=ivf_threshold)
+        start = time.perf_counter()
+        for vector in vectors:
+            index.add(vector)
+        build = time.perf_counter() - start
+        p50, p95, recall, hit_rate = measure(index, queries, expected, args.threshold)
+        print(
+            f"{label:<12} build {build:6.1f}s   p50 {p50:6.2f} ms   p95 {p95:6.2f} ms"
+            f"   recall@1 {recall:.3f}   hit rate {hit_rate:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+"""
+Local OpenAI-compatible mock server, for running and benchmarking offline.
+
+Serves the endpoints the scripts and chat apps use:
+
+    POST /v1/chat/completions           streamed (SSE) or not; tool calls when
+                                        ``tools`` are given; JSON matching
+                                        ``response_format`` (json_schema /
+                                        json_object), so beta.parse() works
+    POST /v1/embeddings                 deterministic vectors per input text
+                                        (float or base64 encoding)
+    POST /v1/images/generations|edits|variations
+                                        an image URL served by the mock
+                                        itself, or b64_json
+    POST /v1/audio/transcriptions|translations
+                                        a canned transcript (json or text)
+    POST /v1/audio/speech               silent WAV audio
+    GET  /v1/models                     a model list
+    HEAD any path                       200, for connection prewarming
+
+Latency, errors and payload sizes are configurable, so runs are repeatable
+where the real API is noisy: time to first token, delay between tokens
+(plus optional uniform jitter), completion length, embedding dimensions,
+image and audio sizes, and the fraction of requests answered with a 5xx
+error or a 429 (with a retry-after-ms header).
+
+The server only uses the standard library. Start it, then point the SDK
+(which reads OPENAI_BASE_URL) and the raw chat completion posts at it:
+
+    python -m benchmarks.mock_openai --port 8000 --ttft-ms 300 --itl-ms 20
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock \\
+        streamlit run 8_chatbot_multimodal_img_audio_final.py
+
+Benchmarks start one in-process with MockOpenAIServer(MockConfig(...)).
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import wave
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Filler text the answers are cut from.
+WORDS = (
+    "Mock answer from the local server: the quick brown fox jumps over the "
+    "lazy dog while the model streams one token after another, as fast as "
+    "it was configured to."
+).split()
+
+# 1x1 transparent PNG, padded with a comment chunk to the configured size.
+_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+@dataclass
+class MockConfig:
+    ttft_ms: float = 200.0  # Time to the first token (or to the whole answer)
+    itl_ms: float = 10.0  # Delay between streamed tokens
+    jitter_ms: float = 0.0  # Uniform 0..jitter added to every delay
+    completion_tokens: int = 64  # Answer length, capped by max_tokens
+    error_rate: float = 0.0  # Fraction of requests answered with a 500
+    rate_limit_rate: float = 0.0  # Fraction answered with a 429
+    embedding_dim: int = 1536
+    image_bytes: int = 1024
+    audio_seconds: float = 1.0
+    seed: int = 0
+
+
+def png(size: int) -> bytes:
+    """A valid PNG of about ``size`` bytes (at least the 1x1 image)."""
+    padding = size - len(_PNG) - 12
+    if padding < 8:
+        return _PNG
+    data = b"Comment\x00" + b" " * (padding - 8)
+    chunk = struct.pack(">I", len(data)) + b"tEXt" + data
+    chunk += struct.pack(">I", zlib.crc32(b"tEXt" + data))
+    # Ancillary chunks go before IEND, the last 12 bytes
+    return _PNG[:-12] + chunk + _PNG[-12:]
+
+
+def _wav(seconds: float, rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(rate)
+        audio.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def _count_tokens(value) -> int:
+    # About four characters per token, like the client-side estimates
+    return max(1, len(json.dumps(value)) // 4)
+
+
+def sample_from_schema(schema: dict, defs: dict | None = None, name: str = ""):
+    """A value that validates against a (strict-mode style) JSON schema."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].split("/")[-1]], defs, name)
+    for combined in ("anyOf", "oneOf", "allOf"):
+        if combined in schema:
+            return sample_from_schema(schema[combined][0], defs, name)
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type", "object")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        return {
+            key: sample_from_schema(value, defs, key)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), defs, name)]
+    if kind == "string":
+        return f"mock {name}".strip()
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    return None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+    rng = random.Random(0)
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- helpers ---
+
+    def random(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def pause(self, ms: float):
+        jitter = self.config.jitter_ms * self.random() if self.config.jitter_ms else 0
+        if ms + jitter > 0:
+            time.sleep((ms + jitter) / 1000)
+
+    def reply(self, status: int, body, content_type="application/json", headers={}):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def injected_error(self) -> bool:
+        """Answer with a configured error instead, sometimes."""
+        draw = self.random()
+        if draw < self.config.rate_limit_rate:
+            self.reply(
+                429,
+                {
+                    "error": {
+                        "message": "Rate limit reached (mock)",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                },
+                headers={"retry-after-ms": "100"},
+            )
+            return True
+        if draw < self.config.rate_limit_rate + self.config.error_rate:
+            self.reply(
+                500,
+                {"error": {"message": "Internal error (mock)", "type": "server_error"}},
+            )
+            return True
+        return False
+
+    # --- routing ---
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path.endswith("/models"):
+            self.reply(
+                200,
+                {
+                    "object": "list",
+                    "data": [
+                        {"id": model, "object": "model", "owned_by": "mock"}
+                        for model in ("gpt-4o", "gpt-4o-mini", "whisper-1", "dall-e-3")
+                    ],
+                },
+            )
+        elif path.endswith("/mock/image.png"):
+            self.reply(200, png(self.config.image_bytes), "image/png")
+        else:
+            self.reply(404, {"error": {"message": f"No mock for GET {path}"}})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        raw = self.read_body()
+        if self.injected_error():
+            return
+        if path.endswith("/chat/completions"):
+            self.chat(json.loads(raw))
+        elif path.endswith("/embeddings"):
+            self.embeddings(json.loads(raw))
+        elif "/images/" in path:
+            self.images(raw)
+        elif path.endswith("/audio/speech"):
+            self.pause(self.config.ttft_ms)
+            self.reply(200, _wav(self.config.audio_seconds), "audio/wav")
+        elif "/audio/" in path:
+            self.transcription(raw)
+        else:
+            self.reply(404, {"error": {"message": f"No mock for POST {path}"}})
+
+    # --- endpoints ---
+
+    def answer(self, request: dict) -> tuple[str | None, list[dict], int]:
+        """(content, tool calls, completion tokens) for a chat request."""
+        limit = request.get("max_completion_tokens") or request.get("max_tokens")
+        tokens = min(self.config.completion_tokens, limit or 1 << 30)
+        messages = request.get("messages") or [{}]
+        tools = request.get("tools") or []
+        choice = request.get("tool_choice", "auto")
+        if tools and choice != "none" and messages[-1].get("role") != "tool":
+            tool = tools[0]
+            if isinstance(choice, dict):
+                wanted = choice["function"]["name"]
+                tool = next(t for t in tools if t["function"]["name"] == wanted)
+            function = tool["function"]
+            arguments = json.dumps(
+                sample_from_schema(function.get("parameters") or {"type": "object"})
+            )
+            call = {
+                "id": f"call_mock{int(self.random() * 1e9):09d}",
+                "type": "function",
+                "function": {"name": function["name"], "arguments": arguments},
+            }
+            return None, [call], _count_tokens(call)
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"].get("schema") or {}
+            content = json.dumps(sample_from_schema(schema))
+            return content, [], _count_tokens(content)
+        if response_format.get("type") == "json_object":
+            content = json.dumps({"answer": " ".join(WORDS[:tokens])})
+            return content, [], _count_tokens(content)
+        words = [WORDS[i % len(WORDS)] for i in range(tokens)]
+        return " ".join(words), [], tokens
+
+    def chat(self, request: dict):
+        content, tool_calls, completion_tokens = self.answer(request)
+        usage = {
+            "prompt_tokens": _count_tokens(request.get("messages")),
+            "completion_tokens": completion_tokens,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + completion_tokens
+        base = {
+            "id": "chatcmpl-mock",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o-mini"),
+            "system_fingerprint": "fp_mock",
+        }
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        if not request.get("stream"):
+            self.pause(self.config.ttft_ms + self.config.itl_ms * (completion_tokens - 1))
+            message = {"role": "assistant", "content": content, "refusal": None}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self.reply(
+                200,
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": message,
+                            "logprobs": None,
+                            "finish_reason": finish_reason,
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        def chunk(delta: dict, finish=None, with_usage=False) -> bytes:
+            body = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [
+                    {"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish}
+                ],
+            }
+            if with_usage:
+                body["choices"], body["usage"] = [], usage
+            return f"data: {json.dumps(body)}\n\n".encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.pause(self.config.ttft_ms)
+        self.write_chunk(chunk({"role": "assistant", "content": ""}))
+        if tool_calls:
+            call = tool_calls[0]
+            self.write_chunk(
+                chunk(
+                    {
+                        "tool_calls": [
+                            {
+                                "index": 0,
+                                "id": call["id"],
+                                "type": "function",
+                                "function": {"name": call["function"]["name"], "arguments": ""},
+                            }
+                        ]
+                    }
+                )
+            )
+            pieces = re.findall(r".{1,8}", call["function"]["arguments"], re.S)
+            for piece in pieces:
+                self.pause(self.config.itl_ms)
+                self.write_chunk(
+                    chunk({"tool_calls": [{"index": 0, "function": {"arguments": piece}}]})
+                )
+        else:
+            for index, piece in enumerate(re.findall(r"\s*\S+", content or "")):
+                if index:
+                    self.pause(self.config.itl_ms)
+                self.write_chunk(chunk({"content": piece}))
+        self.write_chunk(chunk({}, finish=finish_reason))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self.write_chunk(chunk({}, with_usage=True))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_chunk(self, data: bytes):
+        """One HTTP/1.1 chunk; an empty one ends the body."""
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def embeddings(self, request: dict):
+        texts = request.get("input")
+        if isinstance(texts, str) or (texts and isinstance(texts[0], int)):
+            texts = [texts]
+        dim = request.get("dimensions") or self.config.embedding_dim
+        self.pause(self.config.ttft_ms)
+        data = []
+        for index, text in enumerate(texts):
+            # Deterministic unit vector per text
+            seed = hashlib.sha256(json.dumps(text).encode()).digest()
+            rng = random.Random(seed)
+            vector = [rng.gauss(0, 1) for _ in range(dim)]
+            norm = sum(v * v for v in vector) ** 0.5
+            vector = [v / norm for v in vector]
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode()
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = _count_tokens(texts)
+        self.reply(
+            200,
+            {
+                "object": "list",
+                "data": data,
+                "model": request.get("model", "text-embedding-3-small"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            },
+        )
+
+    def images(self, raw: bytes):
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            request = json.loads(raw)
+        else:
+            # Edits and variations are multipart uploads
+            request = {
+                name.decode(): value.decode()
+                for name, value in re.findall(
+                    rb'name="(n|response_format)"\r\n\r\n([^\r]*)', raw
+                )
+            }
+        self.pause(self.config.ttft_ms)
+        if request.get("response_format") == "b64_json":
+            item = {"b64_json": base64.b64encode(png(self.config.image_bytes)).decode()}
+        else:
+            host = self.headers.get("Host", "127.0.0.1")
+            item = {"url": f"http://{host}/v1/mock/image.png"}
+        item["revised_prompt"] = request.get("prompt")
+        self.reply(
+            200,
+            {"created": int(time.time()), "data": [item] * int(request.get("n") or 1)},
+        )
+
+    def transcription(self, raw: bytes):
+        match = re.search(rb'name="response_format"\r\n\r\n([^\r]*)', raw)
+        response_format = match.group(1).decode() if match else "json"
+        text = " ".join(WORDS[: self.config.completion_tokens])
+        self.pause(self.config.ttft_ms)
+        if response_format in ("text", "srt", "vtt"):
+            self.reply(200, text, "text/plain")
+        else:
+            self.reply(200, {"text": text})
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    # Listen backlog for bursts of concurrent connections (the stdlib's is 5)
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class MockOpenAIServer:
+    """The mock server on a background thread; ``base_url`` is for the SDK."""
+
+    def __init__(self, config: MockConfig | None = None, port: int = 0):
+        config = config or MockConfig()
+        handler = type(
+            "ConfiguredMockHandler",
+            (MockHandler,),
+            {"config": config, "rng": random.Random(config.seed), "lock": threading.Lock()},
+        )
+        self.server = _MockHTTPServer(("127.0.0.1", port), handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        threading.Thread(
+            target=self.server.serve_forever, name="mock-openai", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """--ttft-ms, --itl-ms, ... for every MockConfig field."""
+    for name, default in vars(MockConfig()).items():
+        parser.add_argument(
+            "--" + name.replace("_", "-"), type=type(default), default=default
+        )
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(**{name: getattr(args, name) for name in vars(MockConfig())})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = MockOpenAIServer(config_from_args(args), port=args.port)
+    print(f"Mock OpenAI API on {server.base_url} (OPENAI_BASE_URL={server.base_url})")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Content-addressed storage for chat attachments (uploaded images and audio).
+
+Each file is stored once under ``ATTACHMENT_DIR``, named by the SHA-256 of its
+bytes, so the same upload saved twice takes the space of one. The
+``attachments`` table keeps the MIME type, size and a reference count per
+hash; messages only store the hash. When the last message referencing a
+file releases it, its row goes; the file itself is deleted later by
+remove_orphans(), never inside the transaction that might still roll back.
+
+Several databases can share the store (chat.db, the form app's
+chat_history.db, a migration target). Each one that takes a reference is
+listed in ``ATTACHMENT_DIR/databases.txt``, and a file is only an orphan
+when none of them references it.
+
+    python -m db.attachment_store chat.db   # delete unreferenced files
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import BinaryIO
+
+ATTACHMENT_DIR = "attachments"
+
+# Files younger than this are never removed as orphans: the add_ref() of a
+# fresh upload may still be waiting in the write queue.
+ORPHAN_GRACE_SECONDS = 60 * 60
+
+# Databases keeping reference counts for the store, one absolute path a line.
+REGISTRY = "databases.txt"
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the formats the chat apps accept for upload.
+MAGIC_NUMBERS = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"ID3", "audio/mpeg"),
+    (b"\xff\xfb", "audio/mpeg"),
+    (b"\xff\xf3", "audio/mpeg"),
+    (b"\xff\xf2", "audio/mpeg"),
+    (b"OggS", "audio/ogg"),
+    (b"fLaC", "audio/flac"),
+]
+
+
+def init_attachments(conn: sqlite3.Connection):
+    """Create the attachments table if it doesn't exist."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS attachments (
+            sha256 TEXT PRIMARY KEY,
+            mime_type TEXT,
+            size INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+
+
+_registered: set[str] = set()
+_registry_lock = threading.Lock()
+
+
+def _database_path(conn: sqlite3.Connection) -> str:
+    """The file of ``conn``'s main database ("" for an in-memory one)."""
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def registered_databases() -> list[str]:
+    """Every database that has taken a reference to a file in the store."""
+    try:
+        with open(os.path.join(ATTACHMENT_DIR, REGISTRY)) as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def register_database(conn: sqlite3.Connection):
+    """List ``conn``'s database among those remove_orphans() checks."""
+    path = _database_path(conn)
+    if not path or path in _registered:
+        return
+    with _registry_lock:
+        if path not in registered_databases():
+            os.makedirs(ATTACHMENT_DIR, exist_ok=True)
+            with open(os.path.join(ATTACHMENT_DIR, REGISTRY), "a") as f:
+                f.write(path + "\n")
+        _registered.add(path)
+
+
+def attachment_path(sha256: str) -> str:
+    """Path of an attachment; files are fanned out by the first two hex digits."""
+    return os.path.join(ATTACHMENT_DIR, sha256[:2], sha256)
+
+
+def guess_mime_type(head: bytes, default: str = "application/octet-stream") -> str:
+    """Guess a MIME type from the first bytes of a file."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        return "audio/mp4"
+    for magic, mime_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime_type
+    return default
+
+
+def save_attachment(source: bytes | BinaryIO) -> str:
+    """
+    Write bytes or a readable binary stream into the store and return its hash.
+
+    The content is hashed while it is copied to a temporary file, so large
+    uploads are never held in memory twice. If a file with the same hash
+    already exists the copy is discarded. This only writes the file; the
+    reference is taken by add_ref() when the owning message is saved.
+    """
+    os.makedirs(ATTACHMENT_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=ATTACHMENT_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            if isinstance(source, (bytes, bytearray)):
+                digest.update(source)
+                tmp_file.write(source)
+            else:
+                while chunk := source.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+        sha256 = digest.hexdigest()
+        final_path = attachment_path(sha256)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            # Uploaded again: restart its grace period (remove_orphans)
+            os.utime(final_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return sha256
+
+
+def open_attachment(sha256: str) -> BinaryIO:
+    """Open an attachment for streaming reads."""
+    return open(attachment_path(sha256), "rb")
+
+
+def read_attachment(sha256: str) -> bytes:
+    """Read a whole attachment into memory."""
+    with open_attachment(sha256) as f:
+        return f.read()
+
+
+def add_ref(conn: sqlite3.Connection, sha256: str, mime_type: str | None):
+    """Record one more message referencing an attachment (inside a transaction)."""
+    register_database(conn)
+    conn.execute(
+        """
+        INSERT INTO attachments (sha256, mime_type, size, ref_count)
+        VALUES (?,?,?,1)
+        ON CONFLICT(sha256) DO UPDATE SET ref_count = ref_count + 1
+        """,
+        (sha256, mime_type, os.path.getsize(attachment_path(sha256))),
+    )
+
+
+def release_ref(conn: sqlite3.Connection, sha256: str):
+    """
+    Drop one reference to an attachment (inside a transaction), and its row
+    once unreferenced. The file stays until remove_orphans().
+    """
+    conn.execute(
+        "UPDATE attachments SET ref_count = ref_count - 1 WHERE sha256=?", (sha256,)
+    )
+    conn.execute(
+        "DELETE FROM attachments WHERE sha256=? AND ref_count <= 0", (sha256,)
+    )
+
+
+def _referencing_databases(conn: sqlite3.Connection) -> list[sqlite3.Connection]:
+    """``conn`` and read-only connections to the other registered databases."""
+    own = _database_path(conn)
+    connections = [conn]
+    for path in registered_databases():
+        if path == own or not os.path.exists(path):
+            continue
+        connections.append(sqlite3.connect(f"file:{path}?mode=ro", uri=True))
+    return connections
+
+
+def remove_orphans(
+    conn: sqlite3.Connection, grace_seconds: float = ORPHAN_GRACE_SECONDS
+) -> int:
+    """
+    Delete files that no registered database references, and temporary files
+    of interrupted saves, once they are older than ``grace_seconds``.
+
+    Unreferenced files are left behind when the last message referencing a
+    file is deleted, or when an upload is saved but the message that would
+    have referenced it never is (e.g. the request failed). If a registered
+    database can't be read nothing is removed. Returns the number of files
+    removed.
+    """
+    if not os.path.isdir(ATTACHMENT_DIR):
+        return 0
+    register_database(conn)
+    cutoff = time.time() - grace_seconds
+    candidates = []
+    for dir_path, _, file_names in os.walk(ATTACHMENT_DIR):
+        for file_name in file_names:
+            if dir_path == ATTACHMENT_DIR and file_name == REGISTRY:
+                continue
+            path = os.path.join(dir_path, file_name)
+            try:
+                if os.path.getmtime(path) <= cutoff:
+                    candidates.append((path, file_name))
+            except FileNotFoundError:
+                continue
+    databases = _referencing_databases(conn)
+    try:
+        orphans = [
+            path
+            for path, file_name in candidates
+            if file_name.endswith(".tmp")
+            or not any(
+                db.execute(
+                    "SELECT 1 FROM attachments WHERE sha256=?", (file_name,)
+                ).fetchone()
+                for db in databases
+            )
+        ]
+    except sqlite3.Error as e:
+        print(
+            f"Orphan sweep skipped, a database can't be read: {e!r}",
+            file=sys.stderr,
+        )
+        return 0
+    finally:
+        for db in databases[1:]:
+            db.close()
+    for path in orphans:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return len(orphans)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Delete attachment files no message references."
+    )
+    parser.add_argument(
+        "db", nargs="+", help="chat databases using ./attachments (registered)"
+    )
+    parser.add_argument(
+        "--grace-seconds",
+        type=float,
+        default=ORPHAN_GRACE_SECONDS,
+        help="keep files younger than this",
+    )
+    args = parser.parse_args()
+    connections = [sqlite3.connect(path) for path in args.db]
+    try:
+        for conn in connections[1:]:
+            register_database(conn)
+        removed = remove_orphans(connections[0], args.grace_seconds)
+        print(f"{removed} orphaned files removed")
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
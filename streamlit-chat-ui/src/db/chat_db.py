@@ -1,13 +1,20 @@
-import sqlite3
+from itertools import islice
+from typing import Iterable
 
+import streamlit as st
+from db.connection import get_connection, transaction
+from db.migrations import apply_migrations
 from model.chats_models import ChatMessage
 
+DB_NAME = "chat_history.db"
 
-# SQLite database setup
-def init_db():
-    conn = sqlite3.connect("chat_history.db")
+# Messages inserted per transaction by save_messages().
+BATCH_SIZE = 1000
+
+
+def create_tables(conn):
+    """Migration 1: the original chats/messages schema."""
     cursor = conn.cursor()
-    # Create tables
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS chats (
             id TEXT PRIMARY KEY,
@@ -23,62 +30,78 @@ def init_db():
             FOREIGN KEY (chat_id) REFERENCES chats (id)
         )
     """)
+
+
+def add_chat_index(conn):
+    """Migration 2: look up a chat's messages by index, in id order."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages (chat_id, id)"
+    )
+
+
+MIGRATIONS = [create_tables, add_chat_index]
+
+
+# SQLite database setup, once per process
+@st.cache_resource
+def init_db():
+    apply_migrations(get_connection(DB_NAME), MIGRATIONS)
     print("DB Tables created!")
-    conn.commit()
-    conn.close()
 
 
 def save_chat(chat_id, chat_name):
-    conn = sqlite3.connect("chat_history.db")
-    cursor = conn.cursor()
-
-    # Save chat metadata
-    cursor.execute(
-        "INSERT OR IGNORE INTO chats (id, name) VALUES (?, ?)", (chat_id, chat_name)
-    )
-    conn.commit()
-    conn.close()
+    with transaction(DB_NAME) as conn:
+        # Save chat metadata
+        conn.execute(
+            "INSERT OR IGNORE INTO chats (id, name) VALUES (?, ?)", (chat_id, chat_name)
+        )
     print("Saved the chat!")
 
 
-def save_messages(chat_id, messages: list[ChatMessage]):
-    conn = sqlite3.connect("chat_history.db")
-    cursor = conn.cursor()
-    # Save chat messages
-    print(f"messages : {messages}")
-    for msg in messages:
-        print(f"msg : {msg}")
-        cursor.execute(
-            """
-            INSERT INTO messages (chat_id, sender, message)
-            VALUES (?, ?, ?)
-            """,
-            (chat_id, msg.sender, msg.content),
-        )
-    conn.commit()
-    conn.close()
-    print("Saved the messages!")
+def save_messages(
+    chat_id, messages: Iterable[ChatMessage], batch_size: int = BATCH_SIZE
+) -> list[int]:
+    """
+    Bulk-insert messages for a chat and return their ids, in order.
+
+    ``messages`` may be any iterable, including a generator; it is consumed
+    ``batch_size`` messages at a time and each batch is inserted with one
+    executemany() and committed on its own, so only one batch is ever held in
+    memory and an import that fails part-way keeps the batches already saved.
+    """
+    ids = []
+    messages = iter(messages)
+    while batch := list(islice(messages, batch_size)):
+        with transaction(DB_NAME) as conn:
+            conn.executemany(
+                """
+                INSERT INTO messages (chat_id, sender, message)
+                VALUES (?, ?, ?)
+                """,
+                ((chat_id, msg.sender, msg.content) for msg in batch),
+            )
+            # AUTOINCREMENT ids are consecutive within one write transaction
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        ids.extend(range(last_id - len(batch) + 1, last_id + 1))
+    return ids
 
 
 def load_chats():
-    conn = sqlite3.connect("chat_history.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM chats")
+    cursor = get_connection(DB_NAME).execute("SELECT id, name FROM chats")
     chats = cursor.fetchall()
-    conn.close()
     print(f"Loaded chats : {chats}")
     return chats
 
 
 # Load chat messages by chat ID
 def load_messages(chat_id):
-    conn = sqlite3.connect("chat_history.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT sender, message FROM messages WHERE chat_id = ?", (chat_id,))
+    cursor = get_connection(DB_NAME).execute(
+        "SELECT sender, message FROM messages WHERE chat_id = ? ORDER BY id",
+        (chat_id,),
+    )
     messages = []
     for row in cursor.fetchall():
         sender, message = row
         messages.append(ChatMessage(sender=sender, content=message))
-    conn.close()
     print(f"Loaded messages : {messages}")
     return messages
@@ -0,0 +1,898 @@
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterable, Iterator
+
+import streamlit as st
+from db.attachment_store import add_ref, init_attachments, release_ref, remove_orphans
+from db.connection import get_connection
+from db.conversation_cache import get_conversation_cache
+from db.migrations import add_column, apply_migrations
+from db.write_behind import get_write_queue
+from llm.context import CONTEXT_TOKENS, message_tokens, text_message_tokens
+from model.chats_models import ChatMessage, ChatSummary, Conversation, SearchHit
+
+DB_NAME = "chat.db"
+
+# Number of most recent matching messages search_messages() ranks.
+SEARCH_CANDIDATES = 1000
+
+# Length of the excerpt shown for a search hit, in words.
+SNIPPET_WORDS = 16
+
+# Current UTC time with milliseconds, in CURRENT_TIMESTAMP's format.
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Number of messages fetched per "page" when a chat is opened or scrolled back.
+PAGE_SIZE = 50
+
+# Message status: a bot reply is "streaming" until its last chunk is saved.
+STREAMING = "streaming"
+COMPLETE = "complete"
+
+# A streamed reply is saved every CHECKPOINT_CHUNKS chunks (roughly tokens)
+# or CHECKPOINT_SECONDS seconds, whichever comes first.
+CHECKPOINT_CHUNKS = 20
+CHECKPOINT_SECONDS = 0.5
+
+# A reply still marked streaming that hasn't been saved for this long was
+# cut off: a live stream is checkpointed far more often (retries included).
+STALLED_SECONDS = 30
+
+# Replies this process is streaming right now (message_id); see is_stalled.
+_active_streams: set[str] = set()
+
+# The bot message every chat is created with.
+GREETING = "Hello, how can I help you?"
+
+
+def create_tables(conn):
+    """Migration 1: the original chats/messages schema."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id TEXT PRIMARY KEY,
+            name TEXT
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id TEXT PRIMARY KEY,
+            chat_id TEXT,
+            sender TEXT,
+            content TEXT
+        )
+    """
+    )
+
+
+def add_attachment_columns(conn):
+    """Migration 2: attachments live in the content-addressed store."""
+    for column in ("image_sha256", "image_mime", "audio_sha256", "audio_mime"):
+        add_column(conn, "messages", column, "TEXT")
+    init_attachments(conn)
+
+
+def add_ordering_and_timestamps(conn):
+    """
+    Migration 3: explicit per-chat message order, timestamps and indexes.
+
+    Existing messages are numbered in rowid order, which is the order they
+    were displayed in before ``seq`` existed.
+    """
+    add_column(conn, "messages", "seq", "INTEGER")
+    add_column(conn, "messages", "created_at", "TEXT")
+    add_column(conn, "messages", "updated_at", "TEXT")
+    add_column(conn, "chats", "created_at", "TEXT")
+    add_column(conn, "chats", "updated_at", "TEXT")
+    add_column(conn, "chats", "last_activity", "TEXT")
+    conn.execute(
+        """
+        UPDATE messages SET seq = ordered.seq
+        FROM (
+            SELECT rowid AS id,
+                   ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY rowid) AS seq
+            FROM messages
+        ) AS ordered
+        WHERE messages.rowid = ordered.id
+        """
+    )
+    conn.execute(
+        f"""
+        UPDATE messages
+        SET created_at = {NOW}, updated_at = {NOW}
+        WHERE created_at IS NULL
+        """
+    )
+    # Backfilled chats share one timestamp; list_chats() breaks ties by
+    # rowid, which keeps their current sidebar order.
+    conn.execute(
+        f"""
+        UPDATE chats
+        SET created_at = {NOW}, updated_at = {NOW}, last_activity = {NOW}
+        WHERE last_activity IS NULL
+        """
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_chat_seq ON messages (chat_id, seq)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chats_last_activity ON chats (last_activity)"
+    )
+
+
+def add_full_text_search(conn):
+    """
+    Migration 4: FTS5 index over message content, kept in sync by triggers.
+
+    messages_fts is an external-content table: it stores only the index and
+    reads the text back from messages by rowid. More columns (e.g. audio
+    transcripts) can be indexed by a later migration that recreates it.
+    """
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages',
+            content_rowid='rowid',
+            tokenize='porter unicode61'
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+        END
+    """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content)
+            VALUES ('delete', old.rowid, old.content);
+        END
+    """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update
+        AFTER UPDATE OF content ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content)
+            VALUES ('delete', old.rowid, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+        END
+    """
+    )
+    rebuild_search_index(conn)
+
+
+def add_message_status(conn):
+    """Migration 5: streamed replies are saved while they are generated."""
+    add_column(conn, "messages", "status", f"TEXT NOT NULL DEFAULT '{COMPLETE}'")
+
+
+def add_token_count(conn):
+    """Migration 6: token counts for building contexts (llm/context.py)."""
+    add_column(conn, "messages", "token_count", "INTEGER")
+    rows = conn.execute(
+        "SELECT rowid, content FROM messages WHERE status=?", (COMPLETE,)
+    ).fetchall()
+    conn.executemany(
+        "UPDATE messages SET token_count=? WHERE rowid=?",
+        ((text_message_tokens(content or ""), rowid) for rowid, content in rows),
+    )
+
+
+def create_summaries(conn):
+    """Migration 7: rolling chat summaries (llm/compaction.py)."""
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS summaries (
+            chat_id TEXT NOT NULL,
+            first_seq INTEGER NOT NULL,
+            last_seq INTEGER NOT NULL,
+            last_message_id TEXT NOT NULL,
+            content TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            created_at TEXT NOT NULL DEFAULT ({NOW}),
+            PRIMARY KEY (chat_id, last_seq)
+        )
+    """
+    )
+    # One process at a time compacts a chat; see Compactor._claim
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS compaction_leases (
+            chat_id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """
+    )
+
+
+def create_message_embeddings(conn):
+    """
+    Migration 8: message embeddings for cross-chat memory (llm/memory.py).
+
+    ``id`` is the embedding's row in the memory-mapped matrix, so rows are
+    only ever appended.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS message_embeddings (
+            id INTEGER PRIMARY KEY,
+            message_id TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            embedder TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            UNIQUE (message_id, embedder)
+        )
+    """
+    )
+
+
+def rebuild_search_index(conn):
+    """Re-index every message, e.g. after VACUUM has renumbered rowids."""
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+# Append new schema changes here; see db/migrations.py.
+MIGRATIONS = [
+    create_tables,
+    add_attachment_columns,
+    add_ordering_and_timestamps,
+    add_full_text_search,
+    add_message_status,
+    add_token_count,
+    create_summaries,
+    create_message_embeddings,
+]
+
+# Called as listener(chat_id, message) on the writer thread once a complete
+# message is committed; must not block.
+MessageListener = Callable[[str, ChatMessage], None]
+_message_listeners: list[MessageListener] = []
+
+# Called as listener(chat_id) once a chat's deletion is committed.
+ChatListener = Callable[[str], None]
+_delete_listeners: list[ChatListener] = []
+
+
+@st.cache_resource
+def init_db():
+    """
+    Create or upgrade the chat database schema.
+
+    Cached as a Streamlit resource so the migrations are checked once per
+    process instead of on every rerun. Images and audio still kept as base64
+    columns by older versions are moved into the attachment store first,
+    since messages are only read by hash. Attachment files no message uses
+    any more are removed in the background.
+    """
+    # Imported here: db.migrate_attachments imports this module
+    from db.migrate_attachments import legacy_columns, migrate
+
+    apply_migrations(get_connection(DB_NAME), MIGRATIONS)
+    if legacy_columns():
+        migrate()
+    threading.Thread(
+        target=lambda: remove_orphans(get_connection(DB_NAME)),
+        name="attachment-orphans",
+        daemon=True,
+    ).start()
+
+
+def list_chats() -> list[tuple[str, str]]:
+    """Return (chat_id, name) for every chat, least recently active first."""
+    c = get_connection(DB_NAME).cursor()
+    c.execute("SELECT chat_id, name FROM chats ORDER BY last_activity, rowid")
+    return c.fetchall()
+
+
+def load_messages_page(
+    chat_id: str, before: int | None = None, limit: int = PAGE_SIZE
+) -> tuple[list[ChatMessage], int | None]:
+    """
+    Load one page of a chat's messages, newest page first (keyset pagination).
+
+    Returns the page in display order (oldest to newest) and the cursor to pass
+    as ``before`` to fetch the next older page, or None when there is none.
+    Attachments are returned as hashes; their bytes are read from the
+    attachment store only when a message is rendered.
+    """
+    if before is None:
+        # SQLite integers are signed 64-bit.
+        before = 2**63 - 1
+    c = get_connection(DB_NAME).cursor()
+    c.execute(
+        """
+        SELECT seq, message_id, sender, content,
+               image_sha256, image_mime, audio_sha256, audio_mime, status,
+               token_count
+        FROM messages
+        WHERE chat_id=? AND seq < ?
+        ORDER BY seq DESC
+        LIMIT ?
+        """,
+        (chat_id, before, limit + 1),
+    )
+    rows = c.fetchall()
+    has_older = len(rows) > limit
+    rows = rows[:limit]
+    messages = [_message_from_row(row) for row in reversed(rows)]
+    return messages, (rows[-1][0] if has_older else None)
+
+
+def _message_from_row(row) -> ChatMessage:
+    (
+        _,
+        message_id,
+        sender,
+        content,
+        image_sha256,
+        image_mime,
+        audio_sha256,
+        audio_mime,
+        status,
+        token_count,
+    ) = row
+    return ChatMessage(
+        message_id=message_id,
+        sender=sender,
+        content=content,
+        image_sha256=image_sha256,
+        image_mime=image_mime,
+        audio_sha256=audio_sha256,
+        audio_mime=audio_mime,
+        status=status,
+        token_count=token_count,
+    )
+
+
+def load_summary(chat_id: str, db_path: str = DB_NAME) -> ChatSummary | None:
+    """The newest summary of a chat's older messages, if it has been compacted."""
+    row = (
+        get_connection(db_path)
+        .execute(
+            """
+            SELECT first_seq, last_seq, last_message_id, content, token_count
+            FROM summaries WHERE chat_id=?
+            ORDER BY last_seq DESC LIMIT 1
+            """,
+            (chat_id,),
+        )
+        .fetchone()
+    )
+    if row is None:
+        return None
+    first_seq, last_seq, last_message_id, content, token_count = row
+    return ChatSummary(
+        chat_id=chat_id,
+        first_seq=first_seq,
+        last_seq=last_seq,
+        last_message_id=last_message_id,
+        content=content,
+        token_count=token_count,
+    )
+
+
+def load_unsummarized(
+    chat_id: str,
+    before: int | None,
+    summary: ChatSummary | None,
+    budget: int = CONTEXT_TOKENS,
+) -> list[ChatMessage]:
+    """
+    The messages older than ``before`` (a conversation's older_cursor) that
+    ``summary`` doesn't cover, oldest first, up to ``budget`` tokens' worth.
+
+    build_context() needs every message after the summary, but the loaded
+    pages can start after the last message it covers; these are the ones
+    in between, to put in front of the loaded messages.
+    """
+    if before is None:
+        return []
+    rows = (
+        get_connection(DB_NAME)
+        .execute(
+            """
+            SELECT seq, message_id, sender, content,
+                   image_sha256, image_mime, audio_sha256, audio_mime, status,
+                   token_count
+            FROM messages
+            WHERE chat_id=? AND seq > ? AND seq < ?
+            ORDER BY seq DESC
+            """,
+            (chat_id, summary.last_seq if summary else -1, before),
+        )
+    )
+    messages, used = [], 0
+    for row in rows:
+        # Newest first, so the fetch stops once the budget is spent
+        used += row[9] or text_message_tokens(row[3] or "")
+        if used > budget:
+            break
+        messages.append(_message_from_row(row))
+    return messages[::-1]
+
+
+def load_messages_since(chat_id: str, seq: int) -> tuple[list[ChatMessage], int | None]:
+    """
+    Load a chat from message ``seq`` up to its newest message.
+
+    Used to jump to a search hit; returns the same (messages, cursor) pair as
+    load_messages_page() so older pages can still be loaded from there.
+    """
+    c = get_connection(DB_NAME).cursor()
+    c.execute("SELECT MAX(seq) FROM messages WHERE chat_id=?", (chat_id,))
+    newest = c.fetchone()[0] or 0
+    return load_messages_page(
+        chat_id, before=newest + 1, limit=max(newest - seq + 1, PAGE_SIZE)
+    )
+
+
+def get_conversation(chat_id: str) -> Conversation:
+    """
+    Return a chat from the process-wide conversation cache, loading its
+    newest page on a miss. The result is shared: don't modify it.
+    """
+    cache = get_conversation_cache()
+    conversation = cache.get(chat_id)
+    if conversation is None:
+        messages, cursor = load_messages_page(chat_id)
+        conversation = Conversation(
+            chat_id=chat_id, messages=messages, older_cursor=cursor
+        )
+        cache.put(conversation)
+    return conversation
+
+
+def load_older_messages(chat_id: str) -> Conversation:
+    """Prepend the next older page to a cached chat and return it."""
+    conversation = get_conversation(chat_id)
+    if conversation.older_cursor is None:
+        return conversation
+    older, cursor = load_messages_page(chat_id, before=conversation.older_cursor)
+
+    def prepend(current: Conversation) -> Conversation:
+        if current.older_cursor != conversation.older_cursor:
+            # Another session loaded this page first
+            return current
+        return current.model_copy(
+            update={"messages": older + current.messages, "older_cursor": cursor}
+        )
+
+    updated = get_conversation_cache().update(chat_id, prepend)
+    if updated is None:
+        # Evicted meanwhile; cache what was just built
+        updated = prepend(conversation)
+        get_conversation_cache().put(updated)
+    return updated
+
+
+def open_conversation_at(chat_id: str, seq: int) -> Conversation:
+    """Return a chat loaded at least back to message ``seq``, e.g. a search hit."""
+    conversation = get_conversation(chat_id)
+    if conversation.older_cursor is None or conversation.older_cursor <= seq:
+        return conversation
+    messages, cursor = load_messages_since(chat_id, seq)
+    conversation = Conversation(chat_id=chat_id, messages=messages, older_cursor=cursor)
+    get_conversation_cache().put(conversation)
+    return conversation
+
+
+def _search_words(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def fts_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query: every word must match, the last one
+    as a prefix so results show up while the user is still typing. Words are
+    quoted so FTS5 operators and punctuation in the input are taken literally.
+    """
+    terms = [f'"{word}"' for word in _search_words(text)]
+    if not terms:
+        return ""
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def make_snippet(content: str, words: list[str], size: int = SNIPPET_WORDS) -> str:
+    """
+    Cut ``size`` words of ``content`` around the first match, matches in bold.
+
+    A word counts as a match when it starts with a search word, which covers
+    the prefix search and most of what the porter stemmer folds together.
+    """
+    tokens = content.split()
+    is_match = [
+        any(token.lower().strip("*_`.,;:!?()[]\"'").startswith(w) for w in words)
+        for token in tokens
+    ]
+    first = is_match.index(True) if True in is_match else 0
+    start = max(0, min(first - size // 3, len(tokens) - size))
+    window = [
+        f"**{token}**" if match else token
+        for token, match in zip(tokens[start : start + size], is_match[start:])
+    ]
+    prefix = "… " if start > 0 else ""
+    suffix = " …" if start + size < len(tokens) else ""
+    return prefix + " ".join(window) + suffix
+
+
+def search_messages(
+    text: str, limit: int = 20, candidates: int = SEARCH_CANDIDATES
+) -> list[SearchHit]:
+    """
+    Full-text search over all chats, best matches first.
+
+    Ranking every match of a common word across a million messages is too
+    slow for search-as-you-type, so hits are ranked by bm25 among the
+    ``candidates`` most recent matching messages: FTS5 walks its index
+    newest-first and stops there, which bounds the cost of a query however
+    many messages match. Only the returned hits are then read from messages.
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+    c = get_connection(DB_NAME).cursor()
+    c.execute(
+        """
+        SELECT m.message_id, m.chat_id, c.name, m.seq, m.sender, m.content
+        FROM (
+            SELECT rowid, score FROM (
+                SELECT rowid, bm25(messages_fts) AS score
+                FROM messages_fts
+                WHERE messages_fts MATCH ?
+                ORDER BY rowid DESC
+                LIMIT ?
+            )
+            ORDER BY score
+            LIMIT ?
+        ) AS best
+        JOIN messages m ON m.rowid = best.rowid
+        JOIN chats c ON c.chat_id = m.chat_id
+        ORDER BY best.score
+        """,
+        (query, candidates, limit),
+    )
+    words = _search_words(text)
+    return [
+        SearchHit(
+            message_id=message_id,
+            chat_id=chat_id,
+            chat_name=chat_name or "",
+            seq=seq,
+            sender=sender,
+            snippet=make_snippet(content or "", words),
+        )
+        for message_id, chat_id, chat_name, seq, sender, content in c.fetchall()
+    ]
+
+
+def _insert_message(conn, chat_id: str, message: ChatMessage):
+    # seq is the next position in the chat, found through idx_messages_chat_seq
+    conn.execute(
+        f"""
+        INSERT INTO messages (message_id, chat_id, sender, content,
+                              image_sha256, image_mime, audio_sha256, audio_mime,
+                              status, token_count, seq, created_at, updated_at)
+        VALUES (?,?,?,?,?,?,?,?,?,?,
+                (SELECT COALESCE(MAX(seq), 0) + 1 FROM messages WHERE chat_id=?),
+                {NOW}, {NOW})
+        """,
+        (
+            message.message_id,
+            chat_id,
+            message.sender,
+            message.content,
+            message.image_sha256,
+            message.image_mime,
+            message.audio_sha256,
+            message.audio_mime,
+            message.status,
+            _stored_tokens(message),
+            chat_id,
+        ),
+    )
+    conn.execute(
+        f"UPDATE chats SET last_activity = {NOW} WHERE chat_id=?", (chat_id,)
+    )
+    if message.image_sha256:
+        add_ref(conn, message.image_sha256, message.image_mime)
+    if message.audio_sha256:
+        add_ref(conn, message.audio_sha256, message.audio_mime)
+
+
+def _stored_tokens(message: ChatMessage) -> int | None:
+    # A reply still streaming is counted once it's complete
+    return message_tokens(message) if message.status == COMPLETE else None
+
+
+def _counted(message: ChatMessage) -> ChatMessage:
+    """``message`` with its token count, as it is cached and saved."""
+    if message.token_count is not None or message.status != COMPLETE:
+        return message
+    return message.model_copy(update={"token_count": _stored_tokens(message)})
+
+
+def _update_message(conn, chat_id: str, message: ChatMessage):
+    conn.execute(
+        f"""
+        UPDATE messages SET content=?, status=?, token_count=?, updated_at={NOW}
+        WHERE message_id=?
+        """,
+        (
+            message.content,
+            message.status,
+            _stored_tokens(message),
+            message.message_id,
+        ),
+    )
+    if message.status == COMPLETE:
+        # A stalled reply finished after compaction moved past it: it isn't
+        # in the summaries covering its range, so drop them to be redone
+        conn.execute(
+            """
+            DELETE FROM summaries
+            WHERE chat_id=?
+              AND last_seq >= (SELECT seq FROM messages WHERE message_id=?)
+            """,
+            (chat_id, message.message_id),
+        )
+    conn.execute(
+        f"UPDATE chats SET last_activity = {NOW} WHERE chat_id=?", (chat_id,)
+    )
+
+
+def _insert_chat(conn, chat_id: str, name: str, first_message: ChatMessage):
+    conn.execute(
+        f"""
+        INSERT INTO chats (chat_id, name, created_at, updated_at, last_activity)
+        VALUES (?,?,{NOW},{NOW},{NOW})
+        """,
+        (chat_id, name),
+    )
+    _insert_message(conn, chat_id, first_message)
+
+
+def _rename_chat(conn, chat_id: str, new_name: str):
+    conn.execute(
+        f"UPDATE chats SET name=?, updated_at={NOW} WHERE chat_id=?",
+        (new_name, chat_id),
+    )
+
+
+def _delete_chat(conn, chat_id: str):
+    attachments = conn.execute(
+        "SELECT image_sha256, audio_sha256 FROM messages WHERE chat_id=?",
+        (chat_id,),
+    ).fetchall()
+    for sha256 in (sha256 for row in attachments for sha256 in row if sha256):
+        release_ref(conn, sha256)
+    conn.execute("DELETE FROM messages WHERE chat_id=?", (chat_id,))
+    conn.execute("DELETE FROM summaries WHERE chat_id=?", (chat_id,))
+    conn.execute("DELETE FROM message_embeddings WHERE chat_id=?", (chat_id,))
+    conn.execute("DELETE FROM chats WHERE chat_id=?", (chat_id,))
+
+
+def _append_to_cache(chat_id: str, message: ChatMessage):
+    get_conversation_cache().update(
+        chat_id,
+        lambda conversation: conversation.model_copy(
+            update={"messages": [*conversation.messages, message]}
+        ),
+    )
+
+
+def _replace_in_cache(chat_id: str, message: ChatMessage):
+    get_conversation_cache().update(
+        chat_id,
+        lambda conversation: conversation.model_copy(
+            update={
+                "messages": [
+                    message if cached.message_id == message.message_id else cached
+                    for cached in conversation.messages
+                ]
+            }
+        ),
+    )
+
+
+def _invalidate_on_failure(chat_id: str, future: Future) -> Future:
+    """Drop a chat from the cache if a queued write to it fails."""
+
+    def check(done: Future):
+        if done.exception() is not None:
+            get_conversation_cache().invalidate(chat_id)
+
+    future.add_done_callback(check)
+    return future
+
+
+def on_message_saved(listener: MessageListener):
+    """Have ``listener`` called with every complete message that is saved."""
+    if listener not in _message_listeners:
+        _message_listeners.append(listener)
+
+
+def on_chat_deleted(listener: ChatListener):
+    """Have ``listener`` called with the id of every chat that is deleted."""
+    if listener not in _delete_listeners:
+        _delete_listeners.append(listener)
+
+
+def _notify_on_commit(chat_id: str, message: ChatMessage, future: Future) -> Future:
+    if message.status != COMPLETE or not _message_listeners:
+        return future
+
+    def notify(done: Future):
+        if done.exception() is None:
+            for listener in _message_listeners:
+                listener(chat_id, message)
+
+    future.add_done_callback(notify)
+    return future
+
+
+def create_new_chat_in_db(chat_id: str, name: str, first_message: ChatMessage):
+    """Create a new chat row in the DB and insert the first message.
+
+    Waits for the write, so the chat is visible to list_chats() on return.
+    """
+    first_message = _counted(first_message)
+    _notify_on_commit(
+        chat_id,
+        first_message,
+        get_write_queue(DB_NAME).submit(
+            lambda conn: _insert_chat(conn, chat_id, name, first_message)
+        ),
+    ).result()
+    get_conversation_cache().put(
+        Conversation(chat_id=chat_id, messages=[first_message])
+    )
+
+
+def add_message_to_db(chat_id: str, message: ChatMessage) -> Future:
+    """Queue a new message for the given chat on the background writer.
+
+    The message is appended to the cached conversation right away, so
+    get_conversation() returns it before it is committed. Returns a future
+    that resolves once the message is committed.
+    """
+    message = _counted(message)
+    _append_to_cache(chat_id, message)
+    future = get_write_queue(DB_NAME).submit(
+        lambda conn: _insert_message(conn, chat_id, message)
+    )
+    return _notify_on_commit(chat_id, message, _invalidate_on_failure(chat_id, future))
+
+
+def update_message_in_db(chat_id: str, message: ChatMessage) -> Future:
+    """Queue new content and status for a saved message (matched by message_id)."""
+    message = _counted(message)
+    _replace_in_cache(chat_id, message)
+    future = get_write_queue(DB_NAME).submit(
+        lambda conn: _update_message(conn, chat_id, message)
+    )
+    return _notify_on_commit(chat_id, message, _invalidate_on_failure(chat_id, future))
+
+
+def is_stalled(message: ChatMessage) -> bool:
+    """
+    Whether a reply marked STREAMING was cut off and can be continued.
+
+    A reply this process is streaming never is. One streamed by another
+    session or process is only taken as stalled once its saved row hasn't
+    been updated for STALLED_SECONDS.
+    """
+    if message.status != STREAMING or message.message_id in _active_streams:
+        return False
+    row = (
+        get_connection(DB_NAME)
+        .execute(
+            """
+            SELECT status, (julianday('now') - julianday(updated_at)) * 86400
+            FROM messages WHERE message_id=?
+            """,
+            (message.message_id,),
+        )
+        .fetchone()
+    )
+    # Not committed yet (still queued), or finished elsewhere
+    if row is None or row[0] != STREAMING or row[1] is None:
+        return False
+    return row[1] >= STALLED_SECONDS
+
+
+def checkpointed_stream(
+    chat_id: str,
+    message: ChatMessage,
+    chunks: Iterable[str],
+    every_chunks: int = CHECKPOINT_CHUNKS,
+    every_seconds: float = CHECKPOINT_SECONDS,
+) -> Iterator[str]:
+    """
+    Pass a streamed reply through (e.g. to st.write_stream) while saving it.
+
+    ``message`` must already be saved with status STREAMING. The text
+    received so far is written to it every ``every_chunks`` chunks or
+    ``every_seconds`` seconds, and it is marked COMPLETE once ``chunks`` is
+    exhausted. If the stream stops early (the tab is closed, the script is
+    rerun, the request fails) the partial text is kept with status STREAMING.
+    Chunks are appended to ``message.content``, so passing an interrupted
+    message with a continuation request finishes it in place.
+    """
+    content = message.content
+    status = STREAMING
+    unsaved = 0
+    last_saved = time.monotonic()
+    _active_streams.add(message.message_id)
+    try:
+        for chunk in chunks:
+            content += chunk
+            unsaved += 1
+            yield chunk
+            if (
+                unsaved >= every_chunks
+                or time.monotonic() - last_saved >= every_seconds
+            ):
+                update_message_in_db(
+                    chat_id,
+                    message.model_copy(
+                        update={"content": content, "token_count": None}
+                    ),
+                )
+                unsaved = 0
+                last_saved = time.monotonic()
+        status = COMPLETE
+    finally:
+        _active_streams.discard(message.message_id)
+        update_message_in_db(
+            chat_id,
+            message.model_copy(
+                update={"content": content, "status": status, "token_count": None}
+            ),
+        )
+
+
+def update_chat_name_in_db(chat_id: str, new_name: str) -> Future:
+    """Queue a rename of an existing chat on the background writer."""
+    return get_write_queue(DB_NAME).submit(
+        lambda conn: _rename_chat(conn, chat_id, new_name)
+    )
+
+
+def delete_chat_in_db(chat_id: str):
+    """Delete a chat with its messages, summaries and embeddings, and release
+    its attachments.
+
+    Waits for the write, so the chat is gone from list_chats() on return.
+    The attachment files are deleted later by remove_orphans() (see init_db).
+    """
+    get_write_queue(DB_NAME).submit(lambda conn: _delete_chat(conn, chat_id)).result()
+    get_conversation_cache().invalidate(chat_id)
+    for listener in _delete_listeners:
+        listener(chat_id)
+
+
+def get_all_messages():
+    """Retrieve all messages from the DB (for demonstration purposes)."""
+    c = get_connection(DB_NAME).cursor()
+    c.execute(
+        """
+        SELECT chat_id, sender, content, image_sha256, audio_sha256
+        FROM messages
+        ORDER BY chat_id, seq
+        """
+    )
+    return c.fetchall()
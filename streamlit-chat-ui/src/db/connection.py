@@ -0,0 +1,127 @@
+import atexit
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+import streamlit as st
+
+# How long a connection waits on a locked database before raising
+# "database is locked" (milliseconds).
+BUSY_TIMEOUT_MS = 5000
+
+# Number of prepared statements sqlite3 keeps per connection.
+CACHED_STATEMENTS = 256
+
+
+class _ThreadConnection:
+    """A thread's connection, held in its thread-local storage.
+
+    Thread-local values are dropped when their thread ends, so a finalizer
+    on this holder closes the connection of a finished thread.
+    """
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+class ConnectionManager:
+    """Keep one long-lived SQLite connection per thread for a database file.
+
+    Streamlit runs every session on its own script thread, and sqlite3
+    connections must not be shared between threads, so each thread lazily
+    opens its own connection the first time it asks for one and reuses it
+    afterwards. Streamlit starts a new script thread on every rerun, so a
+    connection is closed as soon as its thread has finished. Connections are
+    opened in WAL mode so readers never block the writer, with a busy timeout
+    instead of failing immediately on a lock.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        busy_timeout_ms: int = BUSY_TIMEOUT_MS,
+        cached_statements: int = CACHED_STATEMENTS,
+    ):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: list[sqlite3.Connection] = []
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            cached_statements=self.cached_statements,
+            # Each connection is still only used by the thread that opened
+            # it; this just lets close_all() (atexit) and the finalizer of a
+            # finished thread close it.
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        # WAL makes NORMAL durable across application crashes; only a power
+        # loss can roll back the last transactions.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _release(self, conn: sqlite3.Connection):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use."""
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = _ThreadConnection(self._open())
+            weakref.finalize(holder, self._release, holder.conn)
+            self._local.holder = holder
+        return holder.conn
+
+    def open_connections(self) -> int:
+        """Number of connections currently open (one per live thread)."""
+        with self._lock:
+            return len(self._connections)
+
+    @contextmanager
+    def transaction(self):
+        """Yield the thread's connection and commit, or roll back on error."""
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def close_all(self):
+        """Close every connection opened by this manager."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+@st.cache_resource
+def get_connection_manager(db_path: str) -> ConnectionManager:
+    """Return the process-wide connection manager for ``db_path``."""
+    manager = ConnectionManager(db_path)
+    atexit.register(manager.close_all)
+    return manager
+
+
+def get_connection(db_path: str) -> sqlite3.Connection:
+    """Shortcut for the calling thread's connection to ``db_path``."""
+    return get_connection_manager(db_path).connection()
+
+
+@contextmanager
+def transaction(db_path: str):
+    """Run a block in a transaction on the calling thread's connection."""
+    with get_connection_manager(db_path).transaction() as conn:
+        yield conn
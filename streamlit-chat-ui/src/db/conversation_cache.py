@@ -0,0 +1,127 @@
+"""
+Process-wide LRU cache of decoded conversations.
+
+Every session of a Streamlit process reads conversations through one shared
+cache instead of keeping its own copy in ``st.session_state``, so memory
+grows with the number of chats recently opened rather than with sessions ×
+history. Entries are evicted least recently used first once there are more
+than ``max_conversations`` of them or their estimated size passes
+``max_bytes``.
+
+Cached conversations are shared between sessions and threads and must not
+be mutated; changes go through update(), which swaps in a new object. The
+persistence layer (db/chat_store.py) applies its own writes here and drops
+an entry when a write fails. Writes made by other processes are only seen
+once an entry has been evicted.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import streamlit as st
+from model.chats_models import Conversation
+
+MAX_CONVERSATIONS = 100
+
+MAX_BYTES = 64 * 1024 * 1024
+
+# Rough per-message cost on top of its text: the pydantic object, its ids
+# and attachment hashes. Attachment bytes are never cached.
+MESSAGE_OVERHEAD = 600
+
+
+def conversation_size(conversation: Conversation) -> int:
+    """Estimate the memory held by a cached conversation, in bytes."""
+    return sum(
+        len(message.content) + MESSAGE_OVERHEAD for message in conversation.messages
+    )
+
+
+class ConversationCache:
+    def __init__(
+        self, max_conversations: int = MAX_CONVERSATIONS, max_bytes: int = MAX_BYTES
+    ):
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[Conversation, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chat_id: str) -> Conversation | None:
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(chat_id)
+            return entry[0]
+
+    def put(self, conversation: Conversation):
+        with self._lock:
+            self._store(conversation)
+
+    def update(
+        self, chat_id: str, change: Callable[[Conversation], Conversation]
+    ) -> Conversation | None:
+        """
+        Replace a cached conversation with ``change(conversation)``.
+
+        ``change`` runs under the cache lock, so it must be quick and must not
+        touch the database. Returns the new conversation, or None when
+        ``chat_id`` is not cached (nothing to keep in sync).
+        """
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                return None
+            conversation = change(entry[0])
+            self._store(conversation)
+            return conversation
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            entry = self._entries.pop(chat_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "conversations": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _store(self, conversation: Conversation):
+        old = self._entries.pop(conversation.chat_id, None)
+        if old is not None:
+            self._bytes -= old[1]
+        size = conversation_size(conversation)
+        self._entries[conversation.chat_id] = (conversation, size)
+        self._bytes += size
+        # The newest entry always stays, even when it alone is over max_bytes
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_conversations
+            or self._bytes > self.max_bytes
+        ):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+
+@st.cache_resource
+def get_conversation_cache() -> ConversationCache:
+    """Return the conversation cache shared by every session of this process."""
+    return ConversationCache()
@@ -0,0 +1,96 @@
+"""
+One-shot migration of base64 image/audio columns into the attachment store.
+
+Older versions of the multimodal chatbots stored uploads as base64 TEXT in
+messages.image and messages.audio. This moves every such value into the
+content-addressed attachment store, records its hash and MIME type on the
+message, then drops the old columns and vacuums the database to give the
+space back (re-indexing full-text search afterwards).
+
+The chat apps run it on their first start after an upgrade (chat_store's
+init_db), so chats never show the old columns' images as missing. It can
+also be run by hand from streamlit-chat-ui/src (next to chat.db):
+    python -m db.migrate_attachments
+"""
+
+import argparse
+import base64
+
+from db.attachment_store import add_ref, guess_mime_type, save_attachment
+from db.chat_store import DB_NAME, init_db, rebuild_search_index
+from db.connection import get_connection, transaction
+
+LEGACY_COLUMNS = {"image": "image/jpeg", "audio": "audio/wav"}
+
+
+def legacy_columns() -> list[str]:
+    """Return the base64 columns still present on the messages table."""
+    rows = get_connection(DB_NAME).execute("PRAGMA table_info(messages)").fetchall()
+    names = {row[1] for row in rows}
+    return [column for column in LEGACY_COLUMNS if column in names]
+
+
+def migrate(batch_size: int = 100) -> int:
+    """Move base64 attachments into the store in batches; returns rows migrated."""
+    columns = legacy_columns()
+    if not columns:
+        print("No base64 attachment columns left, nothing to migrate.")
+        return 0
+
+    select = f"""
+        SELECT rowid, {", ".join(columns)} FROM messages
+        WHERE rowid > ? AND ({" OR ".join(f"{c} IS NOT NULL" for c in columns)})
+        ORDER BY rowid
+        LIMIT ?
+    """
+    migrated = 0
+    last_rowid = 0
+    while True:
+        # One transaction per batch: each row is read, stored and rewritten
+        # together, so an interrupted run resumes where it stopped.
+        with transaction(DB_NAME) as conn:
+            rows = conn.execute(select, (last_rowid, batch_size)).fetchall()
+            if not rows:
+                break
+            for rowid, *values in rows:
+                for column, value in zip(columns, values):
+                    if not value:
+                        continue
+                    data = base64.b64decode(value)
+                    sha256 = save_attachment(data)
+                    mime_type = guess_mime_type(data[:16], LEGACY_COLUMNS[column])
+                    conn.execute(
+                        f"""
+                        UPDATE messages
+                        SET {column}_sha256=?, {column}_mime=?, {column}=NULL
+                        WHERE rowid=?
+                        """,
+                        (sha256, mime_type, rowid),
+                    )
+                    add_ref(conn, sha256, mime_type)
+                last_rowid = rowid
+                migrated += 1
+        print(f"Migrated {migrated} messages...")
+
+    conn = get_connection(DB_NAME)
+    for column in columns:
+        conn.execute(f"ALTER TABLE messages DROP COLUMN {column}")
+    conn.commit()
+    conn.execute("VACUUM")
+    # VACUUM may renumber the rowids the full-text index refers to.
+    with conn:
+        rebuild_search_index(conn)
+    print(f"Done: {migrated} messages migrated, dropped columns {columns}.")
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    init_db()
+    migrate(batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
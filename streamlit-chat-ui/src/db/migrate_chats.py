@@ -0,0 +1,339 @@
+"""
+Stream the chat databases written by the different apps into one chat.db.
+
+Three incompatible layouts exist:
+
+- ``chat_store``: chats(chat_id, name) / messages(message_id, ...) written by
+  the 6/7/8 chatbots to chat.db, with base64 image/audio columns or, since
+  the attachment store, image_sha256/audio_sha256.
+- ``chat_db``: chats(id, name) / messages(id, chat_id, sender, message) written
+  by db/chat_db.py to chat_history.db.
+- ``form_openai``: chat_history(id, name) / messages(..., image_path) written
+  by multi-modal-images/chatbot_multimodal_image-form-openai.py.
+
+Each source is detected from its tables and copied into the canonical schema
+of db/chat_store.py. Rows are read with fetchmany() and written with
+executemany() one chunk per transaction, so memory use does not grow with the
+size of the source. The position reached in each source is saved in the
+target in the same transaction as the chunk, so an interrupted run picks up
+where it stopped when started again with the same arguments.
+
+form_openai image paths (``uploaded_images/<uuid>_<name>``, or
+``attachments/<xx>/<sha256>`` since that app uses the attachment store) are
+relative to the directory that app ran from, which is taken to be the
+directory of its database; pass --attachments-root when the files are
+elsewhere. Attachments whose files are missing are skipped and counted in the
+final report.
+
+Run from streamlit-chat-ui/src (attachments are written to ./attachments):
+    python -m db.migrate_chats --target unified_chat.db \\
+        chat.db chat_history.db multi-modal-images/chat_history.db
+"""
+
+import argparse
+import base64
+import os
+import sqlite3
+import uuid
+
+from db.attachment_store import add_ref, guess_mime_type, save_attachment
+from db.chat_store import MIGRATIONS, NOW
+from db.connection import ConnectionManager
+from db.migrations import apply_migrations, has_column
+
+CHUNK_SIZE = 1000
+
+# Namespace for the message_id given to rows that only had an integer id, so
+# re-running the migration produces the same ids and skips copied rows.
+MESSAGE_NAMESPACE = uuid.UUID("6f1c7d52-3a0e-4b8e-9a43-7f7f5d8b2c11")
+
+
+def detect_kind(conn: sqlite3.Connection) -> str:
+    tables = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    }
+    if "chat_history" in tables:
+        return "form_openai"
+    if "chats" in tables and has_column(conn, "messages", "message_id"):
+        return "chat_store"
+    if "chats" in tables and has_column(conn, "messages", "message"):
+        return "chat_db"
+    raise ValueError("not a chat database written by one of the chat apps")
+
+
+def chats_query(kind: str) -> str:
+    if kind == "form_openai":
+        return "SELECT rowid, id, name FROM chat_history WHERE rowid > ? ORDER BY rowid"
+    if kind == "chat_db":
+        return "SELECT rowid, id, name FROM chats WHERE rowid > ? ORDER BY rowid"
+    return "SELECT rowid, chat_id, name FROM chats WHERE rowid > ? ORDER BY rowid"
+
+
+def messages_query(kind: str, conn: sqlite3.Connection) -> str:
+    """
+    Select (key, message_id, chat_id, sender, content, image_sha256,
+    image_mime, image_raw, audio_sha256, audio_mime, audio_raw), where
+    ``*_raw`` is base64 data or, for form_openai, a file path.
+    """
+    if kind == "chat_db":
+        return """
+            SELECT id, NULL, chat_id, sender, message,
+                   NULL, NULL, NULL, NULL, NULL, NULL
+            FROM messages WHERE id > ? ORDER BY id
+        """
+    if kind == "form_openai":
+        return """
+            SELECT id, NULL, chat_id, sender, content,
+                   NULL, NULL, image_path, NULL, NULL, NULL
+            FROM messages WHERE id > ? ORDER BY id
+        """
+    # chat_store: whichever attachment columns this version of the schema has
+    columns = [
+        column if has_column(conn, "messages", column) else "NULL"
+        for column in (
+            "image_sha256",
+            "image_mime",
+            "image",
+            "audio_sha256",
+            "audio_mime",
+            "audio",
+        )
+    ]
+    # rowid order is append order, which is also the order within each chat
+    return f"""
+        SELECT rowid, message_id, chat_id, sender, content, {", ".join(columns)}
+        FROM messages WHERE rowid > ? ORDER BY rowid
+    """
+
+
+def store_attachment(
+    kind: str,
+    sha256: str | None,
+    mime_type: str | None,
+    raw: str | None,
+    default_mime: str,
+    root: str = ".",
+) -> tuple[str | None, str | None]:
+    """
+    Bring one attachment into the store, returning its (sha256, mime).
+    Relative form_openai paths are resolved against ``root``.
+    """
+    if sha256:
+        # Already in the attachment store
+        return sha256, mime_type or default_mime
+    if not raw:
+        return None, None
+    if kind == "form_openai":
+        # A path under uploaded_images/, relative to where that app ran
+        path = os.path.join(root, raw)
+        if not os.path.exists(path):
+            print(f"  missing attachment file, skipped: {path}")
+            return None, None
+        with open(path, "rb") as f:
+            head = f.read(16)
+            f.seek(0)
+            return save_attachment(f), guess_mime_type(head, default_mime)
+    data = base64.b64decode(raw)
+    return save_attachment(data), guess_mime_type(data[:16], default_mime)
+
+
+class ChatMigrator:
+    def __init__(
+        self,
+        target_path: str,
+        chunk_size: int = CHUNK_SIZE,
+        attachments_root: str | None = None,
+    ):
+        self.chunk_size = chunk_size
+        self.attachments_root = attachments_root
+        # Attachments whose file or data could not be read, over all sources
+        self.skipped_attachments = 0
+        self.manager = ConnectionManager(target_path)
+        self.target = self.manager.connection()
+        apply_migrations(self.target, MIGRATIONS)
+        self.target.execute(
+            """
+            CREATE TABLE IF NOT EXISTS migration_checkpoints (
+                source TEXT,
+                stage TEXT,
+                last_key INTEGER NOT NULL,
+                rows_copied INTEGER NOT NULL,
+                PRIMARY KEY (source, stage)
+            )
+        """
+        )
+        self.target.commit()
+
+    def checkpoint(self, source: str, stage: str) -> tuple[int, int]:
+        row = self.target.execute(
+            "SELECT last_key, rows_copied FROM migration_checkpoints "
+            "WHERE source=? AND stage=?",
+            (source, stage),
+        ).fetchone()
+        return row if row else (0, 0)
+
+    def save_checkpoint(self, source: str, stage: str, last_key: int, copied: int):
+        self.target.execute(
+            """
+            INSERT INTO migration_checkpoints (source, stage, last_key, rows_copied)
+            VALUES (?,?,?,?)
+            ON CONFLICT(source, stage)
+            DO UPDATE SET last_key=excluded.last_key, rows_copied=excluded.rows_copied
+            """,
+            (source, stage, last_key, copied),
+        )
+
+    def copy_stage(self, source_conn, source: str, stage: str, query: str, write):
+        """Copy one table chunk by chunk, resuming from its checkpoint."""
+        total = source_conn.execute(
+            f"SELECT COUNT(*) FROM ({query})", (-1,)
+        ).fetchone()[0]
+        last_key, copied = self.checkpoint(source, stage)
+        cursor = source_conn.execute(query, (last_key,))
+        while rows := cursor.fetchmany(self.chunk_size):
+            with self.target:
+                write(rows)
+                copied += len(rows)
+                self.save_checkpoint(source, stage, rows[-1][0], copied)
+            print(f"  {stage}: {copied}/{total}", end="\r", flush=True)
+        print(f"  {stage}: {copied}/{total}")
+
+    def migrate(self, source_path: str):
+        source = os.path.abspath(source_path)
+        source_conn = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        kind = detect_kind(source_conn)
+        print(f"{source_path} ({kind})")
+        root = self.attachments_root or os.path.dirname(source)
+
+        def write_chats(rows):
+            self.target.executemany(
+                f"""
+                INSERT OR IGNORE INTO chats
+                    (chat_id, name, created_at, updated_at, last_activity)
+                VALUES (?,?,{NOW},{NOW},{NOW})
+                """,
+                [(chat_id, name) for _, chat_id, name in rows],
+            )
+
+        def write_messages(rows):
+            rows = [
+                (
+                    row[1] or str(uuid.uuid5(MESSAGE_NAMESPACE, f"{source}:{row[0]}")),
+                    *row[2:],
+                )
+                for row in rows
+            ]
+            # Messages already in the target (same chat.db given twice, or a
+            # source shared by two apps) are skipped rather than re-counted.
+            ids = [row[0] for row in rows]
+            existing = {
+                message_id
+                for (message_id,) in self.target.execute(
+                    f"SELECT message_id FROM messages "
+                    f"WHERE message_id IN ({','.join('?' * len(ids))})",
+                    ids,
+                )
+            }
+            if existing:
+                print(f"  {len(existing)} messages already migrated, skipped")
+            batch = []
+            for (
+                message_id,
+                chat_id,
+                sender,
+                content,
+                image_sha256,
+                image_mime,
+                image_raw,
+                audio_sha256,
+                audio_mime,
+                audio_raw,
+            ) in rows:
+                if message_id in existing:
+                    continue
+                image_sha256, image_mime = store_attachment(
+                    kind, image_sha256, image_mime, image_raw, "image/jpeg", root
+                )
+                audio_sha256, audio_mime = store_attachment(
+                    kind, audio_sha256, audio_mime, audio_raw, "audio/wav", root
+                )
+                self.skipped_attachments += bool(image_raw and not image_sha256)
+                self.skipped_attachments += bool(audio_raw and not audio_sha256)
+                batch.append(
+                    (
+                        message_id,
+                        chat_id,
+                        sender,
+                        content or "",
+                        image_sha256,
+                        image_mime,
+                        audio_sha256,
+                        audio_mime,
+                        chat_id,
+                    )
+                )
+            self.target.executemany(
+                f"""
+                INSERT INTO messages
+                    (message_id, chat_id, sender, content,
+                     image_sha256, image_mime, audio_sha256, audio_mime,
+                     seq, created_at, updated_at)
+                VALUES (?,?,?,?,?,?,?,?,
+                        (SELECT COALESCE(MAX(seq), 0) + 1 FROM messages
+                         WHERE chat_id=?),
+                        {NOW}, {NOW})
+                """,
+                batch,
+            )
+            for row in batch:
+                if row[4]:
+                    add_ref(self.target, row[4], row[5])
+                if row[6]:
+                    add_ref(self.target, row[6], row[7])
+
+        self.copy_stage(source_conn, source, "chats", chats_query(kind), write_chats)
+        self.copy_stage(
+            source_conn,
+            source,
+            "messages",
+            messages_query(kind, source_conn),
+            write_messages,
+        )
+        source_conn.close()
+
+    def close(self):
+        self.manager.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sources", nargs="+", help="chat databases to migrate")
+    parser.add_argument("--target", required=True, help="unified chat database")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument(
+        "--attachments-root",
+        help="directory form_openai image paths are relative to "
+        "(default: the directory of each source database)",
+    )
+    args = parser.parse_args()
+
+    target = os.path.abspath(args.target)
+    if any(os.path.abspath(source) == target for source in args.sources):
+        parser.error("--target must be a different file from every source")
+
+    migrator = ChatMigrator(
+        args.target,
+        chunk_size=args.chunk_size,
+        attachments_root=args.attachments_root,
+    )
+    try:
+        for source in args.sources:
+            migrator.migrate(source)
+    finally:
+        migrator.close()
+    print(f"{migrator.skipped_attachments} attachments skipped")
+
+
+if __name__ == "__main__":
+    main()
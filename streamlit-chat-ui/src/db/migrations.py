@@ -0,0 +1,56 @@
+"""
+Versioned schema migrations keyed on SQLite's ``PRAGMA user_version``.
+
+A database's schema is described as an ordered list of migration steps. The
+database records how many of them it has applied in ``user_version``, and
+apply_migrations() runs only the steps after that, each in its own
+transaction together with the version bump, so a failed step leaves the
+database at the previous version. Steps are append-only: never edit or reorder
+a step that has shipped, add a new one instead.
+"""
+
+import sqlite3
+from typing import Callable
+
+Migration = Callable[[sqlite3.Connection], None]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    return any(row[1] == column for row in rows)
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """ALTER TABLE ... ADD COLUMN, skipped when the column already exists."""
+    if not has_column(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations: list[Migration]) -> int:
+    """
+    Bring the database up to ``len(migrations)`` and return the new version.
+
+    The write lock is taken before the version is re-read, so when several
+    processes start at once only one of them runs each step.
+    """
+    target = len(migrations)
+    if schema_version(conn) >= target:
+        return schema_version(conn)
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version >= target:
+                conn.rollback()
+                return version
+            migrations[version](conn)
+            conn.execute(f"PRAGMA user_version={version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        print(f"Applied migration {version + 1}: {migrations[version].__name__}")
@@ -0,0 +1,125 @@
+"""
+Write-behind queue that moves chat DB writes off the Streamlit script thread.
+
+Writes are queued as small functions of a connection and applied by a single
+background writer thread per database. The writer drains whatever has queued
+up (up to ``max_batch`` writes, waiting at most ``max_delay`` seconds for more)
+and commits the whole batch in one transaction, so a burst of messages costs
+one fsync instead of one per message. Because one thread does all the
+writing, sessions of the same process never contend for the write lock.
+
+Each queued write returns a ``concurrent.futures.Future``; call ``.result()``
+on it when the caller needs to read its own write back.
+"""
+
+import atexit
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import streamlit as st
+from db.connection import get_connection_manager
+
+Write = Callable[[sqlite3.Connection], object]
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    def __init__(self, db_path: str, max_batch: int = 256, max_delay: float = 0.05):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        # Makes checking _closed and queueing one step, so nothing is queued
+        # after _STOP, where the writer would never see it
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name=f"write-behind:{db_path}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, write: Write) -> Future:
+        """Queue ``write(conn)``; the future resolves once it is committed."""
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("write-behind queue is closed")
+            self._queue.put((write, future))
+        return future
+
+    def flush(self, timeout: float | None = None):
+        """Block until everything queued so far is committed."""
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout: float | None = None):
+        """Commit the remaining writes and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _next_batch(self) -> tuple[list, bool]:
+        """Wait for one write, then gather whatever else arrives shortly after."""
+        batch = []
+        item = self._queue.get()
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+        # The first write waits at most max_delay, however many follow it
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        conn = get_connection_manager(self.db_path).connection()
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if batch:
+                self._commit(conn, batch)
+
+    def _commit(self, conn: sqlite3.Connection, batch: list):
+        try:
+            with conn:
+                results = [write(conn) for write, _ in batch]
+        except Exception:
+            # Something in the batch failed and the transaction was rolled
+            # back; replay the writes one by one so only the bad one fails.
+            for write, future in batch:
+                try:
+                    with conn:
+                        result = write(conn)
+                except Exception as e:
+                    # Callers rarely wait on their futures; don't fail silently
+                    print(
+                        f"Write to {self.db_path} failed: {e!r}", file=sys.stderr
+                    )
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+@st.cache_resource
+def get_write_queue(db_path: str) -> WriteBehindQueue:
+    """Return the process-wide writer for ``db_path``, flushed at shutdown."""
+    writer = WriteBehindQueue(db_path)
+    atexit.register(writer.close)
+    return writer
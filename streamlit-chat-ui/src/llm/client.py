@@ -0,0 +1,157 @@
+"""
+One pooled HTTP client shared by every OpenAI call of the chat apps.
+
+Creating ``OpenAI()`` per script, or calling ``requests.post`` for the vision
+endpoint, opens a fresh TCP+TLS connection for every request. Here a single
+``httpx.Client`` per process keeps connections alive between requests and
+is shared by the OpenAI SDK client and by raw chat completion posts.
+HTTP/2 is used when the ``h2`` package is installed (``pip install
+httpx[http2]``), so concurrent requests are multiplexed over one
+connection; otherwise the pool falls back to HTTP/1.1 keep-alive.
+
+Pool limits, timeouts and prewarming are read from the environment (.env):
+
+    OPENAI_BASE_URL           API root, default https://api.openai.com/v1
+    OPENAI_HTTP2              "0" to force HTTP/1.1
+    OPENAI_MAX_CONNECTIONS    open connections at most (default 20)
+    OPENAI_MAX_KEEPALIVE      idle connections kept open (default 10)
+    OPENAI_KEEPALIVE_EXPIRY   seconds an idle connection is kept (default 60)
+    OPENAI_CONNECT_TIMEOUT    seconds (default 5)
+    OPENAI_TIMEOUT            seconds to wait for a response (default 60)
+    OPENAI_PREWARM            connections opened at startup (default 1, 0 = off)
+    OPENAI_RATE_LIMIT         "0" to turn off the shared RPM/TPM limiter
+    OPENAI_USAGE_LEDGER       "0" to stop recording usage
+
+Every request sent through the pool waits on the shared rate limiter in
+llm/rate_limiter.py first, and its usage and cost are recorded in the
+ledger of llm/usage_ledger.py.
+"""
+
+import importlib.util
+import os
+import threading
+
+import httpx
+import streamlit as st
+from dotenv import load_dotenv
+from llm.rate_limiter import RateLimitedTransport, RateLimiter, get_rate_limiter
+from llm.usage_ledger import LedgerTransport, UsageLedger, get_usage_ledger
+from openai import OpenAI
+
+load_dotenv()
+
+BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+HTTP2 = os.environ.get("OPENAI_HTTP2", "1") != "0"
+MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 20))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE", 10))
+KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 60))
+CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 60))
+PREWARM_CONNECTIONS = int(os.environ.get("OPENAI_PREWARM", 1))
+RATE_LIMIT = os.environ.get("OPENAI_RATE_LIMIT", "1") != "0"
+USAGE_LEDGER = os.environ.get("OPENAI_USAGE_LEDGER", "1") != "0"
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def create_http_client(
+    http2: bool = HTTP2,
+    max_connections: int = MAX_CONNECTIONS,
+    max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry: float = KEEPALIVE_EXPIRY,
+    connect_timeout: float = CONNECT_TIMEOUT,
+    read_timeout: float = READ_TIMEOUT,
+    rate_limiter: RateLimiter | None = None,
+    usage_ledger: UsageLedger | None = None,
+) -> httpx.Client:
+    """
+    Build a keep-alive connection pool (HTTP/2 when available), sending
+    every request through ``rate_limiter`` and recording every response in
+    ``usage_ledger`` when they are given.
+    """
+    transport = httpx.HTTPTransport(
+        http2=http2 and http2_available(),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+    )
+    if usage_ledger is not None:
+        # Inside the limiter, so latency doesn't include waiting for it
+        transport = LedgerTransport(transport, usage_ledger)
+    if rate_limiter is not None:
+        transport = RateLimitedTransport(transport, rate_limiter)
+    return httpx.Client(
+        transport=transport,
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+    )
+
+
+def prewarm(http_client: httpx.Client, base_url: str = BASE_URL, connections: int = 1):
+    """
+    Open ``connections`` pooled connections to ``base_url`` ahead of time, so
+    the first user request doesn't pay for DNS, TCP and TLS setup. The
+    requests are concurrent so each one takes its own connection; with
+    HTTP/2 one connection is enough. Failures are ignored, the real request
+    will report them.
+    """
+
+    def touch():
+        try:
+            http_client.head(base_url)
+        except httpx.HTTPError:
+            pass
+
+    threads = [threading.Thread(target=touch) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@st.cache_resource
+def get_http_client() -> httpx.Client:
+    """
+    Return this process's shared connection pool.
+
+    Prewarming runs in the background so it never delays the first render.
+    """
+    http_client = create_http_client(
+        rate_limiter=get_rate_limiter() if RATE_LIMIT else None,
+        usage_ledger=get_usage_ledger() if USAGE_LEDGER else None,
+    )
+    if PREWARM_CONNECTIONS > 0:
+        threading.Thread(
+            target=prewarm,
+            args=(http_client, BASE_URL, PREWARM_CONNECTIONS),
+            name="openai-prewarm",
+            daemon=True,
+        ).start()
+    return http_client
+
+
+@st.cache_resource
+def get_openai_client() -> OpenAI:
+    """
+    Return the OpenAI SDK client, sending its requests through the pool.
+
+    SDK retries are off; llm/resilience.py retries the calls instead.
+    """
+    return OpenAI(base_url=BASE_URL, http_client=get_http_client(), max_retries=0)
+
+
+def post_chat_completion(payload: dict) -> httpx.Response:
+    """
+    POST a raw chat completion request body through the pool.
+
+    For callers that build the JSON themselves (e.g. image questions); the
+    response is returned as is, check ``status_code`` before ``json()``.
+    """
+    return get_http_client().post(
+        f"{BASE_URL}/chat/completions",
+        headers={"Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}"},
+        json=payload,
+    )
@@ -0,0 +1,263 @@
+"""
+Rolling summarization of long chats, off the request path.
+
+A chat whose unsummarized messages pass ``threshold`` tokens is compacted:
+everything except the most recent ``keep_tokens`` worth of messages is
+folded into the chat's summary (the previous summary plus the new segment
+go to the model, which writes the updated one). Each summary is stored in
+the ``summaries`` table with the range of messages it covers
+(``first_seq``..``last_seq``); build_context() in llm/context.py then sends
+the newest summary followed by the messages after it.
+
+Compaction runs on one background worker thread per process; run() only
+queues the chat id, and a chat already queued is not queued twice. Several
+Streamlit processes can share the chat DB: a chat is compacted by whoever
+holds its lease in ``compaction_leases`` (others skip it), and summaries
+are keyed by (chat, last message covered), so redoing one is a no-op.
+
+    OPENAI_COMPACT_TOKENS       unsummarized tokens that trigger compaction
+                                (default 3000)
+    OPENAI_COMPACT_KEEP_TOKENS  most recent tokens kept verbatim (default 1000)
+    OPENAI_SUMMARY_MODEL        default gpt-4o-mini
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+import streamlit as st
+from db.chat_store import COMPLETE, DB_NAME, STALLED_SECONDS, STREAMING, load_summary
+from db.connection import get_connection
+from db.write_behind import get_write_queue
+from dotenv import load_dotenv
+from llm.context import ROLES, SUMMARY_PREFIX, text_message_tokens
+from llm.resilience import resilient_chat_completion
+from llm.usage_ledger import usage_tags
+from model.chats_models import ChatSummary
+
+load_dotenv()
+
+COMPACT_TOKENS = int(os.environ.get("OPENAI_COMPACT_TOKENS", 3000))
+KEEP_TOKENS = int(os.environ.get("OPENAI_COMPACT_KEEP_TOKENS", 1000))
+SUMMARY_MODEL = os.environ.get("OPENAI_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Seconds a compaction lease is held before another process may take over
+# (longer than a summary request with its retries takes).
+LEASE_SECONDS = 120
+
+SUMMARY_MAX_TOKENS = 500
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an "
+    "assistant. Update the summary with the new messages. Keep facts, names, "
+    "numbers, decisions, open questions and the user's preferences; drop "
+    "pleasantries. Write it in the third person, at most 300 words."
+)
+
+# (sender, content) of the messages to fold in, oldest first.
+Segment = list[tuple[str, str]]
+Summarizer = Callable[[str | None, Segment], str]
+
+
+def summarize_with_openai(previous: str | None, segment: Segment) -> str:
+    """The updated summary: ``previous`` (if any) extended with ``segment``."""
+    transcript = "\n".join(
+        f"{ROLES.get(sender, 'user')}: {content}" for sender, content in segment
+    )
+    response = resilient_chat_completion(
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {
+                "role": "user",
+                "content": f"Summary so far:\n{previous or '(none)'}\n\n"
+                f"New messages:\n{transcript}",
+            },
+        ],
+        temperature=0,
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+    return response.choices[0].message.content.strip()
+
+
+class Compactor:
+    def __init__(
+        self,
+        db_path: str = DB_NAME,
+        summarize: Summarizer = summarize_with_openai,
+        threshold: int = COMPACT_TOKENS,
+        keep_tokens: int = KEEP_TOKENS,
+        lease_seconds: float = LEASE_SECONDS,
+    ):
+        self.db_path = db_path
+        self.summarize = summarize
+        self.threshold = threshold
+        self.keep_tokens = keep_tokens
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="compaction"
+        )
+        self._queued: set[str] = set()
+        self._lock = threading.Lock()
+        self._stats = {"compactions": 0, "skipped": 0, "errors": 0}
+
+    def submit(self, chat_id: str) -> Future | None:
+        """Queue a compaction check for ``chat_id``; never blocks."""
+        with self._lock:
+            if chat_id in self._queued:
+                return None
+            self._queued.add(chat_id)
+        return self._executor.submit(self._run, chat_id)
+
+    def _run(self, chat_id: str) -> ChatSummary | None:
+        with self._lock:
+            self._queued.discard(chat_id)
+        try:
+            summary = self.compact(chat_id)
+        except Exception as e:
+            # A failed compaction only means the full history is sent a while
+            # longer; it is retried after the next reply
+            print(f"Compaction of chat {chat_id} failed: {e!r}", file=sys.stderr)
+            with self._lock:
+                self._stats["errors"] += 1
+            return None
+        with self._lock:
+            self._stats["compactions" if summary else "skipped"] += 1
+        return summary
+
+    def _segment(self, chat_id: str) -> tuple[ChatSummary | None, list[tuple]]:
+        """
+        The chat's current summary and the messages to fold into it next
+        (seq, message_id, sender, content rows), or none when the chat is
+        still under the threshold.
+
+        Replies that were cut off while streaming are left out; one that is
+        still being generated ends the segment. If a reply left out is
+        continued later, saving it drops the summaries covering it
+        (db/chat_store.py), so it is folded in when they are redone.
+        """
+        previous = load_summary(chat_id, self.db_path)
+        rows = (
+            get_connection(self.db_path)
+            .execute(
+                """
+                SELECT seq, message_id, sender, content, token_count, status,
+                       (julianday('now') - julianday(updated_at)) * 86400
+                FROM messages
+                WHERE chat_id=? AND seq > ?
+                ORDER BY seq
+                """,
+                (chat_id, previous.last_seq if previous else -1),
+            )
+            .fetchall()
+        )
+        counts = [
+            tokens or text_message_tokens(content or "")
+            for _, _, _, content, tokens, _, _ in rows
+        ]
+        if sum(counts) < self.threshold:
+            return previous, []
+        # Keep the newest messages verbatim; a reply still streaming and
+        # everything after it stays unsummarized too
+        end, kept = len(rows), 0
+        while end > 0 and kept + counts[end - 1] <= self.keep_tokens:
+            end -= 1
+            kept += counts[end]
+        for index, row in enumerate(rows[:end]):
+            status, age = row[5], row[6]
+            if status == STREAMING and age is not None and age < STALLED_SECONDS:
+                end = index
+                break
+        return previous, [
+            row[:4] for row in rows[:end] if row[3] and row[5] == COMPLETE
+        ]
+
+    def _claim(self, chat_id: str) -> bool:
+        """Take (or renew) this chat's lease unless another process holds it."""
+        now = time.time()
+
+        def claim(conn):
+            return conn.execute(
+                """
+                INSERT INTO compaction_leases (chat_id, owner, expires_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (chat_id) DO UPDATE
+                SET owner=excluded.owner, expires_at=excluded.expires_at
+                WHERE compaction_leases.owner=excluded.owner
+                   OR compaction_leases.expires_at < ?
+                """,
+                (chat_id, self.owner, now + self.lease_seconds, now),
+            ).rowcount
+
+        return get_write_queue(self.db_path).submit(claim).result() == 1
+
+    def _release(self, chat_id: str):
+        get_write_queue(self.db_path).submit(
+            lambda conn: conn.execute(
+                "DELETE FROM compaction_leases WHERE chat_id=? AND owner=?",
+                (chat_id, self.owner),
+            )
+        )
+
+    def compact(self, chat_id: str) -> ChatSummary | None:
+        """Fold the chat's older messages into its summary, if it is due."""
+        _, segment = self._segment(chat_id)
+        if not segment or not self._claim(chat_id):
+            return None
+        try:
+            # Re-read under the lease: another process may have just finished
+            previous, segment = self._segment(chat_id)
+            if not segment:
+                return None
+            with usage_tags(feature="summary", chat_id=chat_id):
+                content = self.summarize(
+                    previous.content if previous else None,
+                    [(sender, text) for _, _, sender, text in segment],
+                )
+            last_seq, last_message_id = segment[-1][0], segment[-1][1]
+            summary = ChatSummary(
+                chat_id=chat_id,
+                first_seq=previous.first_seq if previous else segment[0][0],
+                last_seq=last_seq,
+                last_message_id=last_message_id,
+                content=content,
+                token_count=text_message_tokens(SUMMARY_PREFIX + content),
+            )
+            get_write_queue(self.db_path).submit(
+                lambda conn: conn.execute(
+                    """
+                    INSERT OR IGNORE INTO summaries
+                        (chat_id, first_seq, last_seq, last_message_id,
+                         content, token_count)
+                    VALUES (?,?,?,?,?,?)
+                    """,
+                    (
+                        summary.chat_id,
+                        summary.first_seq,
+                        summary.last_seq,
+                        summary.last_message_id,
+                        summary.content,
+                        summary.token_count,
+                    ),
+                )
+            ).result()
+            return summary
+        finally:
+            self._release(chat_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._queued)
+        return stats
+
+
+@st.cache_resource
+def get_compactor() -> Compactor:
+    """Return this process's compaction worker for the chat database."""
+    return Compactor()
@@ -0,0 +1,151 @@
+"""
+Token-budgeted conversation context for the chat apps.
+
+build_context() turns a chat's history and the new user turn into the
+``messages`` of a chat completion request: the system prompt, then as many
+of the most recent earlier messages as fit in the token budget (walking
+back from the newest, stopping at the first one that doesn't fit, so the
+window is always contiguous), then the new turn. Older messages are
+dropped rather than truncated; once a chat has been compacted
+(llm/compaction.py) its summary stands in for the messages it covers.
+Messages recalled from the user's other chats (llm/memory.py) follow the
+system prompt and summary, last of the fixed part, as they change with
+every question.
+
+Each message is tokenized once: db/chat_store.py counts it when it is
+saved complete and keeps the count on ChatMessage.token_count (and in the
+DB), so assembling a context costs O(messages in the window), not O(chat
+length), and never re-tokenizes the chat. Counts use tiktoken when it is installed (it comes
+with langchain-openai) and about four characters per token otherwise.
+
+    OPENAI_CONTEXT_TOKENS   prompt budget for system prompt, history and new
+                            turn together (default 4000)
+"""
+
+import importlib.util
+import math
+import os
+from typing import Sequence
+
+from dotenv import load_dotenv
+from model.chats_models import ChatMessage, ChatSummary, MemorySnippet
+
+load_dotenv()
+
+CONTEXT_TOKENS = int(os.environ.get("OPENAI_CONTEXT_TOKENS", 4000))
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+# Tokenizer of the gpt-4o family.
+ENCODING = "o200k_base"
+
+# Overhead tokens per chat message (role, separators).
+MESSAGE_TOKENS = 4
+
+# Tokens counted for an image part (a high-detail 1024x1024 image).
+IMAGE_TOKENS = 765
+
+ROLES = {"bot": "assistant", "user": "user"}
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+MEMORY_PREFIX = (
+    "Possibly relevant messages from the user's other conversations "
+    "(use them only if they help):\n"
+)
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None and importlib.util.find_spec("tiktoken") is not None:
+        import tiktoken
+
+        _encoding = tiktoken.get_encoding(ENCODING)
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def content_tokens(content: str | list) -> int:
+    """Tokens of a message's ``content``: text, or a list of text/image parts."""
+    if isinstance(content, str):
+        return count_tokens(content)
+    return sum(
+        IMAGE_TOKENS if part.get("type") != "text" else count_tokens(part["text"])
+        for part in content
+    )
+
+
+def text_message_tokens(text: str) -> int:
+    """Tokens a plain-text message takes in the context, overhead included."""
+    return MESSAGE_TOKENS + count_tokens(text)
+
+
+def message_tokens(message: ChatMessage) -> int:
+    """
+    A message's tokens in the context: its saved count, or counted now for
+    one that has none. ``message`` is left as it is; cached messages are
+    shared between sessions.
+    """
+    if message.token_count is not None:
+        return message.token_count
+    return text_message_tokens(message.content or "")
+
+
+def memory_message(memories: Sequence[MemorySnippet]) -> str:
+    return MEMORY_PREFIX + "\n".join(
+        f"- [{memory.chat_name or 'chat'}] {ROLES.get(memory.sender, 'user')}: "
+        f"{memory.content}"
+        for memory in memories
+    )
+
+
+def build_context(
+    history: Sequence[ChatMessage],
+    new_turn: str | dict,
+    system_prompt: str | None = SYSTEM_PROMPT,
+    budget: int = CONTEXT_TOKENS,
+    summary: ChatSummary | None = None,
+    memories: Sequence[MemorySnippet] = (),
+) -> list[dict]:
+    """
+    The messages for a request: system prompt, the newest ``history`` that
+    fits in ``budget`` tokens, and ``new_turn`` (a question, or a complete
+    user message dict such as text plus an image).
+
+    With a ``summary``, it follows the system prompt and the history stops
+    at the last message it covers. ``memories`` from other chats come
+    after that, in one system message.
+
+    History messages contribute their text only; attachments and empty
+    messages (a reply still being streamed) are skipped.
+    """
+    if isinstance(new_turn, str):
+        new_turn = {"role": "user", "content": new_turn}
+    head = []
+    used = MESSAGE_TOKENS + content_tokens(new_turn["content"])
+    if system_prompt:
+        head.append({"role": "system", "content": system_prompt})
+        used += MESSAGE_TOKENS + count_tokens(system_prompt)
+    if summary is not None:
+        head.append({"role": "system", "content": SUMMARY_PREFIX + summary.content})
+        used += summary.token_count
+    if memories:
+        recalled = memory_message(memories)
+        head.append({"role": "system", "content": recalled})
+        used += text_message_tokens(recalled)
+    window = []
+    for message in reversed(history):
+        if summary is not None and message.message_id == summary.last_message_id:
+            break
+        if not message.content:
+            continue
+        used += message_tokens(message)
+        if used > budget:
+            break
+        window.append(
+            {"role": ROLES.get(message.sender, "user"), "content": message.content}
+        )
+    return [*head, *reversed(window), new_turn]
@@ -0,0 +1,516 @@
+"""
+Cross-chat memory: recall what the user said in their other chats.
+
+Every complete message saved through db/chat_store.py is embedded in the
+background and its embedding is stored as a float32 blob in the chat DB's
+``message_embeddings`` table. That table is the source of truth; for
+search the vectors are also kept in a memory-mapped matrix file (row i is
+the embedding with id i), so a process starts without reading every blob
+and the OS page cache, not the Python heap, holds the vectors. A question
+is embedded and scored against the matrix with one matrix-vector product
+per block of rows; the best ``top_k`` messages from other chats that score
+at least ``min_score`` are sent with the request (see build_context() in
+llm/context.py).
+
+Indexing is incremental: chat_store calls the memory's listener once a
+complete message is committed (streamed replies once they are finished),
+and a single worker thread embeds queued messages in batches. Messages
+saved while no process was indexing are picked up by backfill() when the
+memory is created. Rows another process added are read into the matrix
+before each search. The greeting every chat opens with and error notices
+are not indexed.
+
+Deleting a chat deletes its embeddings in the same transaction; the
+memory's delete listener then zeroes their matrix rows and leaves them out
+of searches. Rows deleted by another process are dropped the first time a
+search finds them, and backfill() also purges embeddings left behind by
+older versions.
+
+Configured from the environment (.env); embeddings use the semantic
+cache's embedder settings (OPENAI_SEMANTIC_EMBEDDER, OPENAI_EMBEDDING_MODEL):
+
+    OPENAI_MEMORY               "1" (default) or "0" to turn recall off
+    OPENAI_MEMORY_INDEX         path prefix of the matrix files
+                                (default chat_memory)
+    OPENAI_MEMORY_TOP_K         messages recalled per question (default 3)
+    OPENAI_MEMORY_MIN_SCORE     similarity a message needs (default 0.4)
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import streamlit as st
+from db.chat_store import (
+    COMPLETE,
+    DB_NAME,
+    GREETING,
+    MIGRATIONS,
+    on_chat_deleted,
+    on_message_saved,
+)
+from db.connection import get_connection
+from db.migrations import apply_migrations
+from db.write_behind import get_write_queue
+from dotenv import load_dotenv
+from llm.semantic_cache import (
+    EMBEDDER,
+    EMBEDDING_MODEL,
+    Embedder,
+    HashingEmbedder,
+    OpenAIEmbedder,
+)
+from llm.usage_ledger import usage_tags
+from model.chats_models import ChatMessage, MemorySnippet
+
+load_dotenv()
+
+MEMORY_ENABLED = os.environ.get("OPENAI_MEMORY", "1") != "0"
+INDEX_PATH = os.environ.get("OPENAI_MEMORY_INDEX", "chat_memory")
+TOP_K = int(os.environ.get("OPENAI_MEMORY_TOP_K", 3))
+MIN_SCORE = float(os.environ.get("OPENAI_MEMORY_MIN_SCORE", 0.4))
+
+# Characters of a message that are embedded, and sent when it is recalled.
+EMBED_CHARS = 4000
+SNIPPET_CHARS = 500
+
+# Messages embedded per API call.
+BATCH_SIZE = 64
+
+# Rows scored per matrix-vector product; bounds the temporary score arrays.
+BLOCK_ROWS = 1 << 16
+
+# Matrix file layout: int64 dim and synced id, padded to HEADER_BYTES, then
+# the float32 rows. The file grows by doubling, from INITIAL_ROWS.
+HEADER_BYTES = 64
+INITIAL_ROWS = 1024
+
+# Recall latencies kept for the stats.
+LATENCY_WINDOW = 1000
+
+# is_boilerplate() as SQL over messages ``m``, with GREETING as parameter.
+BOILERPLATE_SQL = "m.sender = 'bot' AND (m.content = ? OR m.content LIKE 'Error:%')"
+
+
+def is_boilerplate(message: ChatMessage) -> bool:
+    """A bot message with nothing to recall: the greeting or an error notice."""
+    return message.sender == "bot" and (
+        message.content == GREETING or message.content.startswith("Error:")
+    )
+
+
+class MemoryMatrix:
+    """
+    Float32 matrix in a memory-mapped file, one row per embedding id (rows
+    without an embedding stay zero). The header records the dimension and
+    the highest id written, so a restarted process only reads newer rows
+    from the DB.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        if not os.path.exists(path):
+            self.reset()
+        self._header = np.memmap(path, dtype=np.int64, mode="r+", shape=(2,))
+        if int(self._header[0]) != dim:
+            # Written by an embedder of another dimension; start over
+            self.reset()
+        self._map()
+
+    def reset(self):
+        """Empty the file: no rows synced."""
+        with open(self.path, "wb") as f:
+            f.write(np.array([self.dim, 0], dtype=np.int64).tobytes())
+            f.truncate(HEADER_BYTES + INITIAL_ROWS * self.dim * 4)
+        if hasattr(self, "_header"):
+            self._header = np.memmap(self.path, dtype=np.int64, mode="r+", shape=(2,))
+            self._map()
+
+    def _map(self):
+        capacity = (os.path.getsize(self.path) - HEADER_BYTES) // (self.dim * 4)
+        self.rows = np.memmap(
+            self.path,
+            dtype=np.float32,
+            mode="r+",
+            offset=HEADER_BYTES,
+            shape=(capacity, self.dim),
+        )
+
+    @property
+    def synced(self) -> int:
+        """Highest embedding id whose row is in the file."""
+        return int(self._header[1])
+
+    def write(self, ids: np.ndarray, vectors: np.ndarray, synced: int):
+        """Store ``vectors`` at rows ``ids``; everything up to ``synced`` is in."""
+        needed = int(ids.max()) + 1
+        if needed > len(self.rows):
+            capacity = len(self.rows)
+            while capacity < needed:
+                capacity *= 2
+            size = HEADER_BYTES + capacity * self.dim * 4
+            # Another process may have grown the file already; never shrink it
+            if os.path.getsize(self.path) < size:
+                with open(self.path, "r+b") as f:
+                    f.truncate(size)
+            self._map()
+        self.rows[ids] = vectors
+        self.rows.flush()
+        self._header[1] = synced
+        self._header.flush()
+
+
+def top_k(
+    matrix: np.ndarray, query: np.ndarray, k: int, valid: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Rows of ``matrix`` (where ``valid``) with the highest dot product with
+    ``query``, best first: (row ids, scores).
+    """
+    ids, scores = [], []
+    for start in range(0, len(valid), BLOCK_ROWS):
+        block = matrix[start : start + BLOCK_ROWS] @ query
+        block[~valid[start : start + len(block)]] = -np.inf
+        best = (
+            np.argpartition(block, -k)[-k:] if len(block) > k else np.arange(len(block))
+        )
+        ids.append(best + start)
+        scores.append(block[best])
+    if not ids:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    ids, scores = np.concatenate(ids), np.concatenate(scores)
+    order = np.argsort(-scores)[:k]
+    keep = np.isfinite(scores[order])
+    return ids[order][keep], scores[order][keep]
+
+
+class ChatMemory:
+    def __init__(
+        self,
+        embedder: Embedder,
+        embedder_name: str,
+        db_path: str = DB_NAME,
+        index_path: str = INDEX_PATH,
+        top_k: int = TOP_K,
+        min_score: float = MIN_SCORE,
+    ):
+        self.embedder = embedder
+        self.embedder_name = embedder_name
+        self.db_path = db_path
+        self.top_k = top_k
+        self.min_score = min_score
+        digest = hashlib.sha256(embedder_name.encode()).hexdigest()[:8]
+        self.matrix_path = f"{index_path}.{digest}.f32"
+        self._matrix: MemoryMatrix | None = None
+        # Chat of each matrix row as a small int (-1: no embedding), so a
+        # search can leave out the asking chat without reading the DB
+        self._chat_codes: dict[str, int] = {}
+        self._row_chats = np.full(INITIAL_ROWS, -1, dtype=np.int32)
+        self._synced = 0
+        self._lock = threading.Lock()
+        self._pending: list[tuple[str, str, str]] = []
+        self._draining = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {"indexed": 0, "recalls": 0, "recalled": 0, "errors": 0}
+        conn = get_connection(db_path)
+        apply_migrations(conn, MIGRATIONS)
+        self._open(conn)
+
+    def _open(self, conn):
+        """Map the matrix file and catch it up with the DB."""
+        row = conn.execute(
+            "SELECT length(embedding), MAX(id) FROM message_embeddings WHERE embedder=?",
+            (self.embedder_name,),
+        ).fetchone()
+        if row[0] is None:
+            return
+        dim, newest = row[0] // 4, row[1]
+        self._matrix = MemoryMatrix(self.matrix_path, dim)
+        if self._matrix.synced > newest:
+            # The file belongs to a chat DB that has since been replaced
+            self._matrix.reset()
+        # Rows already in the file only need their chat
+        for embedding_id, chat_id in conn.execute(
+            "SELECT id, chat_id FROM message_embeddings WHERE embedder=? AND id<=?",
+            (self.embedder_name, self._matrix.synced),
+        ):
+            self._set_chat(embedding_id, chat_id)
+        self._synced = self._matrix.synced
+        self._sync()
+
+    def _set_chat(self, embedding_id: int, chat_id: str):
+        if embedding_id >= len(self._row_chats):
+            grown = np.full(2 * embedding_id, -1, dtype=np.int32)
+            grown[: len(self._row_chats)] = self._row_chats
+            self._row_chats = grown
+        code = self._chat_codes.setdefault(chat_id, len(self._chat_codes))
+        self._row_chats[embedding_id] = code
+
+    def _forget(self, ids):
+        """Leave embeddings ``ids`` out of searches and zero their rows."""
+        ids = np.asarray(ids, dtype=np.int64)
+        self._row_chats[ids[ids < len(self._row_chats)]] = -1
+        if self._matrix is not None:
+            self._matrix.rows[ids[ids < len(self._matrix.rows)]] = 0
+            self._matrix.rows.flush()
+
+    def _on_chat_deleted(self, chat_id: str):
+        with self._lock:
+            code = self._chat_codes.get(chat_id)
+            if code is not None:
+                self._forget(np.flatnonzero(self._row_chats == code))
+
+    def _sync(self):
+        """Read embeddings added since the last sync (by any process) into the matrix."""
+        rows = (
+            get_connection(self.db_path)
+            .execute(
+                """
+                SELECT id, chat_id, embedding FROM message_embeddings
+                WHERE embedder=? AND id>?
+                ORDER BY id
+                """,
+                (self.embedder_name, self._synced),
+            )
+            .fetchall()
+        )
+        if not rows:
+            return
+        vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, _, blob in rows])
+        if self._matrix is None:
+            self._matrix = MemoryMatrix(self.matrix_path, vectors.shape[1])
+            self._matrix.reset()
+        ids = np.array([embedding_id for embedding_id, _, _ in rows])
+        self._matrix.write(ids, vectors, int(ids[-1]))
+        for embedding_id, chat_id, _ in rows:
+            self._set_chat(embedding_id, chat_id)
+        self._synced = int(ids[-1])
+
+    def _on_saved(self, chat_id: str, message: ChatMessage):
+        if (
+            message.status == COMPLETE
+            and message.content
+            and not is_boilerplate(message)
+        ):
+            self.submit([(chat_id, message.message_id, message.content)])
+
+    def submit(self, messages: list[tuple[str, str, str]]):
+        """Queue (chat_id, message_id, content) for indexing; never blocks."""
+        with self._lock:
+            self._pending.extend(messages)
+            if self._draining:
+                return
+            self._draining = True
+        self._executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch = self._pending[:BATCH_SIZE]
+                del self._pending[:BATCH_SIZE]
+                if not batch:
+                    self._draining = False
+                    return
+            try:
+                self.index(batch)
+            except Exception as e:
+                # These messages stay unindexed until the next backfill
+                print(f"Indexing {len(batch)} messages failed: {e!r}", file=sys.stderr)
+                with self._lock:
+                    self._stats["errors"] += 1
+
+    def index(self, messages: list[tuple[str, str, str]]):
+        """Embed and store (chat_id, message_id, content) rows, then sync."""
+        with usage_tags(feature="memory"):
+            vectors = self.embedder([content[:EMBED_CHARS] for _, _, content in messages])
+        rows = [
+            (message_id, chat_id, self.embedder_name, vector.astype(np.float32).tobytes())
+            for (chat_id, message_id, _), vector in zip(messages, vectors)
+        ]
+        get_write_queue(self.db_path).submit(
+            lambda conn: conn.executemany(
+                """
+                INSERT OR IGNORE INTO message_embeddings
+                    (message_id, chat_id, embedder, embedding)
+                VALUES (?,?,?,?)
+                """,
+                rows,
+            )
+        ).result()
+        with self._lock:
+            self._sync()
+            self._stats["indexed"] += len(rows)
+
+    def purge(self):
+        """
+        Delete the embeddings of messages that are gone (chats deleted
+        before embeddings were deleted with them) or are boilerplate.
+        """
+        stale = [
+            (embedding_id,)
+            for (embedding_id,) in get_connection(self.db_path).execute(
+                f"""
+                SELECT e.id FROM message_embeddings e
+                LEFT JOIN messages m ON m.message_id = e.message_id
+                WHERE m.message_id IS NULL OR ({BOILERPLATE_SQL})
+                """,
+                (GREETING,),
+            )
+        ]
+        if not stale:
+            return
+        get_write_queue(self.db_path).submit(
+            lambda conn: conn.executemany(
+                "DELETE FROM message_embeddings WHERE id=?", stale
+            )
+        ).result()
+        with self._lock:
+            self._forget([embedding_id for (embedding_id,) in stale])
+
+    def backfill(self):
+        """Purge stale embeddings and queue every complete message that has
+        no embedding yet."""
+        self.purge()
+        rows = (
+            get_connection(self.db_path)
+            .execute(
+                f"""
+                SELECT m.chat_id, m.message_id, m.content
+                FROM messages m
+                LEFT JOIN message_embeddings e
+                    ON e.message_id = m.message_id AND e.embedder = ?
+                WHERE e.id IS NULL AND m.status = ? AND m.content != ''
+                    AND NOT ({BOILERPLATE_SQL})
+                ORDER BY m.rowid
+                """,
+                (self.embedder_name, COMPLETE, GREETING),
+            )
+            .fetchall()
+        )
+        if rows:
+            self.submit(rows)
+
+    def recall(self, text: str, chat_id: str | None = None) -> list[MemorySnippet]:
+        """The messages outside ``chat_id`` most similar to ``text``, best first."""
+        start = time.perf_counter()
+        with usage_tags(feature="memory"):
+            query = self.embedder([text[:EMBED_CHARS]])[0]
+        while True:
+            with self._lock:
+                self._sync()
+                if self._matrix is None:
+                    return []
+                valid = self._row_chats[: self._synced + 1] >= 0
+                if chat_id in self._chat_codes:
+                    valid &= (
+                        self._row_chats[: self._synced + 1]
+                        != self._chat_codes[chat_id]
+                    )
+                ids, scores = top_k(
+                    self._matrix.rows[: self._synced + 1], query, self.top_k, valid
+                )
+            scores_by_id = {
+                int(embedding_id): float(score)
+                for embedding_id, score in zip(ids, scores)
+                if score >= self.min_score
+            }
+            if not scores_by_id:
+                rows = []
+                break
+            placeholders = ",".join("?" * len(scores_by_id))
+            rows = (
+                get_connection(self.db_path)
+                .execute(
+                    f"""
+                    SELECT e.id, m.chat_id, c.name, m.message_id, m.sender, m.content
+                    FROM message_embeddings e
+                    JOIN messages m ON m.message_id = e.message_id
+                    JOIN chats c ON c.chat_id = m.chat_id
+                    WHERE e.id IN ({placeholders})
+                    """,
+                    list(scores_by_id),
+                )
+                .fetchall()
+            )
+            gone = set(scores_by_id) - {row[0] for row in rows}
+            if not gone:
+                break
+            # Deleted by another process; search again without them
+            with self._lock:
+                self._forget(list(gone))
+        memories = []
+        if rows:
+            memories = sorted(
+                (
+                    MemorySnippet(
+                        chat_id=row_chat,
+                        chat_name=name or "",
+                        message_id=message_id,
+                        sender=sender,
+                        content=content[:SNIPPET_CHARS],
+                        score=scores_by_id[embedding_id],
+                    )
+                    for embedding_id, row_chat, name, message_id, sender, content in rows
+                ),
+                key=lambda memory: -memory.score,
+            )
+        with self._lock:
+            self._stats["recalls"] += 1
+            self._stats["recalled"] += len(memories)
+            self._latencies.append(time.perf_counter() - start)
+        return memories
+
+    def stats(self) -> dict:
+        """Indexing counters and recall latency (embedding + search) percentiles."""
+        with self._lock:
+            latencies = np.array(self._latencies or [0.0]) * 1000
+            return {
+                **self._stats,
+                "pending": len(self._pending),
+                "rows": self._synced,
+                "recall_ms_p50": float(np.percentile(latencies, 50)),
+                "recall_ms_p95": float(np.percentile(latencies, 95)),
+            }
+
+
+@st.cache_resource
+def get_memory() -> ChatMemory:
+    """
+    Return this process's chat memory, indexing every message saved from
+    now on and, in the background, those saved before.
+    """
+    if EMBEDDER == "hashing":
+        memory = ChatMemory(HashingEmbedder(), "hashing")
+    else:
+        memory = ChatMemory(
+            OpenAIEmbedder(feature="memory"), f"openai:{EMBEDDING_MODEL}"
+        )
+    on_message_saved(memory._on_saved)
+    on_chat_deleted(memory._on_chat_deleted)
+    memory._executor.submit(memory.backfill)
+    return memory
+
+
+def start_memory():
+    """Start indexing saved messages, unless OPENAI_MEMORY turns memory off."""
+    if MEMORY_ENABLED:
+        get_memory()
+
+
+def recall_memories(text: str, chat_id: str) -> list[MemorySnippet]:
+    """Messages from other chats relevant to ``text``; none if recall fails."""
+    if not MEMORY_ENABLED or not text:
+        return []
+    try:
+        return get_memory().recall(text, chat_id)
+    except Exception as e:
+        # The question is still answered, only without other chats
+        print(f"Memory recall failed: {e!r}", file=sys.stderr)
+        return []
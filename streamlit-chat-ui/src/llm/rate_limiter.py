@@ -0,0 +1,282 @@
+"""
+Client-side requests-per-minute / tokens-per-minute limiter shared by every
+process using the same API key.
+
+Each model has two token buckets, refilled continuously at RPM/60 and
+TPM/60 per second and holding at most a minute's worth. Before a request is
+sent its token cost is estimated the way the API counts it for rate limits
+(prompt tokens + max_tokens) and taken from both buckets; if either is short
+the caller sleeps until enough has refilled instead of getting a 429. When
+the response arrives the estimate is corrected from its ``usage`` (or, for a
+stream without usage, from the number of chunks received).
+
+Bucket levels live in a small SQLite database updated under BEGIN IMMEDIATE,
+so Streamlit workers and batch jobs started from the same directory (or
+given the same OPENAI_RATE_LIMIT_DB) share one budget.
+
+RateLimitedTransport applies the limiter to every request sent through the
+shared pool in llm/client.py, SDK calls and raw posts alike.
+
+    OPENAI_RPM                 requests per minute per model (default 500)
+    OPENAI_TPM                 tokens per minute per model (default 30000)
+    OPENAI_RATE_LIMIT_DB       default rate_limits.db
+    OPENAI_RATE_LIMIT_MAX_WAIT seconds to wait before sending anyway (default 60)
+"""
+
+import json
+import math
+import os
+import re
+import time
+
+import httpx
+import streamlit as st
+from db.connection import get_connection
+from db.migrations import apply_migrations
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RPM = float(os.environ.get("OPENAI_RPM", 500))
+TPM = float(os.environ.get("OPENAI_TPM", 30_000))
+LIMITER_DB = os.environ.get("OPENAI_RATE_LIMIT_DB", "rate_limits.db")
+MAX_WAIT = float(os.environ.get("OPENAI_RATE_LIMIT_MAX_WAIT", 60))
+
+# Completion tokens reserved when a request doesn't set max_tokens.
+COMPLETION_ESTIMATE = 256
+
+# Tokens counted for an image part (a high-detail 1024x1024 image).
+IMAGE_TOKENS = 765
+
+# Overhead tokens per chat message (role, separators).
+MESSAGE_TOKENS = 4
+
+# Longest single sleep, so a refund from another process is noticed quickly.
+MAX_SLEEP = 1.0
+
+# The response tail that usage is looked for in.
+USAGE_TAIL = 8192
+
+_TOTAL_TOKENS = re.compile(rb'"total_tokens":\s*(\d+)')
+
+
+def create_buckets(conn):
+    """Migration 1: one row per (model, limit) bucket."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            level REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """
+    )
+
+
+MIGRATIONS = [create_buckets]
+
+
+def _text_tokens(text: str) -> int:
+    # About four characters per token for English text
+    return math.ceil(len(text) / 4)
+
+
+def estimate_prompt_tokens(body: dict) -> int:
+    """Estimate the input tokens of a chat or embeddings request body."""
+    tokens = 0
+    for message in body.get("messages") or []:
+        tokens += MESSAGE_TOKENS
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += _text_tokens(content)
+        for part in content if isinstance(content, list) else []:
+            if part.get("type") == "text":
+                tokens += _text_tokens(part.get("text", ""))
+            else:
+                tokens += IMAGE_TOKENS
+    for tool in body.get("tools") or []:
+        tokens += _text_tokens(json.dumps(tool))
+    embedding_input = body.get("input")
+    if isinstance(embedding_input, str):
+        embedding_input = [embedding_input]
+    for text in embedding_input or []:
+        tokens += _text_tokens(str(text))
+    return tokens
+
+
+def estimate_tokens(body: dict) -> int:
+    """Estimate what a request counts against TPM: input plus max output."""
+    tokens = estimate_prompt_tokens(body)
+    if "messages" in body:
+        tokens += (
+            body.get("max_completion_tokens")
+            or body.get("max_tokens")
+            or COMPLETION_ESTIMATE
+        )
+    return tokens
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        db_path: str = LIMITER_DB,
+        rpm: float = RPM,
+        tpm: float = TPM,
+        max_wait: float = MAX_WAIT,
+    ):
+        self.db_path = db_path
+        self.limits = {"requests": rpm, "tokens": tpm}
+        self.max_wait = max_wait
+        apply_migrations(get_connection(db_path), MIGRATIONS)
+
+    def _levels(self, conn, model: str, now: float) -> dict[str, float]:
+        """Current bucket levels for ``model``, refilled up to ``now``."""
+        levels = {}
+        for kind, limit in self.limits.items():
+            row = conn.execute(
+                "SELECT level, updated_at FROM buckets WHERE key=?",
+                (f"{kind}:{model}",),
+            ).fetchone()
+            if row is None:
+                levels[kind] = limit
+            else:
+                levels[kind] = min(limit, row[0] + (now - row[1]) * limit / 60)
+        return levels
+
+    def _save(self, conn, model: str, levels: dict[str, float], now: float):
+        conn.executemany(
+            "INSERT OR REPLACE INTO buckets (key, level, updated_at) VALUES (?,?,?)",
+            [(f"{kind}:{model}", level, now) for kind, level in levels.items()],
+        )
+
+    def _try_take(self, model: str, cost: dict[str, float], force: bool) -> float:
+        """Take ``cost`` if available (or regardless, with ``force``); else
+        return the seconds until it will be."""
+        conn = get_connection(self.db_path)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            levels = self._levels(conn, model, now)
+            wait = max(
+                (cost[kind] - levels[kind]) * 60 / self.limits[kind]
+                for kind in self.limits
+            )
+            if wait <= 0 or force:
+                self._save(
+                    conn,
+                    model,
+                    {kind: levels[kind] - cost[kind] for kind in self.limits},
+                    now,
+                )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return 0.0 if force else wait
+
+    def acquire(self, model: str, tokens: int):
+        """Block until one request and ``tokens`` tokens are available."""
+        # A request bigger than a whole bucket goes once the bucket is full
+        cost = {"requests": 1, "tokens": min(tokens, self.limits["tokens"])}
+        deadline = time.monotonic() + self.max_wait
+        while (wait := self._try_take(model, cost, force=False)) > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"Rate limiter: waited {self.max_wait}s for {model}, sending")
+                self._try_take(model, cost, force=True)
+                return
+            time.sleep(min(wait, remaining, MAX_SLEEP))
+
+    def settle(self, model: str, estimated: int, actual: int):
+        """Give back (or take more of) the tokens a request was estimated at."""
+        if estimated == actual:
+            return
+        conn = get_connection(self.db_path)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            levels = self._levels(conn, model, now)
+            levels["tokens"] = min(
+                self.limits["tokens"], levels["tokens"] + estimated - actual
+            )
+            self._save(conn, model, levels, now)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+class UsageStream(httpx.SyncByteStream):
+    """Pass a response body through and settle its tokens when it closes."""
+
+    def __init__(self, stream, limiter: RateLimiter, model: str, body: dict, status):
+        self.stream = stream
+        self.limiter = limiter
+        self.model = model
+        self.prompt_tokens = estimate_prompt_tokens(body)
+        self.estimated = min(estimate_tokens(body), limiter.limits["tokens"])
+        self.status = status
+        self.tail = b""
+        self.events = 0
+        self.settled = False
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.events += chunk.count(b"data:")
+            self.tail = (self.tail + chunk)[-USAGE_TAIL:]
+            yield chunk
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if not self.settled:
+                self.settled = True
+                self.limiter.settle(self.model, self.estimated, self.actual())
+
+    def actual(self) -> int:
+        if self.status >= 400:
+            # Rejected requests don't use tokens
+            return 0
+        match = _TOTAL_TOKENS.search(self.tail)
+        if match:
+            return int(match.group(1))
+        if self.events:
+            # Streamed without usage: roughly one token per chunk
+            return self.prompt_tokens + self.events
+        return self.estimated
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """httpx transport that runs every JSON POST through a RateLimiter."""
+
+    def __init__(self, transport: httpx.BaseTransport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = None
+        if request.method == "POST" and request.headers.get(
+            "content-type", ""
+        ).startswith("application/json"):
+            body = json.loads(request.read() or b"{}")
+        if body is None:
+            # Uploads (audio) and other calls: one request, tokens unknown
+            self.limiter.acquire("default", 0)
+            return self.transport.handle_request(request)
+        model = body.get("model", "default")
+        self.limiter.acquire(model, estimate_tokens(body))
+        response = self.transport.handle_request(request)
+        response.stream = UsageStream(
+            response.stream, self.limiter, model, body, response.status_code
+        )
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+@st.cache_resource
+def get_rate_limiter() -> RateLimiter:
+    """Return this process's handle on the shared rate limits."""
+    return RateLimiter()
@@ -0,0 +1,316 @@
+"""
+Retries with jittered backoff, and hedged streams, for the OpenAI calls of
+the chat apps.
+
+A call is retried only when the error says trying again can help: connection
+failures and timeouts, 408/409/429 and 5xx answers (a 429 for exhausted
+quota is not retried). The wait before retry n is drawn uniformly from
+[0, min(backoff_max, backoff_base * 2**n)] ("full jitter"), so clients that
+failed together don't come back together, and is never shorter than the
+server's retry-after header. Bad requests, auth errors and the like are
+raised at once.
+
+Streamed chat completions can also be hedged: if a stream hasn't produced
+its first chunk within the p95 time-to-first-chunk seen so far, the same
+request is sent again and whichever stream starts first is used; the other
+is closed. At most ``hedge_max_rate`` of the calls are hedged, so a slow API
+doesn't get twice the load. Only the start of a stream is retried or
+hedged; a stream that fails after its first chunk is cut off, and the chat
+apps offer to continue it (see checkpointed_stream in db/chat_store.py).
+
+The shared OpenAI client is created with ``max_retries=0`` so this layer is
+the only one retrying. Counters and latencies are in
+``get_resilience().stats()``.
+
+Configured from the environment (.env):
+
+    OPENAI_RETRIES            retries after the first attempt (default 3)
+    OPENAI_BACKOFF_BASE       seconds, first retry waits up to this (default 0.5)
+    OPENAI_BACKOFF_MAX        seconds, longest wait between attempts (default 20)
+    OPENAI_HEDGE              "1" to hedge streamed chat completions
+    OPENAI_HEDGE_MAX_RATE     fraction of calls that may be hedged (default 0.05)
+"""
+
+import contextvars
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterator
+
+import httpx
+import numpy as np
+import openai
+import streamlit as st
+from dotenv import load_dotenv
+from llm.client import get_openai_client
+
+load_dotenv()
+
+RETRIES = int(os.environ.get("OPENAI_RETRIES", 3))
+BACKOFF_BASE = float(os.environ.get("OPENAI_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.environ.get("OPENAI_BACKOFF_MAX", 20))
+HEDGE = os.environ.get("OPENAI_HEDGE", "0") == "1"
+HEDGE_MAX_RATE = float(os.environ.get("OPENAI_HEDGE_MAX_RATE", 0.05))
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# First-chunk latencies kept for the p95 hedge delay, and how many are
+# needed before hedging starts.
+TTFT_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+
+_EMPTY = object()
+
+
+def _status_of(error: BaseException) -> int | None:
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True for errors that another attempt may not get."""
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if getattr(error, "code", None) == "insufficient_quota":
+        return False
+    return _status_of(error) in RETRY_STATUSES
+
+
+def retry_after(response: httpx.Response | None) -> float:
+    """Seconds the server asked to wait (retry-after-ms / retry-after), or 0."""
+    if response is None:
+        return 0.0
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        return float(response.headers.get("retry-after", 0))
+    except ValueError:
+        # retry-after may also be an HTTP date; fall back to our own backoff
+        return 0.0
+
+
+def backoff_delay(
+    attempt: int,
+    base: float = BACKOFF_BASE,
+    cap: float = BACKOFF_MAX,
+    server_delay: float = 0.0,
+) -> float:
+    """Full-jitter exponential backoff before retry number ``attempt`` (0-based)."""
+    return max(server_delay, random.uniform(0, min(cap, base * 2**attempt)))
+
+
+def _close(stream):
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+
+class Resilience:
+    def __init__(
+        self,
+        retries: int = RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+        hedge: bool = HEDGE,
+        hedge_max_rate: float = HEDGE_MAX_RATE,
+    ):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_max_rate = hedge_max_rate
+        self._lock = threading.Lock()
+        self._ttft: deque[float] = deque(maxlen=TTFT_WINDOW)
+        self._stats = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _retry_or_raise(self, attempt: int, error: BaseException):
+        """Sleep before the next attempt, or re-raise ``error`` if it's final."""
+        if attempt >= self.retries or not is_retryable(error):
+            self._count("failures")
+            raise error
+        self._count("retries")
+        response = getattr(error, "response", None)
+        time.sleep(
+            backoff_delay(
+                attempt, self.backoff_base, self.backoff_max, retry_after(response)
+            )
+        )
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        ``fn(*args, **kwargs)`` with retries. An httpx.Response with a
+        retryable status is retried like an error, and returned as is once
+        the retries are used up.
+        """
+        self._count("calls")
+        for attempt in range(self.retries + 1):
+            self._count("attempts")
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self._retry_or_raise(attempt, e)
+                continue
+            if (
+                isinstance(result, httpx.Response)
+                and result.status_code in RETRY_STATUSES
+                and attempt < self.retries
+            ):
+                self._count("retries")
+                time.sleep(
+                    backoff_delay(
+                        attempt,
+                        self.backoff_base,
+                        self.backoff_max,
+                        retry_after(result),
+                    )
+                )
+                continue
+            return result
+
+    def hedge_delay(self) -> float | None:
+        """p95 time to first chunk, once enough streams have been seen."""
+        with self._lock:
+            if len(self._ttft) < HEDGE_MIN_SAMPLES:
+                return None
+            return float(np.percentile(self._ttft, 95))
+
+    def _take_hedge(self) -> bool:
+        """Count a hedge if that keeps hedges within ``hedge_max_rate``."""
+        with self._lock:
+            if self._stats["hedges"] + 1 > self.hedge_max_rate * self._stats["calls"]:
+                return False
+            self._stats["hedges"] += 1
+            return True
+
+    def _first_chunk(self, start: Callable) -> tuple:
+        """
+        Start a stream and wait for its first chunk, hedging with a second
+        stream when it's late. Returns (stream, iterator, first chunk).
+        """
+        results = queue.Queue()
+
+        def attempt(hedged: bool):
+            self._count("attempts")
+            started = time.perf_counter()
+            try:
+                stream = start()
+                iterator = iter(stream)
+                chunk = next(iterator, _EMPTY)
+            except Exception as e:
+                results.put((hedged, None, None, None, e))
+                return
+            with self._lock:
+                self._ttft.append(time.perf_counter() - started)
+            results.put((hedged, stream, iterator, chunk, None))
+
+        def launch(hedged: bool):
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(attempt, hedged),
+                daemon=True,
+            ).start()
+
+        def close_loser():
+            stream = results.get()[1]
+            if stream is not None:
+                _close(stream)
+
+        delay = self.hedge_delay() if self.hedge else None
+        started = time.monotonic()
+        launch(False)
+        pending = 1
+        error = None
+        while pending:
+            timeout = None
+            if delay is not None:
+                timeout = max(0.0, delay - (time.monotonic() - started))
+            try:
+                hedged, stream, iterator, chunk, error = results.get(timeout=timeout)
+            except queue.Empty:
+                delay = None
+                if self._take_hedge():
+                    launch(True)
+                    pending += 1
+                continue
+            pending -= 1
+            if error is None:
+                if hedged:
+                    self._count("hedge_wins")
+                if pending:
+                    threading.Thread(target=close_loser, daemon=True).start()
+                return stream, iterator, chunk
+            # Failed; a hedge still on its way may yet succeed
+            delay = None
+        raise error
+
+    def stream(self, start: Callable) -> Iterator:
+        """
+        Call ``start()`` (a function returning a stream) with retries and
+        hedging until a stream produces its first chunk, then return an
+        iterator over all of its chunks. Errors are raised here, as the SDK
+        raises them from create().
+        """
+        self._count("calls")
+        for attempt in range(self.retries + 1):
+            try:
+                stream, iterator, chunk = self._first_chunk(start)
+                break
+            except Exception as e:
+                self._retry_or_raise(attempt, e)
+
+        def chunks():
+            try:
+                if chunk is not _EMPTY:
+                    yield chunk
+                    yield from iterator
+            finally:
+                _close(stream)
+
+        return chunks()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            ttft = list(self._ttft)
+        stats["retry_rate"] = stats["retries"] / stats["calls"] if stats["calls"] else 0.0
+        stats["hedge_rate"] = stats["hedges"] / stats["calls"] if stats["calls"] else 0.0
+        if ttft:
+            stats["ttft_ms_p50"] = float(np.percentile(ttft, 50)) * 1000
+            stats["ttft_ms_p95"] = float(np.percentile(ttft, 95)) * 1000
+        return stats
+
+
+@st.cache_resource
+def get_resilience() -> Resilience:
+    """Return this process's retry/hedging policy and its metrics."""
+    return Resilience()
+
+
+def resilient_call(fn: Callable, *args, **kwargs):
+    """``fn(*args, **kwargs)`` with the shared retry policy."""
+    return get_resilience().call(fn, *args, **kwargs)
+
+
+def resilient_chat_completion(**request):
+    """client.chat.completions.create with retries; streams are also hedged."""
+    create = get_openai_client().chat.completions.create
+    if request.get("stream"):
+        return get_resilience().stream(lambda: create(**request))
+    return get_resilience().call(create, **request)
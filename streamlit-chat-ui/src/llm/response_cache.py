@@ -0,0 +1,351 @@
+"""
+Exact-match cache in front of ``client.chat.completions.create``.
+
+A request is keyed on everything that shapes the answer: model, messages,
+tools, response_format and the sampling parameters. By default only
+deterministic requests (temperature 0) are cached, since caching a
+temperature 1 request would replace fresh samples with one stored answer;
+the apps' text questions (ask_openai) are sent at temperature 0 for this.
+
+Answers are kept in two tiers: an in-memory LRU per process in front of a
+SQLite table shared by every process, each entry expiring after ``ttl``
+seconds. Disk writes go through the write-behind queue. A hit for a
+streamed request is replayed as a synthetic chunk stream, so
+response_generator() and st.write_stream() work the same on a hit and a
+miss. Only complete answers are stored: a stream that was cut off, or an
+answer that ended on ``length`` or ``content_filter``, is passed through
+but not cached.
+
+Configured from the environment (.env):
+
+    OPENAI_CACHE_DB            cache database, default response_cache.db
+    OPENAI_CACHE_TTL           seconds an answer is reused (default 86400)
+    OPENAI_CACHE_MAX_ENTRIES   answers kept in memory (default 512)
+    OPENAI_CACHE_ALL           "1" to cache non-zero temperatures too
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+import streamlit as st
+from db.connection import get_connection
+from db.migrations import apply_migrations
+from db.write_behind import get_write_queue
+from dotenv import load_dotenv
+from llm.singleflight import coalesced_chat_completion
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+load_dotenv()
+
+CACHE_DB = os.environ.get("OPENAI_CACHE_DB", "response_cache.db")
+TTL = float(os.environ.get("OPENAI_CACHE_TTL", 24 * 60 * 60))
+MAX_ENTRIES = int(os.environ.get("OPENAI_CACHE_MAX_ENTRIES", 512))
+CACHE_ALL = os.environ.get("OPENAI_CACHE_ALL", "0") == "1"
+
+# Request arguments that change the answer. Anything else (stream,
+# stream_options, timeout, extra_headers, ...) only changes how it arrives.
+KEY_FIELDS = (
+    "model",
+    "messages",
+    "tools",
+    "tool_choice",
+    "parallel_tool_calls",
+    "functions",
+    "function_call",
+    "response_format",
+    "temperature",
+    "top_p",
+    "max_tokens",
+    "max_completion_tokens",
+    "presence_penalty",
+    "frequency_penalty",
+    "logit_bias",
+    "stop",
+    "seed",
+    "n",
+)
+
+# Finish reasons of a complete answer; "length" and "content_filter" are not.
+COMPLETE_FINISH_REASONS = ("stop", "tool_calls")
+
+# Replayed streams are cut into word-sized pieces, close to token deltas.
+_PIECE = re.compile(r"\s*\S+|\s+")
+
+
+def create_response_cache(conn):
+    """Migration 1: cached answers by request key."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_responses_expires_at ON responses (expires_at)"
+    )
+
+
+MIGRATIONS = [create_response_cache]
+
+
+def _json_default(value):
+    # pydantic models (messages, response_format classes) and other SDK types
+    if hasattr(value, "model_json_schema"):
+        return value.model_json_schema()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return str(value)
+
+
+def cache_key(request: dict) -> str:
+    """SHA-256 of the canonical JSON of the answer-shaping request fields."""
+    fields = {name: request[name] for name in KEY_FIELDS if name in request}
+    canonical = json.dumps(
+        fields, sort_keys=True, separators=(",", ":"), default=_json_default
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def is_cacheable(request: dict, cache_all: bool = CACHE_ALL) -> bool:
+    if request.get("n", 1) != 1:
+        return False
+    return cache_all or request.get("temperature", 1) == 0
+
+
+def accumulate_chunks(chunks: list[ChatCompletionChunk]) -> dict:
+    """Assemble streamed chunks into the dict of a non-streamed ChatCompletion."""
+    content = []
+    tool_calls: dict[int, dict] = {}
+    finish_reason = None
+    usage = None
+    for chunk in chunks:
+        if chunk.usage is not None:
+            usage = chunk.usage.model_dump(mode="json")
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        finish_reason = choice.finish_reason or finish_reason
+        if choice.delta.content:
+            content.append(choice.delta.content)
+        for delta in choice.delta.tool_calls or []:
+            call = tool_calls.setdefault(
+                delta.index,
+                {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                },
+            )
+            if delta.id:
+                call["id"] = delta.id
+            if delta.function and delta.function.name:
+                call["function"]["name"] += delta.function.name
+            if delta.function and delta.function.arguments:
+                call["function"]["arguments"] += delta.function.arguments
+    first = chunks[0]
+    return {
+        "id": first.id,
+        "object": "chat.completion",
+        "created": first.created,
+        "model": first.model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": "".join(content) if content else None,
+                    "tool_calls": [tool_calls[i] for i in sorted(tool_calls)] or None,
+                },
+                # None when the stream ended before its last chunk
+                "finish_reason": finish_reason,
+            }
+        ],
+        "usage": usage,
+    }
+
+
+def replay_chunks(response: dict) -> Iterator[ChatCompletionChunk]:
+    """Stream a stored answer back as the chunks the API would have sent."""
+    choice = response["choices"][0]
+    message = choice["message"]
+
+    def chunk(delta: dict, finish_reason=None, usage=None) -> ChatCompletionChunk:
+        return ChatCompletionChunk.model_validate(
+            {
+                "id": response["id"],
+                "object": "chat.completion.chunk",
+                "created": response["created"],
+                "model": response["model"],
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+                "usage": usage,
+            }
+        )
+
+    yield chunk({"role": "assistant", "content": ""})
+    for piece in _PIECE.findall(message.get("content") or ""):
+        yield chunk({"content": piece})
+    for index, call in enumerate(message.get("tool_calls") or []):
+        yield chunk({"tool_calls": [{"index": index, **call}]})
+    yield chunk({}, finish_reason=choice["finish_reason"], usage=response.get("usage"))
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        db_path: str = CACHE_DB,
+        max_entries: int = MAX_ENTRIES,
+        ttl: float = TTL,
+        cache_all: bool = CACHE_ALL,
+    ):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_all = cache_all
+        # key -> (response dict, expires_at)
+        self._memory: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "stores": 0,
+            "bypassed": 0,
+        }
+        apply_migrations(get_connection(db_path), MIGRATIONS)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _remember(self, key: str, response: dict, expires_at: float):
+        with self._lock:
+            self._memory[key] = (response, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> dict | None:
+        """Look ``key`` up in memory, then on disk; None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+        row = (
+            get_connection(self.db_path)
+            .execute("SELECT response, expires_at FROM responses WHERE key=?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            self._count("misses")
+            return None
+        if row[1] <= now:
+            self._count("expired")
+            self._count("misses")
+            return None
+        response = json.loads(row[0])
+        self._remember(key, response, row[1])
+        self._count("disk_hits")
+        return response
+
+    def put(self, key: str, response: dict):
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, response, expires_at)
+        self._count("stores")
+        get_write_queue(self.db_path).submit(
+            lambda conn: conn.execute(
+                """
+                INSERT OR REPLACE INTO responses (key, response, created_at, expires_at)
+                VALUES (?,?,?,?)
+                """,
+                (key, json.dumps(response), now, expires_at),
+            )
+        )
+
+    def purge_expired(self) -> int:
+        """Delete expired answers from disk; returns how many were removed."""
+        return (
+            get_write_queue(self.db_path)
+            .submit(
+                lambda conn: conn.execute(
+                    "DELETE FROM responses WHERE expires_at <= ?", (time.time(),)
+                ).rowcount
+            )
+            .result()
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
+
+    def _store_stream(self, key: str, stream) -> Iterator[ChatCompletionChunk]:
+        """Pass a live stream through and store it once it has fully arrived."""
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        if not chunks:
+            return
+        response = accumulate_chunks(chunks)
+        if response["choices"][0]["finish_reason"] in COMPLETE_FINISH_REASONS:
+            self.put(key, response)
+
+    def create(self, create: Callable, **request):
+        """
+        Call ``create(**request)`` (e.g. client.chat.completions.create) unless
+        the answer is cached. Returns a ChatCompletion, or an iterator of
+        ChatCompletionChunk when ``stream=True``, in both cases.
+        """
+        if not is_cacheable(request, self.cache_all):
+            self._count("bypassed")
+            return create(**request)
+        key = cache_key(request)
+        response = self.get(key)
+        if response is not None:
+            if request.get("stream"):
+                return replay_chunks(response)
+            return ChatCompletion.model_validate(response)
+        if request.get("stream"):
+            return self._store_stream(key, create(**request))
+        completion = create(**request)
+        if completion.choices[0].finish_reason in COMPLETE_FINISH_REASONS:
+            self.put(key, completion.model_dump(mode="json"))
+        return completion
+
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Return this process's response cache."""
+    return ResponseCache()
+
+
+def cached_chat_completion(**request):
+    """
+    client.chat.completions.create through the response cache; misses are
+    coalesced with identical calls in flight and retried on failure.
+    """
+    return get_response_cache().create(coalesced_chat_completion, **request)
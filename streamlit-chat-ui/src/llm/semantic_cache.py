@@ -0,0 +1,434 @@
+"""
+Semantic cache for the chat path: reuse the answer to an earlier question
+that means the same thing ("how do I create a thread in python" / "python
+thread creation").
+
+Each answered single-turn question is embedded and kept in a local NumPy
+vector index, one per model. A new question is embedded and looked up
+there; if the most similar stored question scores at least ``threshold``
+(cosine similarity) its answer is returned instead of calling the API.
+Only answers that finished normally (``finish_reason="stop"``) are stored;
+a reply cut off by ``max_tokens``, a dropped stream or a filtered answer is
+not.
+Small indexes are searched by brute force; past ``ivf_threshold`` vectors an
+IVF index (k-means lists scanned over int8 codes, best candidates re-ranked
+exactly) keeps lookups sub-linear.
+
+Embedders are pluggable: anything that turns a list of strings into a
+float32 matrix of L2-normalised rows. OpenAIEmbedder calls the embeddings
+API; HashingEmbedder is deterministic and offline, for tests and
+benchmarks, and only catches paraphrases that share words.
+
+Configured from the environment (.env):
+
+    OPENAI_SEMANTIC_CACHE_DB        default semantic_cache.db
+    OPENAI_SEMANTIC_THRESHOLD       similarity needed for a hit (default 0.92)
+    OPENAI_SEMANTIC_EMBEDDER        "openai" (default) or "hashing"
+    OPENAI_EMBEDDING_MODEL          default text-embedding-3-small
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterator
+
+import numpy as np
+import streamlit as st
+from db.connection import get_connection
+from db.migrations import apply_migrations
+from db.write_behind import get_write_queue
+from dotenv import load_dotenv
+from llm.client import get_openai_client
+from llm.context import MEMORY_PREFIX, SYSTEM_PROMPT
+from llm.resilience import resilient_call
+from llm.response_cache import (
+    accumulate_chunks,
+    cached_chat_completion,
+    replay_chunks,
+)
+from llm.usage_ledger import usage_tags
+from openai.types.chat import ChatCompletion
+
+load_dotenv()
+
+CACHE_DB = os.environ.get("OPENAI_SEMANTIC_CACHE_DB", "semantic_cache.db")
+THRESHOLD = float(os.environ.get("OPENAI_SEMANTIC_THRESHOLD", 0.92))
+EMBEDDER = os.environ.get("OPENAI_SEMANTIC_EMBEDDER", "openai")
+EMBEDDING_MODEL = os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Index size at which brute force gives way to IVF.
+IVF_THRESHOLD = 20_000
+
+# IVF lists scanned per query, and candidates re-ranked with full vectors.
+NPROBE = 8
+RERANK = 16
+
+# Lookup latencies kept for the stats.
+LATENCY_WINDOW = 1000
+
+Embedder = Callable[[list[str]], np.ndarray]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-features embedding: words and character trigrams
+    hashed into ``dim`` signed buckets. Needs no model or network.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _features(self, text: str) -> list[str]:
+        words = re.findall(r"\w+", text.lower())
+        features = list(words)
+        for word in words:
+            padded = f"<{word}>"
+            features += [padded[i : i + 3] for i in range(len(padded) - 2)]
+        return features
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value >> 63 else -1.0
+                vectors[row, value % self.dim] += sign
+        return normalize(vectors)
+
+
+class OpenAIEmbedder:
+    def __init__(self, model: str = EMBEDDING_MODEL, feature: str = "semantic_cache"):
+        self.model = model
+        self.feature = feature  # Booked to this feature in the usage ledger
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        with usage_tags(feature=self.feature):
+            response = resilient_call(
+                get_openai_client().embeddings.create, model=self.model, input=texts
+            )
+        return normalize(np.array([item.embedding for item in response.data]))
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0):
+    """Spherical k-means: centroids are re-normalised, distance is -dot."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty clusters with random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Nearest-neighbour search over normalised vectors by dot product.
+
+    Vectors are appended to a float32 matrix grown by doubling. Below
+    ``ivf_threshold`` vectors a query is one matrix-vector product. Above it
+    the vectors are clustered (k-means, about sqrt(n) lists) and a query
+    only scans the ``nprobe`` closest lists, using int8 codes (a quarter of
+    the memory traffic), then re-ranks the best ``rerank`` exactly. The
+    clustering is redone whenever the index has doubled since it was built.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        ivf_threshold: int = IVF_THRESHOLD,
+        nprobe: int = NPROBE,
+        rerank: int = RERANK,
+    ):
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self._vectors = np.zeros((1024, dim), dtype=np.float32)
+        self._codes = np.zeros((1024, dim), dtype=np.int8)
+        self._scales = np.zeros(1024, dtype=np.float32)
+        self._size = 0
+        self._centroids: np.ndarray | None = None
+        self._lists: list[list[int]] = []
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, vector: np.ndarray) -> int:
+        """Append one vector and return its id (its position)."""
+        if self._size == len(self._vectors):
+            capacity = 2 * len(self._vectors)
+            self._vectors = np.resize(self._vectors, (capacity, self.dim))
+            self._codes = np.resize(self._codes, (capacity, self.dim))
+            self._scales = np.resize(self._scales, capacity)
+        vector_id = self._size
+        scale = max(float(np.abs(vector).max()), 1e-12) / 127
+        self._vectors[vector_id] = vector
+        self._codes[vector_id] = np.round(vector / scale).astype(np.int8)
+        self._scales[vector_id] = scale
+        self._size += 1
+        if self._size >= self.ivf_threshold and self._size >= 2 * self._trained_size:
+            self._train()
+        elif self._centroids is not None:
+            self._lists[int(np.argmax(self._centroids @ vector))].append(vector_id)
+        return vector_id
+
+    def _train(self):
+        vectors = self._vectors[: self._size]
+        k = max(1, int(np.sqrt(self._size)))
+        sample = vectors[
+            np.random.default_rng(0).choice(
+                self._size, min(self._size, 256 * k), replace=False
+            )
+        ]
+        self._centroids = kmeans(sample, k)
+        assignment = np.argmax(vectors @ self._centroids.T, axis=1)
+        self._lists = [[] for _ in range(k)]
+        for vector_id, list_id in enumerate(assignment):
+            self._lists[list_id].append(vector_id)
+        self._trained_size = self._size
+
+    def search(self, query: np.ndarray) -> tuple[int, float]:
+        """Return (id, similarity) of the closest vector, or (-1, -1.0) if empty."""
+        if self._size == 0:
+            return -1, -1.0
+        if self._centroids is None:
+            scores = self._vectors[: self._size] @ query
+            best = int(np.argmax(scores))
+            return best, float(scores[best])
+        probes = np.argsort(self._centroids @ query)[-self.nprobe :]
+        candidates = np.fromiter(
+            (i for p in probes for i in self._lists[p]), dtype=np.int64
+        )
+        if len(candidates) == 0:
+            return -1, -1.0
+        approx = (self._codes[candidates] @ query) * self._scales[candidates]
+        top = candidates[np.argsort(approx)[-self.rerank :]]
+        exact = self._vectors[top] @ query
+        best = int(np.argmax(exact))
+        return int(top[best]), float(exact[best])
+
+
+def create_semantic_cache(conn):
+    """Migration 1: answered questions with their embeddings."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model TEXT NOT NULL,
+            embedder TEXT NOT NULL,
+            question TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            answer TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """
+    )
+
+
+MIGRATIONS = [create_semantic_cache]
+
+
+def _is_boilerplate(message: dict) -> bool:
+    """A message that doesn't make a request multi-turn (llm/context.py)."""
+    content = message.get("content")
+    if message.get("role") == "system":
+        # The apps' system prompt, or the memories recalled from other chats
+        return content == SYSTEM_PROMPT or (
+            isinstance(content, str) and content.startswith(MEMORY_PREFIX)
+        )
+    # The greeting a chat is created with, before the user said anything
+    return message.get("role") == "assistant"
+
+
+def question_of(request: dict) -> str | None:
+    """
+    The question of a plain-text chat request with no earlier exchange,
+    else None.
+
+    The first turn of an app chat is sent as the system prompt, the chat's
+    stored greeting, recalled memories (llm/context.py) and the question;
+    only the question keys the cache. A summary, an earlier question or a
+    continuation makes the request multi-turn.
+    """
+    messages = request.get("messages") or []
+    if not messages or messages[-1].get("role") != "user":
+        return None
+    earlier = messages[:-1]
+    if not all(_is_boilerplate(message) for message in earlier):
+        return None
+    if sum(message.get("role") == "assistant" for message in earlier) > 1:
+        # More than the greeting: replies to turns not sent as text
+        return None
+    messages = messages[-1:]
+    if any(request.get(name) for name in ("tools", "functions", "response_format")):
+        return None
+    if request.get("n", 1) != 1:
+        return None
+    content = messages[0].get("content")
+    return content if isinstance(content, str) and content.strip() else None
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        embedder: Embedder,
+        embedder_name: str,
+        db_path: str = CACHE_DB,
+        threshold: float = THRESHOLD,
+        ivf_threshold: int = IVF_THRESHOLD,
+    ):
+        self.embedder = embedder
+        self.embedder_name = embedder_name
+        self.db_path = db_path
+        self.threshold = threshold
+        self.ivf_threshold = ivf_threshold
+        self._indexes: dict[str, VectorIndex] = {}
+        # (model, vector id) -> answer
+        self._answers: dict[tuple[str, int], str] = {}
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.hits = 0
+        self.misses = 0
+        conn = get_connection(db_path)
+        apply_migrations(conn, MIGRATIONS)
+        # Vectors from another embedder live in another space; skip them
+        for model, embedding, answer in conn.execute(
+            "SELECT model, embedding, answer FROM answers WHERE embedder=? ORDER BY id",
+            (embedder_name,),
+        ):
+            self._add(model, np.frombuffer(embedding, dtype=np.float32), answer)
+
+    def _add(self, model: str, vector: np.ndarray, answer: str):
+        index = self._indexes.get(model)
+        if index is None:
+            index = self._indexes[model] = VectorIndex(
+                len(vector), ivf_threshold=self.ivf_threshold
+            )
+        self._answers[(model, index.add(vector))] = answer
+
+    def lookup(self, model: str, question: str) -> tuple[str | None, np.ndarray]:
+        """Return (cached answer or None, the question's embedding)."""
+        start = time.perf_counter()
+        vector = self.embedder([question])[0]
+        with self._lock:
+            index = self._indexes.get(model)
+            vector_id, score = index.search(vector) if index else (-1, -1.0)
+            answer = (
+                self._answers[(model, vector_id)] if score >= self.threshold else None
+            )
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._latencies.append(time.perf_counter() - start)
+        return answer, vector
+
+    def store(self, model: str, question: str, vector: np.ndarray, answer: str):
+        with self._lock:
+            self._add(model, vector, answer)
+        get_write_queue(self.db_path).submit(
+            lambda conn: conn.execute(
+                """
+                INSERT INTO answers
+                    (model, embedder, question, embedding, answer, created_at)
+                VALUES (?,?,?,?,?,?)
+                """,
+                (
+                    model,
+                    self.embedder_name,
+                    question,
+                    vector.astype(np.float32).tobytes(),
+                    answer,
+                    time.time(),
+                ),
+            )
+        )
+
+    def stats(self) -> dict:
+        """Hit rate and lookup latency (embedding + search) percentiles."""
+        with self._lock:
+            latencies = np.array(self._latencies or [0.0]) * 1000
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._answers),
+                "lookup_ms_p50": float(np.percentile(latencies, 50)),
+                "lookup_ms_p95": float(np.percentile(latencies, 95)),
+            }
+
+    def _store_stream(self, model, question, vector, stream) -> Iterator:
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        if not chunks:
+            return
+        choice = accumulate_chunks(chunks)["choices"][0]
+        # Only answers that ended normally; not cut off, filtered or tool calls
+        if choice["finish_reason"] == "stop" and choice["message"]["content"]:
+            self.store(model, question, vector, choice["message"]["content"])
+
+    def create(self, create: Callable, **request):
+        """
+        Answer a single-turn question from the cache when a similar one was
+        answered before, else call ``create(**request)`` and remember the
+        answer. Returns what ``create`` would (a stream when ``stream=True``).
+        """
+        question = question_of(request)
+        if question is None:
+            return create(**request)
+        model = request["model"]
+        answer, vector = self.lookup(model, question)
+        if answer is not None:
+            response = {
+                "id": "chatcmpl-semantic-cache",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": answer},
+                        "finish_reason": "stop",
+                    }
+                ],
+            }
+            if request.get("stream"):
+                return replay_chunks(response)
+            return ChatCompletion.model_validate(response)
+        if request.get("stream"):
+            return self._store_stream(model, question, vector, create(**request))
+        completion = create(**request)
+        choice = completion.choices[0]
+        if choice.finish_reason == "stop" and choice.message.content:
+            self.store(model, question, vector, choice.message.content)
+        return completion
+
+
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    """Return this process's semantic cache, with the configured embedder."""
+    if EMBEDDER == "hashing":
+        return SemanticCache(HashingEmbedder(), "hashing")
+    return SemanticCache(OpenAIEmbedder(), f"openai:{EMBEDDING_MODEL}")
+
+
+def semantic_chat_completion(**request):
+    """Chat completion through the semantic cache, then the exact-match cache."""
+    return get_semantic_cache().create(cached_chat_completion, **request)
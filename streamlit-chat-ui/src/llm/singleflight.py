@@ -0,0 +1,154 @@
+"""
+Singleflight for chat completions: identical requests in flight at the same
+time share one upstream call.
+
+Streamlit reruns, double-clicks and several tabs open on the same chat
+easily send the same request twice within a second. The first caller starts
+the call; a caller with an identical request (same JSON body) that arrives
+before it has finished attaches to it instead of sending its own.
+
+A non-streamed call is simply awaited by everyone. A stream is read by a
+background thread into a shared chunk buffer, and every subscriber iterates
+the buffer with its own cursor: a late joiner first gets every chunk
+already received, then the live ones as they arrive. The upstream stream is
+read to the end even if the subscribers stop early, so one of them going
+away (a rerun) doesn't cut off the others. Once the call has finished the
+request leaves the table; later identical requests are new calls (or hits
+in the response caches above this layer).
+"""
+
+import contextvars
+import json
+import threading
+from concurrent.futures import Future
+from typing import Callable, Iterator
+
+import streamlit as st
+from llm.resilience import resilient_chat_completion
+
+
+def request_key(request: dict) -> str:
+    """Canonical JSON of the whole request; identical requests share a key."""
+    return json.dumps(request, sort_keys=True, separators=(",", ":"), default=repr)
+
+
+class Flight:
+    """The chunks of one in-flight stream, shared by its subscribers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.condition = threading.Condition()
+
+    def pump(self, create: Callable, request: dict, on_done: Callable):
+        """Read the upstream stream into the buffer (runs in its own thread)."""
+        try:
+            for chunk in create(**request):
+                with self.condition:
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            on_done()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def wait_started(self):
+        """Block until the first chunk arrives or the stream has ended."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.chunks or self.done)
+
+    def subscribe(self) -> Iterator:
+        """Every chunk from the first one, then live chunks until the end."""
+        cursor = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: cursor < len(self.chunks) or self.done
+                )
+                if cursor < len(self.chunks):
+                    chunk = self.chunks[cursor]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            cursor += 1
+            yield chunk
+
+
+class SingleFlight:
+    def __init__(self):
+        # request key -> Flight (streams) or Future (other calls)
+        self._in_flight: dict[str, Flight | Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    def _join(self, key: str, new: Callable):
+        """Return (in-flight entry for ``key``, True if this caller created it)."""
+        with self._lock:
+            self._stats["calls"] += 1
+            entry = self._in_flight.get(key)
+            if entry is not None:
+                self._stats["coalesced"] += 1
+                return entry, False
+            entry = self._in_flight[key] = new()
+            return entry, True
+
+    def _land(self, key: str):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def create(self, create: Callable, **request):
+        """
+        ``create(**request)``, or a share of the identical call already in
+        flight. Errors before the first chunk are raised here, like the SDK.
+        """
+        key = request_key(request)
+        if request.get("stream"):
+            flight, leader = self._join(key, Flight)
+            if leader:
+                # The request is sent from the pump thread; the caller's
+                # context carries its usage tags (llm/usage_ledger.py)
+                threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(flight.pump, create, request, lambda: self._land(key)),
+                    name="singleflight-stream",
+                    daemon=True,
+                ).start()
+            flight.wait_started()
+            if flight.error is not None and not flight.chunks:
+                raise flight.error
+            return flight.subscribe()
+        future, leader = self._join(key, Future)
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(create(**request))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self._land(key)
+        return future.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._in_flight)
+        stats["coalesced_rate"] = (
+            stats["coalesced"] / stats["calls"] if stats["calls"] else 0.0
+        )
+        return stats
+
+
+@st.cache_resource
+def get_singleflight() -> SingleFlight:
+    """Return this process's table of in-flight requests."""
+    return SingleFlight()
+
+
+def coalesced_chat_completion(**request):
+    """client.chat.completions.create (with retries), shared by identical calls."""
+    return get_singleflight().create(resilient_chat_completion, **request)
@@ -0,0 +1,460 @@
+"""
+Token usage and cost ledger for every OpenAI call of the chat apps.
+
+LedgerTransport sits in the shared pool (llm/client.py), so chat, vision,
+embedding, image and audio calls, SDK and raw posts alike, each append one
+row to the ``usage`` table when their response body is closed: endpoint,
+model, feature, chat id, status, prompt/completion/cached tokens, latency
+(request sent to last byte) and cost. Usage is read from the response
+(the last chunk of a stream sent with ``stream_options={"include_usage":
+True}``); a stream without it counts one completion token per chunk.
+
+Feature and chat id come from usage_tags(), a context manager around the
+code that sends the request; the feature defaults to the endpoint
+("chat", "embeddings", "images", "audio"):
+
+    with usage_tags(feature="vision", chat_id=chat_id):
+        response = post_chat_completion(payload)
+
+SQLite triggers fold each row into hourly, daily and per-chat rollups in
+the same transaction, so reports read a few rollup rows instead of
+scanning the ledger. Rows are written by the write-behind queue
+(db/write_behind.py) and never delay a response.
+
+The basics and prompt_engineering scripts keep thin writers of this
+ledger (their llm/usage_ledger.py): they append to the same ``usage``
+table and leave the rollups and reports to this module, which folds their
+rows in when it first opens their database.
+
+    OPENAI_USAGE_DB       default usage.db
+    OPENAI_USAGE_LEDGER   "0" to stop recording
+
+Run from streamlit-chat-ui/src for a report (``--db`` for a scripts'
+ledger, e.g. ../../basics/src/usage.db):
+    python -m llm.usage_ledger day
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+import streamlit as st
+from db.connection import get_connection
+from db.migrations import apply_migrations
+from db.write_behind import get_write_queue
+from dotenv import load_dotenv
+
+load_dotenv()
+
+USAGE_DB = os.environ.get("OPENAI_USAGE_DB", "usage.db")
+
+# USD per million tokens: (input, cached input, output).
+TOKEN_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4o-transcribe": (2.50, 2.50, 10.00),
+    "gpt-4o-mini-transcribe": (1.25, 1.25, 5.00),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.13, 0.0),
+}
+# USD per image (standard quality, 1024x1024).
+IMAGE_PRICES = {"dall-e-3": 0.04, "dall-e-2": 0.02}
+# USD per million input characters (text to speech).
+SPEECH_PRICES = {"tts-1": 15.0, "tts-1-hd": 30.0}
+# USD per minute of transcribed audio.
+AUDIO_MINUTE_PRICES = {"whisper-1": 0.006}
+
+# Bytes of the response kept to find the model (head) and usage (tail).
+HEAD_BYTES = 2048
+TAIL_BYTES = 8192
+
+ROLLUPS = {
+    "hour": "usage_hourly",
+    "day": "usage_daily",
+    "chat": "usage_by_chat",
+}
+
+_MODEL = re.compile(rb'"model":\s*"([^"]+)"')
+_FORM_MODEL = re.compile(rb'name="model"\r\n\r\n([^\r]+)')
+_COUNTS = {
+    name: re.compile(rb'"%s":\s*(\d+)' % name.encode())
+    for name in (
+        "prompt_tokens",
+        "completion_tokens",
+        "cached_tokens",
+        "input_tokens",
+        "output_tokens",
+    )
+}
+_SECONDS = re.compile(rb'"seconds":\s*([\d.]+)')
+
+_tags: ContextVar[dict] = ContextVar("usage_tags", default={})
+
+
+@contextmanager
+def usage_tags(**tags):
+    """Tag the calls made inside the block (``feature``, ``chat_id``)."""
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+# Columns every rollup row sums up.
+METRICS = (
+    "calls",
+    "errors",
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+    "latency_ms_total",
+    "cost_usd",
+)
+REAL_METRICS = {"latency_ms_total", "cost_usd"}
+
+
+def _create_rollup(conn, table: str, keys: tuple[str, ...]):
+    columns = [f"{key} TEXT NOT NULL" for key in keys] + [
+        f"{metric} {'REAL' if metric in REAL_METRICS else 'INTEGER'} NOT NULL"
+        for metric in METRICS
+    ]
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            {", ".join(columns)},
+            PRIMARY KEY ({", ".join(keys)})
+        ) WITHOUT ROWID
+    """
+    )
+
+
+def _rollup_upsert(table: str, keys: str, values: str) -> str:
+    """The trigger statement adding ``new`` (a ledger row) to a rollup row."""
+    return f"""
+        INSERT INTO {table} ({keys}, calls, errors, prompt_tokens,
+                             completion_tokens, cached_tokens,
+                             latency_ms_total, cost_usd)
+        VALUES ({values}, 1, new.status >= 400, new.prompt_tokens,
+                new.completion_tokens, new.cached_tokens, new.latency_ms,
+                coalesce(new.cost_usd, 0))
+        ON CONFLICT ({keys}) DO UPDATE SET
+            calls = calls + 1,
+            errors = errors + excluded.errors,
+            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+            completion_tokens = completion_tokens + excluded.completion_tokens,
+            cached_tokens = cached_tokens + excluded.cached_tokens,
+            latency_ms_total = latency_ms_total + excluded.latency_ms_total,
+            cost_usd = cost_usd + excluded.cost_usd;
+    """
+
+
+def _rollup_backfill(table: str, keys: str, values: str, where: str = "") -> str:
+    """The statement folding the rows already in the ledger into a rollup."""
+    return f"""
+        INSERT INTO {table} ({keys}, calls, errors, prompt_tokens,
+                             completion_tokens, cached_tokens,
+                             latency_ms_total, cost_usd)
+        SELECT {values}, count(*), sum(new.status >= 400),
+               sum(new.prompt_tokens), sum(new.completion_tokens),
+               sum(new.cached_tokens), sum(new.latency_ms),
+               coalesce(sum(new.cost_usd), 0)
+        FROM usage AS new {where}
+        GROUP BY {values}
+    """
+
+
+def create_ledger(conn):
+    """
+    Migration 1: the ledger, its rollups and the triggers feeding them.
+
+    The basics and prompt_engineering scripts only append to ``usage``; if
+    they wrote to this database first, their rows are folded into the new
+    rollups here, and the triggers take over from then on.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usage (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            endpoint TEXT NOT NULL,
+            model TEXT NOT NULL,
+            feature TEXT NOT NULL,
+            chat_id TEXT,
+            status INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            cached_tokens INTEGER NOT NULL,
+            latency_ms REAL NOT NULL,
+            cost_usd REAL
+        )
+    """
+    )
+    _create_rollup(conn, "usage_hourly", ("hour", "model", "feature"))
+    _create_rollup(conn, "usage_daily", ("day", "model", "feature"))
+    _create_rollup(conn, "usage_by_chat", ("chat_id", "model"))
+    rollups = {
+        "hourly": (
+            "usage_hourly",
+            "hour, model, feature",
+            "strftime('%Y-%m-%d %H:00', new.ts, 'unixepoch'), new.model, new.feature",
+        ),
+        "daily": (
+            "usage_daily",
+            "day, model, feature",
+            "date(new.ts, 'unixepoch'), new.model, new.feature",
+        ),
+        "by_chat": ("usage_by_chat", "chat_id, model", "new.chat_id, new.model"),
+    }
+    hourly = _rollup_upsert(*rollups["hourly"])
+    daily = _rollup_upsert(*rollups["daily"])
+    by_chat = _rollup_upsert(*rollups["by_chat"])
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS usage_rollups AFTER INSERT ON usage
+        BEGIN {hourly} {daily} END
+    """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS usage_chat_rollup AFTER INSERT ON usage
+        WHEN new.chat_id IS NOT NULL
+        BEGIN {by_chat} END
+    """
+    )
+    conn.execute(_rollup_backfill(*rollups["hourly"]))
+    conn.execute(_rollup_backfill(*rollups["daily"]))
+    conn.execute(
+        _rollup_backfill(*rollups["by_chat"], where="WHERE new.chat_id IS NOT NULL")
+    )
+
+
+MIGRATIONS = [create_ledger]
+
+
+def _price(prices: dict, model: str):
+    """The price of the longest-named model ``model`` is a version of."""
+    names = [name for name in prices if model.startswith(name)]
+    return prices[max(names, key=len)] if names else None
+
+
+def cost_of(
+    endpoint: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_tokens: int,
+    units: float = 0,
+) -> float | None:
+    """
+    USD cost of one call, or None for an unknown model. ``units`` are the
+    images generated, characters spoken or seconds transcribed.
+    """
+    if endpoint == "images":
+        price = _price(IMAGE_PRICES, model)
+        return price * units if price is not None else None
+    if endpoint == "audio" and _price(SPEECH_PRICES, model) is not None:
+        return _price(SPEECH_PRICES, model) * units / 1e6
+    if endpoint == "audio" and _price(AUDIO_MINUTE_PRICES, model) is not None:
+        # Unknown unless the response reports the audio's duration
+        return _price(AUDIO_MINUTE_PRICES, model) * units / 60 if units else None
+    prices = _price(TOKEN_PRICES, model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1e6
+
+
+def endpoint_of(path: str) -> str:
+    for endpoint in ("chat", "embeddings", "images", "audio"):
+        if f"/{endpoint}/" in path or path.endswith(f"/{endpoint}"):
+            return endpoint
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class UsageLedger:
+    def __init__(self, db_path: str = USAGE_DB):
+        self.db_path = db_path
+        apply_migrations(get_connection(db_path), MIGRATIONS)
+
+    def record(self, **row):
+        """Queue one ledger row; the rollups follow in the same commit."""
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        values = tuple(row.values())
+        get_write_queue(self.db_path).submit(
+            lambda conn: conn.execute(
+                f"INSERT INTO usage ({columns}) VALUES ({placeholders})", values
+            )
+        )
+
+    def rollup(self, by: str = "day", limit: int = 50) -> list[dict]:
+        """The newest rows of a rollup (``by`` hour, day or chat)."""
+        table = ROLLUPS[by]
+        order = "cost_usd DESC" if by == "chat" else f"{by} DESC"
+        cursor = get_connection(self.db_path).execute(
+            f"SELECT * FROM {table} ORDER BY {order} LIMIT ?", (limit,)
+        )
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class LedgerStream(httpx.SyncByteStream):
+    """Pass a response body through and record its usage when it closes."""
+
+    def __init__(self, stream, ledger: UsageLedger, call: dict, parse: bool):
+        self.stream = stream
+        self.ledger = ledger
+        self.call = call
+        self.parse = parse
+        self.head = b""
+        self.tail = b""
+        self.events = 0
+        self.recorded = False
+
+    def __iter__(self):
+        for chunk in self.stream:
+            if self.parse:
+                if len(self.head) < HEAD_BYTES:
+                    self.head += chunk[: HEAD_BYTES - len(self.head)]
+                self.events += chunk.count(b"data:")
+                self.tail = (self.tail + chunk)[-TAIL_BYTES:]
+            yield chunk
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if not self.recorded:
+                self.recorded = True
+                self._record()
+
+    def _count(self, name: str) -> int:
+        match = _COUNTS[name].search(self.tail)
+        return int(match.group(1)) if match else 0
+
+    def _record(self):
+        call = self.call
+        latency_ms = (time.perf_counter() - call.pop("started")) * 1000
+        units = call.pop("units")
+        model = call.pop("model")
+        match = _MODEL.search(self.head) or _MODEL.search(self.tail)
+        if match:
+            # The exact (dated) model that answered
+            model = match.group(1).decode()
+        prompt = self._count("prompt_tokens") or self._count("input_tokens")
+        completion = self._count("completion_tokens") or self._count(
+            "output_tokens"
+        )
+        if not completion and self.events > 1 and call["status"] < 400:
+            # Streamed without usage: about one token per chunk
+            completion = self.events - 1
+        cached = self._count("cached_tokens")
+        seconds = _SECONDS.search(self.tail)
+        if seconds:
+            units = float(seconds.group(1))
+        self.ledger.record(
+            **call,
+            model=model,
+            prompt_tokens=prompt,
+            completion_tokens=completion,
+            cached_tokens=cached,
+            latency_ms=round(latency_ms, 1),
+            cost_usd=(
+                cost_of(call["endpoint"], model, prompt, completion, cached, units)
+                if call["status"] < 400
+                else 0.0
+            ),
+        )
+
+
+class LedgerTransport(httpx.BaseTransport):
+    """httpx transport that records every response in a UsageLedger."""
+
+    def __init__(self, transport: httpx.BaseTransport, ledger: UsageLedger):
+        self.transport = transport
+        self.ledger = ledger
+
+    def _describe(self, request: httpx.Request, endpoint: str) -> tuple[str, float]:
+        """The requested model and the billed units (images, characters)."""
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            match = _FORM_MODEL.search(request.read())
+            return (match.group(1).decode() if match else "unknown"), 0
+        if endpoint not in ("images", "audio") or request.method != "POST":
+            # Chat and embedding responses name their model
+            return "unknown", 0
+        body = json.loads(request.read() or b"{}")
+        model = body.get("model") or ("dall-e-2" if endpoint == "images" else "")
+        if endpoint == "images":
+            return model, body.get("n", 1)
+        return model or "unknown", len(body.get("input", ""))
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "HEAD":
+            return self.transport.handle_request(request)
+        endpoint = endpoint_of(request.url.path)
+        model, units = self._describe(request, endpoint)
+        tags = _tags.get()
+        started = time.perf_counter()
+        response = self.transport.handle_request(request)
+        content_type = response.headers.get("content-type", "")
+        response.stream = LedgerStream(
+            response.stream,
+            self.ledger,
+            {
+                "started": started,
+                "ts": time.time(),
+                "endpoint": endpoint,
+                "feature": tags.get("feature", endpoint),
+                "chat_id": tags.get("chat_id"),
+                "status": response.status_code,
+                "model": model,
+                "units": units,
+            },
+            parse="json" in content_type or "event-stream" in content_type,
+        )
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+@st.cache_resource
+def get_usage_ledger() -> UsageLedger:
+    """Return this process's handle on the usage ledger."""
+    return UsageLedger()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print token usage and cost rollups from the usage ledger."
+    )
+    parser.add_argument("by", choices=list(ROLLUPS), nargs="?", default="day")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--db", default=USAGE_DB)
+    args = parser.parse_args()
+    for row in UsageLedger(args.db).rollup(args.by, args.limit):
+        key = " ".join(str(row[column]) for column in row if column not in METRICS)
+        print(
+            f"{key:<50} {row['calls']:>6} calls {row['errors']:>4} errors "
+            f"{row['prompt_tokens']:>9} in ({row['cached_tokens']} cached) "
+            f"{row['completion_tokens']:>8} out "
+            f"{row['latency_ms_total'] / row['calls']:8.0f} ms avg "
+            f"${row['cost_usd']:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
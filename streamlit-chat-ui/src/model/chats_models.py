@@ -1,6 +1,56 @@
-from pydantic import BaseModel
+import uuid
+
+from pydantic import BaseModel, Field
 
 
 class ChatMessage(BaseModel):
-    sender: str
+    sender: str  # BOT, USER
+    content: str
+    message_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    # Uploaded files live in the attachment store (db/attachment_store.py);
+    # a message only keeps their SHA-256 and MIME type.
+    image_sha256: str | None = None
+    image_mime: str | None = None
+    audio_sha256: str | None = None
+    audio_mime: str | None = None
+    status: str = "complete"  # "streaming" while a bot reply is being generated
+    token_count: int | None = None  # Counted when saved (db/chat_store.py)
+
+
+class ChatSummary(BaseModel):
+    """Rolling summary of a chat's messages ``first_seq``..``last_seq``."""
+
+    chat_id: str
+    first_seq: int
+    last_seq: int
+    last_message_id: str  # Newest message the summary covers
     content: str
+    token_count: int  # Counted once by llm/context.py
+
+
+class SearchHit(BaseModel):
+    message_id: str
+    chat_id: str
+    chat_name: str
+    seq: int
+    sender: str
+    snippet: str  # Matching excerpt with the matched terms in **bold**
+
+
+class MemorySnippet(BaseModel):
+    """A message from another chat recalled by llm/memory.py."""
+
+    chat_id: str
+    chat_name: str
+    message_id: str
+    sender: str
+    content: str  # Cut to llm/memory.SNIPPET_CHARS
+    score: float  # Cosine similarity to the question
+
+
+class Conversation(BaseModel):
+    chat_id: str
+    messages: list[ChatMessage]  # Loaded messages, oldest to newest
+    # Cursor for the next older page (see load_messages_page), None when the
+    # whole chat is loaded
+    older_cursor: int | None = None
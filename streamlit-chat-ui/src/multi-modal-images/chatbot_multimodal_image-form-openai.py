@@ -1,14 +1,26 @@
 import base64
 import os
 import sqlite3
+import sys
 import uuid
 from typing import Optional
 
-import requests
 import streamlit as st
-from openai import OpenAI
 from pydantic import BaseModel
 
+# The shared modules (llm/, db/) live in src/, one level up from this app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.attachment_store import (  # noqa: E402
+    ATTACHMENT_DIR,
+    add_ref,
+    attachment_path,
+    guess_mime_type,
+    init_attachments,
+    open_attachment,
+    save_attachment,
+)
+from llm.client import get_openai_client, post_chat_completion  # noqa: E402
+
 
 # Function to initialize the database schema
 def init_db():
@@ -32,11 +44,20 @@ def init_db():
             FOREIGN KEY(chat_id) REFERENCES chat_history(id)  -- Reference to chat_history table
         )
     """)
+    # Reference counts of the uploaded images (db/attachment_store.py)
+    init_attachments(conn)
     conn.commit()
     conn.close()
     print("Database initialized successfully.")
 
 
+def stored_image_sha256(image_path):
+    """The hash of an image in the attachment store; None for older uploads."""
+    if image_path and os.path.dirname(os.path.dirname(image_path)) == ATTACHMENT_DIR:
+        return os.path.basename(image_path)
+    return None
+
+
 # Function to save a chat and its messages to the database
 def save_chat_to_db(chat_id, chat_name, messages):
     if not messages:  # Skip if there are no messages to save
@@ -55,8 +76,12 @@ def save_chat_to_db(chat_id, chat_name, messages):
             (chat_id, chat_name),
         )
         print(f"Chat {chat_name} with ID {chat_id} saved to database.")
-        # Save individual messages
-        for message in messages:
+        # The whole chat is passed on every save; only the messages added
+        # since the last one are inserted (and take a reference to their image)
+        saved = cursor.execute(
+            "SELECT COUNT(*) FROM messages WHERE chat_id = ?", (chat_id,)
+        ).fetchone()[0]
+        for message in messages[saved:]:
             cursor.execute(
                 """
                 INSERT INTO messages (chat_id, sender, content, image_path)
@@ -64,13 +89,18 @@ def save_chat_to_db(chat_id, chat_name, messages):
                 """,
                 (chat_id, message.sender, message.content, message.image_path),
             )
+            sha256 = stored_image_sha256(message.image_path)
+            if sha256:
+                with open_attachment(sha256) as f:
+                    add_ref(conn, sha256, guess_mime_type(f.read(16), "image/jpeg"))
             print(
                 f"Message from {message.sender} saved: {message.content or 'Image message'}"
             )
+        conn.commit()
     except Exception as e:
+        conn.rollback()
         print(f"Error saving chat to DB: {e}")
     finally:
-        conn.commit()
         conn.close()
 
 
@@ -99,10 +129,6 @@ def load_chats_from_db():
     return result
 
 
-# Ensure the directory for uploaded images exists
-os.makedirs("uploaded_images", exist_ok=True)
-print("Directory for uploaded images ensured.")
-
 # Initialize the database at the start of the application
 init_db()
 
@@ -112,6 +138,7 @@ class ChatMessage(BaseModel):
     sender: str  # Sender of the message (user or bot)
     content: Optional[str] = None  # Text content of the message, can be None
     image_path: Optional[str] = None  # Path to the image file if an image is uploaded
+    # (attachments/<xx>/<sha256>; uploaded_images/<uuid>_<name> in older chats)
 
 
 # Constants for identifying the sender
@@ -120,7 +147,7 @@ BOT = "bot"
 
 # Set up the OpenAI client and model to be used
 LLM = "gpt-4o"
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 
 # Set up the main header of the Streamlit app
 st.header("Chat :blue[Application]")
@@ -156,11 +183,6 @@ def ask_openai_image(
     """Send a question and optional image to OpenAI and receive a response."""
     try:
         print(f"Sending question to OpenAI with image: {image_path}")
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
-        }
-
         payload = {
             "model": "gpt-4o-mini",
             "messages": [
@@ -181,9 +203,8 @@ def ask_openai_image(
             "temperature": temperature,
         }
 
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions", headers=headers, json=payload
-        )
+        # Sent over the shared connection pool instead of a new connection
+        response = post_chat_completion(payload)
 
         print(f"Response type: {type(response)}")
         return response
@@ -322,10 +343,9 @@ def run():
                 )
 
             if uploaded_file:
-                # Save the uploaded image locally
-                file_path = f"uploaded_images/{uuid.uuid4()}_{uploaded_file.name}"
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.read())
+                # Save the uploaded image in the content-addressed store, so
+                # the same image uploaded twice is kept once
+                file_path = attachment_path(save_attachment(uploaded_file))
                 print(f"Uploaded file saved to: {file_path}")
                 st.session_state.current_chat.append(
                     ChatMessage(
@@ -1,12 +1,16 @@
 import os
 import sqlite3
+import sys
 import uuid
 from typing import Optional
 
 import streamlit as st
-from openai import OpenAI
 from pydantic import BaseModel
 
+# The shared modules (llm/, db/) live in src/, one level up from this app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm.client import get_openai_client  # noqa: E402
+
 
 # Function to initialize the database schema
 def init_db():
@@ -126,7 +130,7 @@ if "active_chat_id" not in st.session_state:
 
 # Set up the OpenAI client and model to be used
 LLM = "gpt-4o"
-client = OpenAI()
+client = get_openai_client()  # Shared, pooled client (llm/client.py)
 
 # Sidebar configuration for managing chats
 with st.sidebar: